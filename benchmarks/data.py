@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+NAMES = [
+    "alice",
+    "bob",
+    "charlie",
+    "diana",
+    "eric",
+    "fiona",
+    "george",
+    "hannah",
+    "ian",
+    "julia",
+    "kevin",
+    "laura",
+    "michael",
+    "nina",
+    "oscar",
+    "paula",
+    "quentin",
+    "rachel",
+    "steve",
+    "tina",
+]
+CITIES = [
+    "New York",
+    "Los Angeles",
+    "Chicago",
+    "Houston",
+    "Phoenix",
+    "Seattle",
+    "Denver",
+    "Boston",
+    "Austin",
+    "Portland",
+    "Columbus",
+    "Miami",
+]
+# Share of missing scores, as in examples/testdata.csv
+MISSING_SCORES = 0.15
+
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    # Same columns and dtypes as examples/testdata.csv
+    rng = np.random.default_rng(seed)
+    score = rng.uniform(50, 100, rows).round(1)
+    score[rng.random(rows) < MISSING_SCORES] = np.nan
+    names = np.array(NAMES, dtype=object)
+    cities = np.array(CITIES, dtype=object)
+    return pd.DataFrame(
+        {
+            "name": names[rng.integers(len(names), size=rows)],
+            "age": rng.integers(18, 66, size=rows),
+            "city": cities[rng.integers(len(cities), size=rows)],
+            "score": score,
+        }
+    )
+
+
+def make_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode()
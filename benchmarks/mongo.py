@@ -0,0 +1,109 @@
+import copy
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+# In-memory stand-in for the parts of the motor client the app uses, so the
+# endpoints can be benchmarked without a MongoDB server
+
+_OPERATORS = {
+    "$in": lambda value, arg: value in arg,
+    "$gt": lambda value, arg: value is not None and value > arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+}
+
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for key, cond in query.items():
+        value = doc.get(key)
+        if isinstance(cond, dict) and cond and all(op in _OPERATORS for op in cond):
+            if not all(_OPERATORS[op](value, arg) for op, arg in cond.items()):
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+@dataclass
+class Result:
+    inserted_id: Any = None
+    matched_count: int = 0
+    modified_count: int = 0
+    deleted_count: int = 0
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self.docs = docs
+
+    def __aiter__(self):
+        self._iter = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return self.docs[:length]
+
+
+class MemoryCollection:
+    def __init__(self):
+        self.docs: List[Dict[str, Any]] = []
+
+    async def create_index(self, *args, **kwargs):
+        return None
+
+    async def find_one(self, query, *args, **kwargs):
+        for doc in self.docs:
+            if matches(doc, query):
+                return copy.deepcopy(doc)
+        return None
+
+    def find(self, query=None, *args, **kwargs):
+        docs = [doc for doc in self.docs if matches(doc, query or {})]
+        return MemoryCursor(copy.deepcopy(docs))
+
+    async def count_documents(self, query):
+        return sum(matches(doc, query) for doc in self.docs)
+
+    async def insert_one(self, doc):
+        self.docs.append(copy.deepcopy(doc))
+        return Result(inserted_id=len(self.docs))
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(copy.deepcopy(update.get("$set", {})))
+                return Result(matched_count=1, modified_count=1)
+        if upsert:
+            self.docs.append({**query, **copy.deepcopy(update.get("$set", {}))})
+        return Result()
+
+    async def delete_one(self, query):
+        for i, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[i]
+                return Result(deleted_count=1)
+        return Result()
+
+
+class MemoryDatabase(dict):
+    def __missing__(self, name: str) -> MemoryCollection:
+        self[name] = MemoryCollection()
+        return self[name]
+
+
+class MemoryClient:
+    def __init__(self, *args, **kwargs):
+        self.databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.databases.setdefault(name, MemoryDatabase())
+
+    def close(self):
+        pass
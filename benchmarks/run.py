@@ -0,0 +1,341 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.models import TransformStep
+from src.routes.utils import execute_pipeline, run_step, safe_dict
+from src.transformer import TransformerRegistry, register_builtin_transformers
+
+from .data import make_csv, make_frame
+
+SUITES = ["transformers", "pipeline", "serialize", "endpoints"]
+
+# Args each builtin transformer is timed with
+TRANSFORMER_ARGS: Dict[str, Dict[str, Any]] = {
+    "filter": {"condition": "score > 75"},
+    "rename": {"from": "name", "to": "first_name"},
+    "uppercase": {"column": "name"},
+    "drop": {"columns": ["city"]},
+    "fillna": {"column": "score", "value": 0},
+    "sort": {"by": "score", "ascending": False},
+    "limit": {"n": 100},
+    "head": {"n": 100},
+    "topk": {"by": "score", "n": 100, "ascending": False},
+    "sample": {"n": 100},
+}
+
+PIPELINE = [
+    {"name": "filter", "args": {"condition": "age >= 30"}},
+    {"name": "fillna", "args": {"column": "score", "value": 0}},
+    {"name": "uppercase", "args": {"column": "city"}},
+    {"name": "sort", "args": {"by": "score", "ascending": False}},
+    {"name": "rename", "args": {"from": "name", "to": "first_name"}},
+]
+
+
+class Benchmark:
+    def __init__(
+        self,
+        name: str,
+        rows: int,
+        func: Callable[[Any], Any],
+        setup: Callable[[], Any] = lambda: None,
+    ):
+        self.name = name
+        self.rows = rows
+        # Runs once per repetition, untimed; its result is passed to func
+        self.setup = setup
+        self.func = func
+
+    def run(self, repeat: int) -> Dict[str, Any]:
+        times = []
+        for _ in range(repeat):
+            arg = self.setup()
+            start = time.perf_counter()
+            self.func(arg)
+            times.append(time.perf_counter() - start)
+
+        # Peak memory is taken on a separate run, since tracing allocations
+        # slows the code down. It counts what func allocates on top of the
+        # memory in use when it starts.
+        arg = self.setup()
+        tracemalloc.start()
+        try:
+            self.func(arg)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "name": self.name,
+            "rows": self.rows,
+            "repeat": repeat,
+            "min_seconds": min(times),
+            "median_seconds": statistics.median(times),
+            "rows_per_second": self.rows / min(times) if min(times) else None,
+            "peak_bytes": peak,
+        }
+
+
+def transformer_benchmarks(
+    df: pd.DataFrame, registry: TransformerRegistry
+) -> Iterator[Benchmark]:
+    for name in registry.list_available():
+        if name not in TRANSFORMER_ARGS:
+            print(f"skipping transformer without benchmark args: {name}")
+            continue
+        transformer = registry.get(name)
+        yield Benchmark(
+            f"transformer/{name}",
+            len(df),
+            lambda frame, name=name, transformer=transformer: run_step(
+                name, transformer, frame, TRANSFORMER_ARGS[name]
+            ),
+            # Some transformers write to the frame they are given
+            setup=df.copy,
+        )
+
+
+def pipeline_benchmarks(
+    df: pd.DataFrame, registry: TransformerRegistry
+) -> Iterator[Benchmark]:
+    pipeline = [TransformStep(**step) for step in PIPELINE]
+    yield Benchmark(
+        "pipeline/execute_pipeline",
+        len(df),
+        lambda frame: execute_pipeline(pipeline, frame, registry),
+        setup=df.copy,
+    )
+
+
+def serialize_benchmarks(df: pd.DataFrame) -> Iterator[Benchmark]:
+    yield Benchmark(
+        "serialize/safe_dict",
+        len(df),
+        safe_dict,
+        setup=lambda: df.to_dict(orient="records"),
+    )
+
+
+def endpoint_benchmarks(df: pd.DataFrame, client, headers) -> Iterator[Benchmark]:
+    # Bodies are encoded up front so only the server side is timed. The result
+    # cache is bypassed so every repetition runs the pipeline.
+    body = json.dumps(
+        {"data": safe_dict(df.to_dict(orient="records")), "pipeline": PIPELINE}
+    ).encode()
+    csv = make_csv(df)
+    pipeline = json.dumps(PIPELINE)
+
+    def post_json(_):
+        response = client.post(
+            "/transform/?cache=false",
+            content=body,
+            headers={**headers, "Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+
+    def post_file(_):
+        response = client.post(
+            "/transform/file?cache=false",
+            files={"file": ("data.csv", csv, "text/csv")},
+            data={"pipeline": pipeline},
+            headers=headers,
+        )
+        response.raise_for_status()
+
+    yield Benchmark("endpoint/transform", len(df), post_json)
+    yield Benchmark("endpoint/transform_file", len(df), post_file)
+
+
+def start_app():
+    # The app runs in-process against an in-memory MongoDB, with the rate
+    # limit and admission control off
+    import main
+    from fastapi.testclient import TestClient
+
+    from src.config import ADMIN_PASSWORD, ADMIN_USERNAME
+    from src.rate_limiter import limiter
+
+    from .mongo import MemoryClient
+
+    main.AsyncIOMotorClient = MemoryClient
+    limiter.enabled = False
+    client = TestClient(main.app)
+    client.__enter__()
+    main.app.state.admission.rate = 0
+    main.app.state.admission.max_concurrent = 0
+    response = client.post(
+        "/auth/login", data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD}
+    )
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return client, headers
+
+
+def run_benchmarks(
+    sizes: List[int],
+    suites: List[str],
+    repeat: int,
+    endpoint_max_rows: int,
+    match: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    registry = TransformerRegistry()
+    register_builtin_transformers(registry)
+    client = headers = None
+    if "endpoints" in suites and any(rows <= endpoint_max_rows for rows in sizes):
+        client, headers = start_app()
+
+    results = []
+    try:
+        for rows in sizes:
+            df = make_frame(rows)
+            benchmarks: List[Benchmark] = []
+            if "transformers" in suites:
+                benchmarks.extend(transformer_benchmarks(df, registry))
+            if "pipeline" in suites:
+                benchmarks.extend(pipeline_benchmarks(df, registry))
+            if "serialize" in suites:
+                benchmarks.extend(serialize_benchmarks(df))
+            if client is not None and rows <= endpoint_max_rows:
+                benchmarks.extend(endpoint_benchmarks(df, client, headers))
+
+            for benchmark in benchmarks:
+                if match and match not in benchmark.name:
+                    continue
+                result = benchmark.run(repeat)
+                print(format_result(result), flush=True)
+                results.append(result)
+    finally:
+        if client is not None:
+            client.__exit__(None, None, None)
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    return (
+        f"{result['name']:<32} {result['rows']:>10} rows "
+        f"{result['min_seconds'] * 1000:>11.2f} ms "
+        f"{result['peak_bytes'] / 2**20:>9.1f} MiB"
+    )
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], threshold: float
+) -> List[str]:
+    # A benchmark regresses when its best time or its peak memory grows by
+    # more than the threshold over the baseline run of the same size
+    previous: Dict[Tuple[str, int], Dict[str, Any]] = {
+        (result["name"], result["rows"]): result for result in baseline
+    }
+    regressions = []
+    for result in results:
+        base = previous.get((result["name"], result["rows"]))
+        if base is None:
+            continue
+        for key in ("min_seconds", "peak_bytes"):
+            if base[key] and result[key] > base[key] * (1 + threshold):
+                regressions.append(
+                    f"{result['name']} ({result['rows']} rows): {key} "
+                    f"{base[key]:.6g} -> {result[key]:.6g} "
+                    f"(+{result[key] / base[key] - 1:.0%})"
+                )
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Time the transformers, pipeline execution, serialization "
+        "and transform endpoints on synthetic data.",
+    )
+    parser.add_argument(
+        "--rows",
+        default="10000,100000,1000000",
+        help="comma separated dataset sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--suite",
+        default=",".join(SUITES),
+        help="comma separated suites to run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--match", help="only run benchmarks whose name contains this text"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="timed runs per benchmark"
+    )
+    parser.add_argument(
+        "--endpoint-max-rows",
+        type=int,
+        default=1_000_000,
+        help="largest dataset sent to the endpoints (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output", default="benchmark.json", help="where to write the results"
+    )
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown or memory growth that counts as a regression "
+        "(default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    args.rows = [int(rows) for rows in args.rows.split(",")]
+    args.suite = args.suite.split(",")
+    unknown = set(args.suite) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    results = run_benchmarks(
+        args.rows, args.suite, args.repeat, args.endpoint_max_rows, args.match
+    )
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# Example plugin, loaded with PLUGIN_DIR=examples/plugins. TRANSFORMERS is read
+# without importing this module, which is imported when one of its
+# transformers first runs.
+from pandas import DataFrame
+
+TRANSFORMERS = {
+    "lowercase": {
+        "func": "lowercase_column",
+        "required_args": ["column"],
+        "required_column_types": {"column": "string"},
+        "row_local": True,
+        "output_schema": "same_schema",
+        "parallel": True,
+    },
+    "round": {
+        "func": "round_column",
+        "required_args": ["column", "decimals"],
+        "required_column_types": {"column": "numeric"},
+        "row_local": True,
+        "output_schema": "same_schema",
+    },
+}
+
+
+def lowercase_column(df: DataFrame, **kwargs) -> DataFrame:
+    col = kwargs["column"]
+    df = df.copy(deep=False)
+    df[col] = df[col].str.lower()
+    return df
+
+
+def round_column(df: DataFrame, **kwargs) -> DataFrame:
+    return df.round({kwargs["column"]: kwargs["decimals"]})
+
+
+def same_schema(schema, **kwargs):
+    return dict(schema)
@@ -1,3 +1,4 @@
+import threading
 from contextlib import asynccontextmanager
 from typing import cast
 
@@ -10,11 +11,58 @@ from slowapi.middleware import SlowAPIMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from starlette.types import HTTPExceptionHandler
 
-from src.config import DB_NAME, MONGO_URI
-from src.db import create_admin_user_if_none
+from src.admission import AdmissionController, open_store
+from src.compression import CompressionMiddleware, DecompressionMiddleware
+from src.config import (
+    COMPRESS_RESPONSES,
+    COST_LIMIT_BURST,
+    COST_LIMIT_RATE,
+    COST_LIMIT_STORE,
+    COST_STEP_WEIGHTS,
+    DB_NAME,
+    EXECUTOR_BACKEND,
+    EXECUTOR_MAX_WORKERS,
+    EXECUTOR_TIMEOUT_SECONDS,
+    JOB_QUEUE_MAX,
+    JOB_RESULT_TTL_SECONDS,
+    JOB_STORE,
+    JOB_TIMEOUT_SECONDS,
+    JOB_USER_MAX_QUEUED,
+    JOB_USER_MAX_RUNNING,
+    JOB_WORKERS,
+    MAX_CONCURRENT_TRANSFORMS,
+    MONGO_URI,
+    PASSWORD_HASH_MAX_PENDING,
+    PASSWORD_HASH_WORKERS,
+    PLUGIN_DIR,
+    PRELOAD_IMPORTS,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK_MAX_BYTES,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_MAX_ENTRY_BYTES,
+)
+from src.datasets import purge_expired_datasets
+from src.db import create_admin_user_if_none, create_indexes
+from src.engines import register_engine_transformers
+from src.executor import PipelineExecutor
+from src.lazy import preload
+from src.partition import shutdown_pool
+from src.passwords import PasswordHasher
+from src.plugins import register_plugin_transformers
+from src.jobs import JobQueue, MemoryJobStore, MongoJobStore
 from src.rate_limiter import limiter
+from src.result_cache import ResultCache
 from src.logger import get_logger
-from src.routes import auth_router, root_router, transform_router
+from src.lookups import register_lookup_transformers
+from src.routes import (
+    auth_router,
+    datasets_router,
+    jobs_router,
+    lookups_router,
+    metrics_router,
+    root_router,
+    transform_router,
+)
 from src.transformer import TransformerRegistry, register_builtin_transformers
 
 
@@ -28,20 +76,82 @@ async def lifespan(app: FastAPI):
     # Transformer Registry init
     registry = TransformerRegistry()
     register_builtin_transformers(registry)
+    register_lookup_transformers(registry)
+    register_engine_transformers(registry)
+    plugins = register_plugin_transformers(registry, PLUGIN_DIR)
     app.state.registry = registry
-    get_logger().info("Transformer Registry loaded")
+    get_logger().info(
+        f"Transformer Registry loaded ({', '.join(registry.list_engines())}, "
+        f"{plugins} plugin transformers)"
+    )
+
+    # Pipeline executor init
+    app.state.executor = PipelineExecutor(
+        backend=EXECUTOR_BACKEND,
+        max_workers=EXECUTOR_MAX_WORKERS,
+        timeout=EXECUTOR_TIMEOUT_SECONDS or None,
+    )
+    get_logger().info(f"Pipeline executor started ({EXECUTOR_BACKEND})")
+
+    # Result cache init
+    app.state.result_cache = ResultCache(
+        max_bytes=RESULT_CACHE_MAX_BYTES,
+        max_entry_bytes=RESULT_CACHE_MAX_ENTRY_BYTES,
+        disk_dir=RESULT_CACHE_DIR or None,
+        disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES,
+    )
+
+    # Password hashing runs off the event loop
+    app.state.password_hasher = PasswordHasher(
+        max_workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING
+    )
 
     # Rate Limiter init
     app.state.limiter = limiter
+    app.state.admission = AdmissionController(
+        store=open_store(COST_LIMIT_STORE),
+        rate=COST_LIMIT_RATE,
+        burst=COST_LIMIT_BURST,
+        max_concurrent=MAX_CONCURRENT_TRANSFORMS,
+        # Slots outlive the longest pipeline, unless their worker died
+        lease=(EXECUTOR_TIMEOUT_SECONDS or 3600) + 60,
+        weights=COST_STEP_WEIGHTS,
+    )
     app.add_exception_handler(
         RateLimitExceeded, cast(HTTPExceptionHandler, _rate_limit_exceeded_handler)
     )
 
-    # Create admin user if none exists
-    await create_admin_user_if_none(app.state.db)
+    # Indexes, then create admin user if none exists
+    await create_indexes(app.state.db)
+    await create_admin_user_if_none(app.state.db, app.state.password_hasher)
+    await purge_expired_datasets(app.state.db)
+
+    # Job queue init
+    app.state.job_queue = JobQueue(
+        store=MemoryJobStore() if JOB_STORE == "memory" else MongoJobStore(app.state.db),
+        executor=app.state.executor,
+        workers=JOB_WORKERS,
+        max_queued=JOB_QUEUE_MAX,
+        max_queued_per_user=JOB_USER_MAX_QUEUED,
+        max_running_per_user=JOB_USER_MAX_RUNNING,
+        timeout=JOB_TIMEOUT_SECONDS or None,
+        result_ttl=JOB_RESULT_TTL_SECONDS,
+    )
+    await app.state.job_queue.start()
+    get_logger().info(f"Job queue started ({JOB_WORKERS} workers)")
+
+    # The app serves requests while pandas and the other modules pipelines
+    # need are imported, so the first transform does not wait for them
+    if PRELOAD_IMPORTS:
+        threading.Thread(target=preload, name="preload", daemon=True).start()
 
     yield
 
+    await app.state.job_queue.stop()
+    app.state.executor.shutdown()
+    app.state.password_hasher.shutdown()
+    shutdown_pool()
+    app.state.admission.close()
     mongo_client.close()
     get_logger().info("MongoDB disconnected")
 
@@ -49,18 +159,26 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan)
 
 # Middleware
+# Innermost, so that errors decoding a request body reach the endpoint reading it
+app.add_middleware(DecompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT"],
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
 )
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 app.add_middleware(SlowAPIMiddleware)
+if COMPRESS_RESPONSES:
+    app.add_middleware(CompressionMiddleware)
 
 
 # Register routers
 app.include_router(root_router)
 app.include_router(auth_router)
 app.include_router(transform_router)
+app.include_router(datasets_router)
+app.include_router(jobs_router)
+app.include_router(lookups_router)
+app.include_router(metrics_router)
@@ -0,0 +1,280 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+from .status import Overloaded, RateLimited
+
+COST_UNIT_BYTES = 1024 * 1024
+# Buckets and slots that can be forgotten are purged every so many operations
+PURGE_EVERY = 1000
+
+
+def request_cost(
+    input_bytes: int, steps: Iterable[str], weights: Dict[str, float]
+) -> float:
+    # One token per MiB of input for each step, weighted by how costly the
+    # step is, and at least one token per request
+    weight = sum(weights.get(step, 1.0) for step in steps)
+    return max(1.0, input_bytes / COST_UNIT_BYTES * max(weight, 1.0))
+
+
+class AdmissionStore:
+    # Token buckets and concurrency slots shared by every worker using the
+    # same store. Stores are picked by the scheme of the COST_LIMIT_STORE URI.
+
+    def take(
+        self, key: str, cost: float, need: float, rate: float, burst: float
+    ) -> float:
+        # Refills the bucket of `key` and takes `cost` tokens from it when it
+        # holds at least `need`, which may leave it in debt. Returns 0, or the
+        # seconds until it holds `need` tokens.
+        raise NotImplementedError
+
+    def acquire_slot(self, limit: int, lease: float) -> Optional[str]:
+        # Returns the id of a slot held until it is released or its lease
+        # expires, or None when `limit` slots are held
+        raise NotImplementedError
+
+    def release_slot(self, slot: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def refill(
+    tokens: float, updated: float, now: float, rate: float, burst: float
+) -> float:
+    return min(burst, tokens + max(now - updated, 0.0) * rate)
+
+
+def take_tokens(
+    tokens: float, cost: float, need: float, rate: float
+) -> Tuple[float, float]:
+    # Returns the tokens left and the wait. Charges with no need always go
+    # through, even into debt.
+    if need > 0 and tokens < need:
+        return tokens, (need - tokens) / rate
+    return tokens - cost, 0.0
+
+
+class MemoryAdmissionStore(AdmissionStore):
+    # For a single process
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.slots: Dict[str, float] = {}
+        self.operations = 0
+        self.lock = threading.Lock()
+
+    def take(self, key, cost, need, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            self._purge(now, rate, burst)
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens, wait = take_tokens(
+                refill(tokens, updated, now, rate, burst), cost, need, rate
+            )
+            self.buckets[key] = (tokens, now)
+            return wait
+
+    def acquire_slot(self, limit, lease):
+        now = time.monotonic()
+        with self.lock:
+            self.slots = {
+                slot: expires for slot, expires in self.slots.items() if expires > now
+            }
+            if len(self.slots) >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            self.slots[slot] = now + lease
+            return slot
+
+    def release_slot(self, slot):
+        with self.lock:
+            self.slots.pop(slot, None)
+
+    def _purge(self, now: float, rate: float, burst: float):
+        # Buckets that have refilled completely are the same as no bucket
+        self.operations += 1
+        if self.operations % PURGE_EVERY == 0:
+            self.buckets = {
+                key: (tokens, updated)
+                for key, (tokens, updated) in self.buckets.items()
+                if refill(tokens, updated, now, rate, burst) < burst
+            }
+
+
+class SQLiteAdmissionStore(AdmissionStore):
+    # Shared by the workers of one host through a SQLite file. Each operation
+    # is a single write transaction, so workers see each other's changes.
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(
+            path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS slots "
+            "(slot TEXT PRIMARY KEY, expires REAL NOT NULL)"
+        )
+        self.operations = 0
+        self.lock = threading.Lock()
+
+    def _transaction(self, func: Callable[[sqlite3.Connection], object]):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def take(self, key, cost, need, rate, burst):
+        # Wall clock time, since it is compared across processes
+        now = time.time()
+
+        def run(conn: sqlite3.Connection):
+            self.operations += 1
+            if self.operations % PURGE_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM buckets WHERE tokens + (? - updated) * ? >= ?",
+                    (now, rate, burst),
+                )
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, wait = take_tokens(
+                refill(tokens, updated, now, rate, burst), cost, need, rate
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) "
+                "VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            return wait
+
+        return self._transaction(run)
+
+    def acquire_slot(self, limit, lease):
+        now = time.time()
+
+        def run(conn: sqlite3.Connection):
+            conn.execute("DELETE FROM slots WHERE expires <= ?", (now,))
+            (held,) = conn.execute("SELECT COUNT(*) FROM slots").fetchone()
+            if held >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            conn.execute("INSERT INTO slots VALUES (?, ?)", (slot, now + lease))
+            return slot
+
+        return self._transaction(run)
+
+    def release_slot(self, slot):
+        self._transaction(
+            lambda conn: conn.execute("DELETE FROM slots WHERE slot = ?", (slot,))
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_memory_store(uri) -> AdmissionStore:
+    return MemoryAdmissionStore()
+
+
+def open_sqlite_store(uri) -> AdmissionStore:
+    # sqlite:///relative/path or sqlite:////absolute/path
+    return SQLiteAdmissionStore(uri.path[1:] if uri.path.startswith("/") else uri.path)
+
+
+# Store factories by URI scheme. Other stores, e.g. one on Redis, are added here.
+STORES: Dict[str, Callable[..., AdmissionStore]] = {
+    "memory": open_memory_store,
+    "sqlite": open_sqlite_store,
+}
+
+
+def open_store(uri: str) -> AdmissionStore:
+    parsed = urlparse(uri)
+    if parsed.scheme not in STORES:
+        raise ValueError(
+            f"Unsupported admission store '{uri}', expected one of "
+            f"{[f'{scheme}://' for scheme in STORES]}"
+        )
+    return STORES[parsed.scheme](parsed)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        store: AdmissionStore,
+        rate: float,
+        burst: float,
+        max_concurrent: int,
+        lease: float,
+        weights: Dict[str, float],
+    ):
+        self.store = store
+        # Tokens per second and bucket size; a rate of 0 admits any cost
+        self.rate = rate
+        self.burst = burst
+        # Transforms running at once in every worker; 0 for no cap
+        self.max_concurrent = max_concurrent
+        # Slots of workers that died without releasing them expire after this
+        self.lease = lease
+        self.weights = weights
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 or self.max_concurrent > 0
+
+    def cost(self, input_bytes: int, steps: Iterable[str]) -> float:
+        return request_cost(input_bytes, steps, self.weights)
+
+    def admit(self, key: str, cost: float) -> Optional[str]:
+        # Takes `cost` tokens from the bucket of `key` and a concurrency slot.
+        # A request costlier than the bucket is admitted once the bucket is
+        # full and leaves it in debt. Returns the slot to release.
+        if self.rate > 0:
+            wait = self.store.take(
+                key, cost, min(cost, self.burst), self.rate, self.burst
+            )
+            if wait > 0:
+                raise RateLimited(math.ceil(wait))
+        if self.max_concurrent <= 0:
+            return None
+        slot = self.store.acquire_slot(self.max_concurrent, self.lease)
+        if slot is None:
+            if self.rate > 0:
+                # The request did not run, so its tokens are given back
+                self.store.take(key, -cost, 0.0, self.rate, self.burst)
+            raise Overloaded()
+        return slot
+
+    def charge(self, key: str, cost: float):
+        # Settles the cost of a request once it is known, after it was
+        # admitted on an estimate. Negative costs give tokens back.
+        if self.rate > 0 and cost:
+            self.store.take(key, cost, 0.0, self.rate, self.burst)
+
+    def release(self, slot: Optional[str]):
+        if slot is not None:
+            self.store.release_slot(slot)
+
+    def close(self):
+        self.store.close()
@@ -2,12 +2,12 @@ from typing import Optional
 
 from fastapi import Depends, Request, Security
 from fastapi.security import OAuth2PasswordBearer
-from jose import ExpiredSignatureError, JWTError, jwt
+from jose import ExpiredSignatureError, JWTError
 
-from .config import ALGORITHM, SECRET_KEY
 from .db import get_user
 from .models import User, UserRole
 from .status import InsufficientPermission, InvalidCredentials
+from .tokens import decode_token
 from .utils import get_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
@@ -16,8 +16,10 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 async def get_current_user(
     request: Request, token: str = Depends(oauth2_scheme)
 ) -> User:
+    if not token:
+        raise InvalidCredentials()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username = payload.get("sub", "")
         if username == "":
             raise InvalidCredentials()
@@ -42,7 +44,7 @@ async def get_optional_user(
     if not token:
         return None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username = payload.get("sub")
         if not username:
             raise InvalidCredentials()
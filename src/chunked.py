@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, Optional
+
+from .lazy import pd
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+_RUN = "__run"
+_POS = "__pos"
+_LAST = "__last"
+
+
+def rebatch(chunks: Iterable[DataFrame], rows: int) -> Iterator[DataFrame]:
+    buffer: List[DataFrame] = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= rows:
+            merged = pd.concat(buffer)
+            for start in range(0, len(merged) - rows + 1, rows):
+                yield merged.iloc[start : start + rows]
+            rest = len(merged) % rows
+            buffer = [merged.iloc[len(merged) - rest :]] if rest else []
+            size = rest
+    if buffer:
+        yield pd.concat(buffer)
+
+
+class _Run:
+    def __init__(self, index: int, paths: List[str], batch_rows: int):
+        self.index = index
+        self.paths = paths
+        self.batch_rows = batch_rows
+        self.buffer: Optional[DataFrame] = None
+
+    def refill(self, rest: Optional[DataFrame] = None) -> bool:
+        # Keeps at least a batch of rows loaded so every merge round makes
+        # progress of at least one batch
+        parts = [] if rest is None or not len(rest) else [rest]
+        size = sum(len(part) for part in parts)
+        while size < self.batch_rows and self.paths:
+            part = pd.read_pickle(self.paths.pop(0))
+            parts.append(part)
+            size += len(part)
+        self.buffer = pd.concat(parts) if parts else None
+        return self.buffer is not None
+
+
+# Stable sort of a chunk stream with bounded memory. Input is cut into sorted
+# runs of at most `run_rows` rows that are spilled to disk in batches of
+# `batch_rows`, then merged keeping one batch per run in memory.
+def external_sort(
+    chunks: Iterable[DataFrame],
+    by: List[Any],
+    ascending: Any = True,
+    run_rows: int = 1_000_000,
+    batch_rows: int = 100_000,
+) -> Iterator[DataFrame]:
+    keys = list(by)
+    if isinstance(ascending, (list, tuple)):
+        key_ascending = list(ascending)
+    else:
+        key_ascending = [ascending] * len(keys)
+
+    with tempfile.TemporaryDirectory(prefix="sort-") as tmpdir:
+        runs: List[_Run] = []
+        for run_df in rebatch(chunks, run_rows):
+            run_df = run_df.sort_values(by=keys, ascending=key_ascending, kind="stable")
+            if not runs and len(run_df) < run_rows:
+                # Everything fitted in a single run, no need to spill
+                for start in range(0, len(run_df), batch_rows):
+                    yield run_df.iloc[start : start + batch_rows]
+                return
+
+            paths = []
+            for start in range(0, len(run_df), batch_rows):
+                path = os.path.join(tmpdir, f"run{len(runs)}-{len(paths)}.pkl")
+                run_df.iloc[start : start + batch_rows].to_pickle(path)
+                paths.append(path)
+            runs.append(_Run(len(runs), paths, batch_rows))
+            del run_df
+
+        yield from _merge_runs(runs, keys, key_ascending)
+
+
+def _merge_runs(
+    runs: List[_Run], keys: List[Any], key_ascending: List[bool]
+) -> Iterator[DataFrame]:
+    active = [run for run in runs if run.refill()]
+    while active:
+        # Rows are ordered by (keys, run, position), which is the order a stable
+        # sort over the whole input produces. The smallest last row across the
+        # loaded batches bounds every row not loaded yet, so everything up to
+        # it can be emitted.
+        parts = []
+        for run in active:
+            part = run.buffer.copy()
+            part[_RUN] = run.index
+            part[_POS] = range(len(part))
+            part[_LAST] = False
+            part.iloc[-1, part.columns.get_loc(_LAST)] = True
+            parts.append(part)
+        merged = pd.concat(parts, ignore_index=True).sort_values(
+            by=keys + [_RUN, _POS],
+            ascending=key_ascending + [True, True],
+            kind="stable",
+        )
+        cutoff = int(merged[_LAST].to_numpy().argmax())
+        emitted = merged.iloc[: cutoff + 1]
+        yield emitted.drop(columns=[_RUN, _POS, _LAST])
+
+        remaining = merged.iloc[cutoff + 1 :]
+        rests = dict(iter(remaining.groupby(_RUN, sort=False)))
+        active = [
+            run
+            for run in active
+            if run.refill(
+                rests[run.index].drop(columns=[_RUN, _POS, _LAST])
+                if run.index in rests
+                else None
+            )
+        ]
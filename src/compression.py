@@ -0,0 +1,297 @@
+import functools
+import gzip
+import zlib
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import COMPRESS_MIN_BYTES, DECOMPRESS_MAX_BYTES, GZIP_LEVEL, ZSTD_LEVEL
+from .status import PayloadTooLarge, UnsupportedEncoding
+
+GZIP = "gzip"
+ZSTD = "zstd"
+# Content-Encoding names, in the order responses prefer them
+ENCODINGS = {ZSTD: ZSTD, GZIP: GZIP, "x-gzip": GZIP}
+# Responses that are compressed already
+COMPRESSED_MEDIA_TYPES = (
+    "application/x-parquet",
+    "application/vnd.apache.parquet",
+    "application/gzip",
+    "application/zstd",
+    "text/event-stream",
+)
+# Bodies at least this large are compressed off the event loop
+THREAD_MIN_BYTES = 256 * 1024
+# Request bodies are decompressed in steps of at most this much output. zstd
+# cannot bound its output, so it is fed input slices small enough that a step
+# stays within a few tens of MiB.
+DECOMPRESS_STEP_BYTES = 1024 * 1024
+ZSTD_SLICE_BYTES = 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def available_encodings() -> List[str]:
+    return [ZSTD, GZIP] if _zstd() is not None else [GZIP]
+
+
+def content_encoding(value: str) -> Optional[str]:
+    # The encoding named by a Content-Encoding header, None for identity
+    value = value.strip().lower()
+    if value in ("", "identity"):
+        return None
+    encoding = ENCODINGS.get(value)
+    if encoding not in available_encodings():
+        raise UnsupportedEncoding(
+            f"Unsupported Content-Encoding '{value}', expected one of "
+            f"{available_encodings()}"
+        )
+    return encoding
+
+
+def quality_values(header: str) -> Iterator[Tuple[str, float]]:
+    # The values of an Accept style header with their q parameter
+    for item in header.split(","):
+        value, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, number = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        yield value.lower(), quality
+
+
+def negotiate_encoding(accept: str) -> Optional[str]:
+    qualities = {}
+    for value, quality in quality_values(accept):
+        qualities[ENCODINGS.get(value, value)] = quality
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def open_decoded(file: BinaryIO, encoding: str) -> BinaryIO:
+    # Decompresses the file as it is read. Closing the result leaves the file
+    # open.
+    if encoding == GZIP:
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    return _zstd().ZstdDecompressor().stream_reader(
+        file, closefd=False, read_across_frames=True
+    )
+
+
+def check_expanded(what: str, size: int):
+    # Fails a compressed input as soon as it expands past the limit, so a
+    # small body cannot fill the memory
+    if 0 < DECOMPRESS_MAX_BYTES < size:
+        raise PayloadTooLarge(
+            f"{what} expands to more than {DECOMPRESS_MAX_BYTES} bytes"
+        )
+
+
+class Decoder:
+    # Decompresses a body that arrives in pieces. Concatenated gzip members
+    # or zstd frames are decoded one after another.
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.errors: Tuple = (zlib.error,)
+        if encoding == ZSTD:
+            self.errors += (_zstd().ZstdError,)
+        self.size = 0
+        self.reset()
+
+    def reset(self):
+        if self.encoding == GZIP:
+            self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.obj = _zstd().ZstdDecompressor().decompressobj()
+        self.started = False
+
+    def decompress(self, data: bytes, final: bool = False) -> bytes:
+        out = []
+        pending = False
+        try:
+            while data or pending:
+                self.started = True
+                if self.encoding == GZIP:
+                    piece = self.obj.decompress(data, DECOMPRESS_STEP_BYTES)
+                    data = self.obj.unconsumed_tail
+                    pending = len(piece) == DECOMPRESS_STEP_BYTES
+                else:
+                    piece = self.obj.decompress(data[:ZSTD_SLICE_BYTES])
+                    data = data[ZSTD_SLICE_BYTES:]
+                self.size += len(piece)
+                check_expanded(f"The {self.encoding} request body", self.size)
+                out.append(piece)
+                if self.obj.eof:
+                    data = self.obj.unused_data + data
+                    pending = False
+                    self.reset()
+        except self.errors:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid {self.encoding} request body"
+            )
+        if final and self.started:
+            raise HTTPException(
+                status_code=400, detail=f"Truncated {self.encoding} request body"
+            )
+        return b"".join(out)
+
+
+class Compressor:
+    # Each chunk is flushed, so streamed responses reach the client as they
+    # are produced
+    def __init__(self, encoding: str):
+        if encoding == GZIP:
+            self.obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.sync = zlib.Z_SYNC_FLUSH
+        else:
+            zstd = _zstd()
+            self.obj = zstd.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+            self.sync = zstd.COMPRESSOBJ_FLUSH_BLOCK
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        out = self.obj.compress(data)
+        return out + (self.obj.flush() if final else self.obj.flush(self.sync))
+
+
+class DecompressionMiddleware:
+    # Request bodies sent with a Content-Encoding are decoded as they are
+    # received, so the endpoints read them as if they were sent as is
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            encoding = content_encoding(
+                Headers(scope=scope).get("content-encoding", "")
+            )
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code)
+            await response(scope, receive, send)
+            return
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (key, value)
+            for key, value in scope["headers"]
+            if key not in (b"content-encoding", b"content-length")
+        ]
+        decoder = Decoder(encoding)
+
+        async def receive_decoded() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                message = dict(message)
+                message["body"] = decoder.decompress(
+                    message.get("body", b""), final=not message.get("more_body")
+                )
+            return message
+
+        await self.app(scope, receive_decoded, send)
+
+
+class CompressionMiddleware:
+    # Compresses responses of at least `minimum_size` bytes with the best
+    # encoding the client accepts
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = None
+        if scope["type"] == "http":
+            encoding = negotiate_encoding(
+                Headers(scope=scope).get("accept-encoding", "")
+            )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    def __init__(self, send: Send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Held until the first body shows whether to compress
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = "content-encoding" in headers or headers.get(
+                "content-type", ""
+            ).startswith(COMPRESSED_MEDIA_TYPES)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._flush_start()
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            # Responses may be sent in pieces, which are held until they add up
+            # to the minimum size
+            self.pending.append(body)
+            self.pending_size += len(body)
+            if more_body and self.pending_size < self.minimum_size:
+                return
+            body = b"".join(self.pending)
+            self.pending = []
+            if not more_body and (not body or len(body) < self.minimum_size):
+                self.passthrough = True
+                await self._flush_start()
+                await self._send({**message, "body": body})
+                return
+            self.compressor = Compressor(self.encoding)
+            headers = MutableHeaders(raw=self.start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            headers["Content-Encoding"] = self.encoding
+            del headers["Content-Length"]
+
+        final = not more_body
+        if len(body) >= THREAD_MIN_BYTES:
+            body = await run_in_threadpool(self.compressor.compress, body, final)
+        else:
+            body = self.compressor.compress(body, final)
+        if self.start is not None and final:
+            MutableHeaders(raw=self.start["headers"])["Content-Length"] = str(len(body))
+        await self._flush_start()
+        await self._send({**message, "body": body})
+
+    async def _flush_start(self):
+        if self.start is not None:
+            start, self.start = self.start, None
+            await self._send(start)
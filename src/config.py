@@ -23,10 +23,97 @@ SECRET_KEY = get_env("SECRET_KEY", default="supersecret")
 ALGORITHM = get_env("ALGORITHM", default="HS256")
 MONGO_URI = get_env("MONGO_URI", default="mongodb://localhost:27017")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(get_env("ACCESS_TOKEN_EXPIRE_MINUTES", default="60"))
+TOKEN_CACHE_SIZE = int(get_env("TOKEN_CACHE_SIZE", default="10000"))
+PASSWORD_HASH_WORKERS = int(
+    get_env("PASSWORD_HASH_WORKERS", default=str(max(1, (os.cpu_count() or 1) // 2)))
+)
+PASSWORD_HASH_MAX_PENDING = int(get_env("PASSWORD_HASH_MAX_PENDING", default="64"))
 RATE_LIMIT = get_env("RATE_LIMIT", default="20/minute")
+RATE_LIMIT_STORAGE_URI = get_env("RATE_LIMIT_STORAGE_URI", default="memory://")
+COST_LIMIT_STORE = get_env("COST_LIMIT_STORE", default="memory://")
+COST_LIMIT_RATE = float(get_env("COST_LIMIT_RATE", default="1"))
+COST_LIMIT_BURST = float(get_env("COST_LIMIT_BURST", default="60"))
+raw_weights = get_env("COST_STEP_WEIGHTS", default="sort:3,filter:2")
+COST_STEP_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (item.partition(":") for item in raw_weights.split(","))
+    if name.strip()
+}
+MAX_CONCURRENT_TRANSFORMS = int(
+    get_env("MAX_CONCURRENT_TRANSFORMS", default=str(2 * (os.cpu_count() or 1)))
+)
 DB_NAME = get_env("DB_NAME", default="data_transformer")
+PLUGIN_DIR = get_env("PLUGIN_DIR", default="plugins")
+PRELOAD_IMPORTS = get_env("PRELOAD_IMPORTS", default="true").lower() == "true"
 
 raw_transforms = get_env("DEFAULT_TRANSFORMS", default="uppercase,rename")
 DEFAULT_TRANSFORMS = [t.strip() for t in raw_transforms.split(",") if t.strip()]
 ADMIN_USERNAME = get_env("ADMIN_USERNAME", default="admin")
 ADMIN_PASSWORD = get_env("ADMIN_PASSWORD", default="admin123")
+BULK_MAX_USERS = int(get_env("BULK_MAX_USERS", default="10000"))
+BULK_MAX_PASSWORDS = int(get_env("BULK_MAX_PASSWORDS", default="100"))
+
+EXECUTOR_BACKEND = get_env("EXECUTOR_BACKEND", default="thread")
+EXECUTOR_MAX_WORKERS = int(get_env("EXECUTOR_MAX_WORKERS", default="4"))
+EXECUTOR_TIMEOUT_SECONDS = float(get_env("EXECUTOR_TIMEOUT_SECONDS", default="300"))
+
+CHUNK_ROWS = int(get_env("CHUNK_ROWS", default="100000"))
+CHUNKED_UPLOAD_THRESHOLD_BYTES = int(
+    get_env("CHUNKED_UPLOAD_THRESHOLD_BYTES", default=str(64 * 1024 * 1024))
+)
+SORT_RUN_ROWS = int(get_env("SORT_RUN_ROWS", default="1000000"))
+STREAM_BATCH_ROWS = int(get_env("STREAM_BATCH_ROWS", default="10000"))
+BATCH_MAX_PIPELINES = int(get_env("BATCH_MAX_PIPELINES", default="50"))
+FILTER_CACHE_SIZE = int(get_env("FILTER_CACHE_SIZE", default="1024"))
+ENGINE = get_env("ENGINE", default="pandas")
+PARTITION_WORKERS = int(get_env("PARTITION_WORKERS", default=str(os.cpu_count() or 1)))
+PARTITION_MIN_ROWS = int(get_env("PARTITION_MIN_ROWS", default="100000"))
+COPY_ON_WRITE = get_env("COPY_ON_WRITE", default="true").lower() == "true"
+COMPACT_DTYPES = get_env("COMPACT_DTYPES", default="true").lower() == "true"
+MEMORY_BUDGET_BYTES = int(get_env("MEMORY_BUDGET_BYTES", default="0"))
+
+COMPRESS_RESPONSES = get_env("COMPRESS_RESPONSES", default="true").lower() == "true"
+COMPRESS_MIN_BYTES = int(get_env("COMPRESS_MIN_BYTES", default="1024"))
+GZIP_LEVEL = int(get_env("GZIP_LEVEL", default="1"))
+DECOMPRESS_MAX_BYTES = int(
+    get_env("DECOMPRESS_MAX_BYTES", default=str(1024 * 1024 * 1024))
+)
+ZSTD_LEVEL = int(get_env("ZSTD_LEVEL", default="3"))
+
+METRICS_ENABLED = get_env("METRICS_ENABLED", default="true").lower() == "true"
+SLOW_PIPELINE_SECONDS = float(get_env("SLOW_PIPELINE_SECONDS", default="10"))
+
+USER_CACHE_SIZE = int(get_env("USER_CACHE_SIZE", default="10000"))
+USER_CACHE_TTL_SECONDS = float(get_env("USER_CACHE_TTL_SECONDS", default="60"))
+
+RESULT_CACHE_MAX_BYTES = int(
+    get_env("RESULT_CACHE_MAX_BYTES", default=str(256 * 1024 * 1024))
+)
+RESULT_CACHE_MAX_ENTRY_BYTES = int(
+    get_env("RESULT_CACHE_MAX_ENTRY_BYTES", default=str(32 * 1024 * 1024))
+)
+RESULT_CACHE_DIR = get_env("RESULT_CACHE_DIR", default="")
+RESULT_CACHE_DISK_MAX_BYTES = int(
+    get_env("RESULT_CACHE_DISK_MAX_BYTES", default=str(1024 * 1024 * 1024))
+)
+
+DATASET_DIR = get_env("DATASET_DIR", default="datasets")
+DATASET_TTL_SECONDS = int(get_env("DATASET_TTL_SECONDS", default="86400"))
+DATASET_MAX_TTL_SECONDS = int(
+    get_env("DATASET_MAX_TTL_SECONDS", default=str(30 * 86400))
+)
+DATASET_QUOTA_BYTES = int(
+    get_env("DATASET_QUOTA_BYTES", default=str(1024 * 1024 * 1024))
+)
+
+LOOKUP_DIR = get_env("LOOKUP_DIR", default="lookups")
+LOOKUP_MAX_BYTES = int(get_env("LOOKUP_MAX_BYTES", default=str(256 * 1024 * 1024)))
+
+JOB_STORE = get_env("JOB_STORE", default="mongo")
+JOB_DIR = get_env("JOB_DIR", default="jobs")
+JOB_WORKERS = int(get_env("JOB_WORKERS", default="2"))
+JOB_QUEUE_MAX = int(get_env("JOB_QUEUE_MAX", default="100"))
+JOB_USER_MAX_QUEUED = int(get_env("JOB_USER_MAX_QUEUED", default="10"))
+JOB_USER_MAX_RUNNING = int(get_env("JOB_USER_MAX_RUNNING", default="2"))
+JOB_TIMEOUT_SECONDS = float(get_env("JOB_TIMEOUT_SECONDS", default="3600"))
+JOB_RESULT_TTL_SECONDS = int(get_env("JOB_RESULT_TTL_SECONDS", default="86400"))
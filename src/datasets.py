@@ -0,0 +1,35 @@
+import os
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .config import DATASET_DIR, DATASET_QUOTA_BYTES
+from .db import delete_dataset, get_expired_datasets
+from .logger import get_logger
+from .models import User, UserRole
+
+
+def dataset_path(dataset_id: str) -> str:
+    return os.path.join(DATASET_DIR, f"{dataset_id}.arrow")
+
+
+def remove_dataset_file(dataset_id: str):
+    try:
+        os.remove(dataset_path(dataset_id))
+    except FileNotFoundError:
+        pass
+
+
+def dataset_quota(user: User) -> Optional[int]:
+    if user.role == UserRole.admin:
+        return None
+    if user.dataset_quota_bytes is None:
+        return DATASET_QUOTA_BYTES
+    return user.dataset_quota_bytes
+
+
+async def purge_expired_datasets(db: AsyncIOMotorDatabase):
+    for dataset in await get_expired_datasets(db):
+        if await delete_dataset(db, dataset.dataset_id):
+            remove_dataset_file(dataset.dataset_id)
+            get_logger().info(f"Dataset '{dataset.dataset_id}' expired")
@@ -1,25 +1,73 @@
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
 
-import bcrypt
 from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
-from .config import ADMIN_PASSWORD, ADMIN_USERNAME, DEFAULT_TRANSFORMS
+from .cache import MISSING, TTLCache
+from .config import (
+    ADMIN_PASSWORD,
+    ADMIN_USERNAME,
+    DEFAULT_TRANSFORMS,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL_SECONDS,
+)
 from .logger import get_logger
-from .models import User, UserRole
+from .models import Dataset, Job, JobStatus, User, UserRole
+from .passwords import PasswordHasher
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Per-process caches keyed by username. Writes through this module invalidate
+# them; changes made by other workers are picked up once entries expire.
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+allowed_transforms_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
 
 
 def get_user_db(db: AsyncIOMotorDatabase) -> AsyncIOMotorCollection:
     return db["users"]
 
 
+def get_dataset_db(db: AsyncIOMotorDatabase) -> AsyncIOMotorCollection:
+    return db["datasets"]
+
+
+def get_job_db(db: AsyncIOMotorDatabase) -> AsyncIOMotorCollection:
+    return db["jobs"]
+
+
+def invalidate_user(username: str):
+    user_cache.invalidate(username)
+    allowed_transforms_cache.invalidate(username)
+
+
+async def create_indexes(db: AsyncIOMotorDatabase):
+    # Duplicate usernames are only rejected by this index, so startup fails
+    # without it
+    await get_user_db(db).create_index("username", unique=True)
+    try:
+        await get_dataset_db(db).create_index("dataset_id", unique=True)
+        await get_dataset_db(db).create_index("owner")
+    except Exception as e:
+        get_logger().warning(f"Could not create indexes on datasets: {e}")
+    try:
+        await get_job_db(db).create_index("job_id", unique=True)
+        await get_job_db(db).create_index("status")
+    except Exception as e:
+        get_logger().warning(f"Could not create indexes on jobs: {e}")
+
+
 async def get_admin_user(db: AsyncIOMotorDatabase) -> Optional[User]:
     return await get_user_db(db).find_one({"role": UserRole.admin})
 
 
-async def create_admin_user_if_none(db: AsyncIOMotorDatabase):
+async def create_admin_user_if_none(
+    db: AsyncIOMotorDatabase, password_hasher: PasswordHasher
+):
     admin = await get_admin_user(db)
     if not admin:
-        hashed_pw = bcrypt.hashpw(ADMIN_PASSWORD.encode(), bcrypt.gensalt()).decode()
+        hashed_pw = await password_hasher.hash(ADMIN_PASSWORD)
 
         await get_user_db(db).insert_one(
             {
@@ -29,22 +77,66 @@ async def create_admin_user_if_none(db: AsyncIOMotorDatabase):
                 "allowed_transforms": None,
             }
         )
+        invalidate_user(ADMIN_USERNAME)
         get_logger().info(
             f"[INFO] Admin user created: {ADMIN_USERNAME} / {ADMIN_PASSWORD}"
         )
 
 
 async def get_user(db: AsyncIOMotorDatabase, username: str) -> Optional[User]:
+    if (cached := user_cache.get(username)) is not MISSING:
+        return cached
     user = await get_user_db(db).find_one({"username": username})
-    return User(**user) if user else None
+    if not user:
+        return None
+    user = User(**user)
+    user_cache.set(username, user)
+    return user
+
+
+async def get_user_roles(
+    db: AsyncIOMotorDatabase, usernames: Iterable[str]
+) -> Dict[str, UserRole]:
+    # The roles of the users that exist, in a single query
+    cursor = get_user_db(db).find(
+        {"username": {"$in": list(usernames)}}, {"username": 1, "role": 1}
+    )
+    return {doc["username"]: UserRole(doc["role"]) async for doc in cursor}
 
 
 async def set_user_transforms(
     db: AsyncIOMotorDatabase, username: str, transforms: list[str]
 ):
-    return await get_user_db(db).update_one(
+    result = await get_user_db(db).update_one(
         {"username": username}, {"$set": {"allowed_transforms": transforms}}
     )
+    invalidate_user(username)
+    return result
+
+
+async def set_users_transforms(
+    db: AsyncIOMotorDatabase, transforms: Dict[str, List[str]]
+) -> Dict[str, str]:
+    # One unordered bulk write for all users. Admins are never matched.
+    # Returns an error by username for the updates that failed.
+    requests = [
+        UpdateOne(
+            {"username": username, "role": {"$ne": UserRole.admin}},
+            {"$set": {"allowed_transforms": allowed}},
+        )
+        for username, allowed in transforms.items()
+    ]
+    errors = {}
+    try:
+        await get_user_db(db).bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        usernames = list(transforms)
+        for error in e.details.get("writeErrors", []):
+            errors[usernames[error["index"]]] = error.get("errmsg", "Write failed")
+    finally:
+        for username in transforms:
+            invalidate_user(username)
+    return errors
 
 
 async def get_user_allowed_transforms(
@@ -52,17 +144,21 @@ async def get_user_allowed_transforms(
 ):
     if username is None:
         return DEFAULT_TRANSFORMS
+    if (cached := allowed_transforms_cache.get(username)) is not MISSING:
+        return cached
     user = await get_user(db, username)
     if user is None:
         return DEFAULT_TRANSFORMS
     if user.role == UserRole.admin:
-        return None
-    return user.allowed_transforms or DEFAULT_TRANSFORMS
+        allowed = None
+    else:
+        allowed = user.allowed_transforms or DEFAULT_TRANSFORMS
+    allowed_transforms_cache.set(username, allowed)
+    return allowed
 
 
 async def create_user(db, username: str, hashed_pw: str, role: str = "user") -> bool:
-    if await get_user(db, username):
-        return False
+    # Duplicates are rejected by the unique index on username
     try:
         user = User(
             username=username,
@@ -74,3 +170,102 @@ async def create_user(db, username: str, hashed_pw: str, role: str = "user") ->
         return True
     except Exception:
         return False
+    finally:
+        invalidate_user(username)
+
+
+async def create_users(db: AsyncIOMotorDatabase, users: List[User]) -> Dict[str, str]:
+    # One unordered insert for all users, so a duplicate does not stop the
+    # others. Returns an error by username for the users not created.
+    errors = {}
+    try:
+        await get_user_db(db).insert_many(
+            [user.model_dump() for user in users], ordered=False
+        )
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            username = users[error["index"]].username
+            if error.get("code") == DUPLICATE_KEY_ERROR:
+                errors[username] = "Username already exists"
+            else:
+                errors[username] = error.get("errmsg", "Error creating user")
+    finally:
+        for user in users:
+            invalidate_user(user.username)
+    return errors
+
+
+async def set_user_dataset_quota(
+    db: AsyncIOMotorDatabase, username: str, quota: Optional[int]
+):
+    result = await get_user_db(db).update_one(
+        {"username": username}, {"$set": {"dataset_quota_bytes": quota}}
+    )
+    invalidate_user(username)
+    return result
+
+
+async def create_dataset(db: AsyncIOMotorDatabase, dataset: Dataset):
+    await get_dataset_db(db).insert_one(dataset.model_dump())
+
+
+async def get_dataset(db: AsyncIOMotorDatabase, dataset_id: str) -> Optional[Dataset]:
+    # Expired datasets are hidden until they are purged
+    dataset = await get_dataset_db(db).find_one(
+        {"dataset_id": dataset_id, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    )
+    return Dataset(**dataset) if dataset else None
+
+
+async def list_datasets(db: AsyncIOMotorDatabase, owner: str) -> List[Dataset]:
+    cursor = get_dataset_db(db).find(
+        {"owner": owner, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    )
+    return [Dataset(**dataset) async for dataset in cursor]
+
+
+async def get_dataset_usage(db: AsyncIOMotorDatabase, owner: str) -> int:
+    # Expired datasets count until they are purged, as their files still exist
+    cursor = get_dataset_db(db).find({"owner": owner}, {"size_bytes": 1})
+    return sum([dataset["size_bytes"] async for dataset in cursor])
+
+
+async def delete_dataset(db: AsyncIOMotorDatabase, dataset_id: str) -> bool:
+    result = await get_dataset_db(db).delete_one({"dataset_id": dataset_id})
+    return result.deleted_count > 0
+
+
+async def get_expired_datasets(db: AsyncIOMotorDatabase) -> List[Dataset]:
+    cursor = get_dataset_db(db).find(
+        {"expires_at": {"$lte": datetime.now(timezone.utc)}}
+    )
+    return [Dataset(**dataset) async for dataset in cursor]
+
+
+async def create_job(db: AsyncIOMotorDatabase, job: Job):
+    await get_job_db(db).insert_one(job.model_dump())
+
+
+async def update_job(db: AsyncIOMotorDatabase, job_id: str, fields: dict):
+    await get_job_db(db).update_one({"job_id": job_id}, {"$set": fields})
+
+
+async def get_job(db: AsyncIOMotorDatabase, job_id: str) -> Optional[Job]:
+    job = await get_job_db(db).find_one({"job_id": job_id})
+    return Job(**job) if job else None
+
+
+async def get_unfinished_jobs(db: AsyncIOMotorDatabase) -> List[Job]:
+    cursor = get_job_db(db).find(
+        {"status": {"$in": [JobStatus.queued, JobStatus.running]}}
+    )
+    return [Job(**job) async for job in cursor]
+
+
+async def get_expired_jobs(db: AsyncIOMotorDatabase) -> List[Job]:
+    cursor = get_job_db(db).find({"expires_at": {"$lte": datetime.now(timezone.utc)}})
+    return [Job(**job) async for job in cursor]
+
+
+async def delete_job(db: AsyncIOMotorDatabase, job_id: str):
+    await get_job_db(db).delete_one({"job_id": job_id})
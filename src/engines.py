@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import functools
+import importlib.util
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from .lazy import np
+from .models import TransformStep
+from .predicates import Unsupported, compile_condition
+from .transformer import Transformer, TransformerRegistry, row_count
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+POLARS = "polars"
+
+
+@functools.lru_cache(maxsize=None)
+def _polars():
+    try:
+        import polars
+    except ImportError:
+        return None
+    return polars
+
+
+@dataclass
+class Engine:
+    available: Callable[[], bool]
+    # Converts a pandas frame to a lazy frame of the engine
+    load: Callable[[DataFrame], Any]
+    # Runs the query built on a lazy frame and returns a pandas frame
+    collect: Callable[[Any], DataFrame]
+
+
+def polars_available() -> bool:
+    return _polars() is not None
+
+
+def polars_installed() -> bool:
+    # Without importing polars, which is only loaded once a pipeline uses it
+    return importlib.util.find_spec(POLARS) is not None
+
+
+def polars_load(df: DataFrame):
+    # Only numeric, boolean and object columns are converted, since their
+    # values compare and sort the same way in both engines
+    if not df.columns.is_unique or not all(isinstance(col, str) for col in df.columns):
+        raise Unsupported("columns")
+    for dtype in df.dtypes:
+        if not isinstance(dtype, np.dtype) or dtype.kind not in "biufO":
+            raise Unsupported(dtype)
+    return _polars().from_pandas(df).lazy()
+
+
+def polars_collect(frame) -> DataFrame:
+    return frame.collect().to_pandas()
+
+
+ENGINES: Dict[str, Engine] = {
+    POLARS: Engine(polars_available, polars_load, polars_collect),
+}
+
+
+# Polars transformers. Each one raises Unsupported for the args whose result
+# would not match the pandas transformer.
+def polars_filter(frame, **kwargs):
+    condition = kwargs["condition"]
+    predicate = compile_condition(condition) if isinstance(condition, str) else None
+    if predicate is None:
+        raise Unsupported("filter")
+    expr = predicate.expr.polars(_polars(), frame.collect_schema())
+    return frame.filter(expr)
+
+
+def polars_rename(frame, **kwargs):
+    return frame.rename({kwargs["from"]: kwargs["to"]})
+
+
+def polars_uppercase(frame, **kwargs):
+    pl = _polars()
+    column = kwargs["column"]
+    if frame.collect_schema()[column] != pl.String:
+        raise Unsupported("uppercase")
+    return frame.with_columns(pl.col(column).str.to_uppercase())
+
+
+def polars_drop(frame, **kwargs):
+    return frame.drop(kwargs["columns"])
+
+
+def polars_fillna(frame, **kwargs):
+    pl = _polars()
+    column = kwargs["column"]
+    value = kwargs["value"]
+    dtype = frame.collect_schema()[column]
+    # Only fills that keep the column's dtype, as they do in pandas
+    if (
+        (dtype.is_float() and type(value) in (int, float))
+        or (dtype.is_integer() and type(value) is int)
+        or (dtype == pl.String and type(value) is str)
+    ):
+        return frame.with_columns(pl.col(column).fill_null(value))
+    raise Unsupported("fillna")
+
+
+def polars_sort(frame, **kwargs):
+    by = kwargs["by"]
+    ascending = kwargs.get("ascending", True)
+    by = [by] if isinstance(by, str) else by
+    if isinstance(ascending, bool):
+        descending: Any = not ascending
+    elif isinstance(ascending, list) and all(
+        isinstance(value, bool) for value in ascending
+    ):
+        descending = [not value for value in ascending]
+    else:
+        raise Unsupported("sort")
+    # Stable, with missing values last like sort_values
+    return frame.sort(by, descending=descending, nulls_last=True, maintain_order=True)
+
+
+def polars_limit(frame, **kwargs):
+    return frame.head(row_count(kwargs["n"], "n"))
+
+
+def polars_topk(frame, **kwargs):
+    frame = polars_sort(frame, by=kwargs["by"], ascending=kwargs.get("ascending", True))
+    return polars_limit(frame, n=kwargs["n"])
+
+
+POLARS_TRANSFORMERS = {
+    "filter": polars_filter,
+    "rename": polars_rename,
+    "uppercase": polars_uppercase,
+    "drop": polars_drop,
+    "fillna": polars_fillna,
+    "sort": polars_sort,
+    "limit": polars_limit,
+    "head": polars_limit,
+    "topk": polars_topk,
+}
+
+
+def register_engine_transformers(registry: TransformerRegistry):
+    # Engines whose library is not installed are left out
+    if polars_installed():
+        for name, func in POLARS_TRANSFORMERS.items():
+            registry.register(name, Transformer(func=func), engine=POLARS)
+
+
+def run_engine(
+    engine: str,
+    pipeline: List[TransformStep],
+    df: DataFrame,
+    registry: TransformerRegistry,
+) -> Optional[DataFrame]:
+    # The steps are built into one lazy query that the engine optimizes and
+    # runs at once. None means the pipeline has to run on pandas: a step has
+    # no implementation for the engine or could give a different result
+    # there, or the query failed and pandas gives the error.
+    lazy = ENGINES.get(engine)
+    transformers = [registry.get(step.name, engine) for step in pipeline]
+    if lazy is None or not lazy.available() or None in transformers:
+        return None
+    try:
+        frame = lazy.load(df)
+        for step, transformer in zip(pipeline, transformers):
+            frame = transformer.run(frame, **step.args)
+        return lazy.collect(frame)
+    except Exception:
+        return None
@@ -0,0 +1,92 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, Request
+
+from .logger import get_logger
+from .status import ClientDisconnected, PipelineTimeout
+
+BACKENDS = ("inline", "thread", "process")
+DISCONNECT_POLL_INTERVAL = 0.5
+DEFAULT_TIMEOUT = object()
+
+
+class PipelineExecutor:
+    def __init__(
+        self,
+        backend: str = "thread",
+        max_workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unsupported executor backend '{backend}', expected one of {BACKENDS}"
+            )
+        self.backend = backend
+        self.timeout = timeout
+        self.pool: Optional[Executor] = None
+        if backend == "thread":
+            self.pool = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="pipeline"
+            )
+        elif backend == "process":
+            self.pool = ProcessPoolExecutor(max_workers=max_workers)
+
+    async def run(
+        self,
+        request: Optional[Request],
+        func: Callable[..., Any],
+        *args,
+        timeout: Any = DEFAULT_TIMEOUT,
+    ):
+        if self.pool is None:
+            return func(*args)
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.timeout
+
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(self.pool, _call, func, *args)
+        waiters = {job}
+        watcher = None
+        if request is not None:
+            watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+            waiters.add(watcher)
+
+        try:
+            done, _ = await asyncio.wait(
+                waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+        if job in done:
+            return job.result()
+
+        # Jobs that have not started yet are dropped from the pool queue. A job
+        # that is already running cannot be interrupted and finishes in the
+        # background; its result is discarded.
+        job.cancel()
+        if watcher is not None and watcher in done:
+            get_logger("executor").info("Client disconnected, pipeline cancelled")
+            raise ClientDisconnected()
+        raise PipelineTimeout(f"Pipeline timed out after {timeout}s")
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def _wait_for_disconnect(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+def _call(func: Callable[..., Any], *args):
+    try:
+        return func(*args)
+    except HTTPException as e:
+        # An HTTPException built with keyword arguments cannot be unpickled,
+        # which would break the process pool
+        raise HTTPException(e.status_code, e.detail, e.headers)
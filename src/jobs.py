@@ -0,0 +1,325 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from .config import JOB_DIR
+from .db import (
+    create_job,
+    delete_job,
+    get_expired_jobs,
+    get_job,
+    get_unfinished_jobs,
+    update_job,
+)
+from .executor import PipelineExecutor
+from .logger import get_logger
+from .models import Job, JobStatus
+from .status import QueueFull
+
+# Lanes in priority order
+LANES = ("admin", "user", "anonymous")
+JOB_FILES = ("input", "progress", "arrow", "arrow.tmp")
+PROGRESS_INTERVAL = 0.5
+DEFAULT_JOB_SECONDS = 10.0
+
+
+def job_lane(username: Optional[str], allowed) -> str:
+    if username is None:
+        return "anonymous"
+    return "admin" if allowed is None else "user"
+
+
+def job_path(job_id: str, kind: str) -> str:
+    return os.path.join(JOB_DIR, f"{job_id}.{kind}")
+
+
+def remove_job_files(job_id: str, kinds=JOB_FILES):
+    for kind in kinds:
+        try:
+            os.remove(job_path(job_id, kind))
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def job_result(result_path: str, input_path: str) -> Iterator[str]:
+    # Gives the temporary path a job writes its result to, which becomes the
+    # result once written. The queue removes the input of a job it gave up
+    # on, e.g. after a timeout, so such a job leaves no result behind.
+    tmp_path = f"{result_path}.tmp"
+    yield tmp_path
+    os.replace(tmp_path, result_path)
+    if not os.path.exists(input_path):
+        os.remove(result_path)
+
+
+class ProgressReporter:
+    # Written to a file so jobs running in another process can report it
+    def __init__(self, path: str):
+        self.path = path
+        self.reported_at = 0.0
+
+    def __call__(self, fraction: float):
+        now = time.monotonic()
+        if fraction < 1 and now - self.reported_at < PROGRESS_INTERVAL:
+            return
+        self.reported_at = now
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(str(min(max(fraction, 0.0), 1.0)))
+        os.replace(tmp_path, self.path)
+
+
+def read_progress(path: str) -> Optional[float]:
+    try:
+        with open(path) as file:
+            return float(file.read())
+    except (OSError, ValueError):
+        return None
+
+
+class MongoJobStore:
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    async def create(self, job: Job):
+        await create_job(self.db, job)
+
+    async def update(self, job_id: str, **fields):
+        await update_job(self.db, job_id, fields)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await get_job(self.db, job_id)
+
+    async def get_unfinished(self) -> List[Job]:
+        return await get_unfinished_jobs(self.db)
+
+    async def get_expired(self) -> List[Job]:
+        return await get_expired_jobs(self.db)
+
+    async def delete(self, job_id: str):
+        await delete_job(self.db, job_id)
+
+
+class MemoryJobStore:
+    # Same interface as MongoJobStore, for tests and single-process setups
+    # that do not need jobs to outlive the server
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+
+    async def create(self, job: Job):
+        self.jobs[job.job_id] = job.model_copy()
+
+    async def update(self, job_id: str, **fields):
+        if job_id in self.jobs:
+            self.jobs[job_id] = self.jobs[job_id].model_copy(update=fields)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        return job.model_copy() if job else None
+
+    async def get_unfinished(self) -> List[Job]:
+        return [
+            job.model_copy()
+            for job in self.jobs.values()
+            if job.status in (JobStatus.queued, JobStatus.running)
+        ]
+
+    async def get_expired(self) -> List[Job]:
+        now = datetime.now(timezone.utc)
+        return [
+            job.model_copy()
+            for job in self.jobs.values()
+            if job.expires_at is not None and job.expires_at <= now
+        ]
+
+    async def delete(self, job_id: str):
+        self.jobs.pop(job_id, None)
+
+
+@dataclass
+class QueuedJob:
+    job: Job
+    # Caps are applied per user, and per client address for anonymous jobs
+    owner_key: str
+    func: Callable[..., Any]
+    args: tuple
+
+
+class JobQueue:
+    # Jobs wait in one lane per priority and are run by a fixed number of
+    # workers on the pipeline executor. A worker takes the oldest job of the
+    # highest lane whose owner is below the running cap.
+    def __init__(
+        self,
+        store,
+        executor: PipelineExecutor,
+        workers: int,
+        max_queued: int,
+        max_queued_per_user: int,
+        max_running_per_user: int,
+        timeout: Optional[float],
+        result_ttl: int,
+    ):
+        self.store = store
+        self.executor = executor
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.max_running_per_user = max_running_per_user
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self.lanes: Dict[str, Deque[QueuedJob]] = {lane: deque() for lane in LANES}
+        self.queued_by_owner: Counter = Counter()
+        self.running_by_owner: Counter = Counter()
+        self.changed = asyncio.Condition()
+        self.tasks: List[asyncio.Task] = []
+        self.mean_seconds: Optional[float] = None
+
+    async def start(self):
+        os.makedirs(JOB_DIR, exist_ok=True)
+        # Jobs queued or running when the server stopped are lost
+        for job in await self.store.get_unfinished():
+            await self._finish(
+                job.job_id,
+                JobStatus.failed,
+                error={"status_code": 503, "detail": "Job interrupted by a restart"},
+            )
+            remove_job_files(job.job_id)
+        await self.purge_expired()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def purge_expired(self):
+        for job in await self.store.get_expired():
+            await self.store.delete(job.job_id)
+            remove_job_files(job.job_id)
+
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def retry_after(self) -> int:
+        # Time for the workers to get through the current queue
+        seconds = self.mean_seconds or DEFAULT_JOB_SECONDS
+        waves = math.ceil((self.queued() + 1) / max(self.workers, 1))
+        return max(1, min(3600, math.ceil(seconds * waves)))
+
+    def check_capacity(self, owner_key: str):
+        if self.queued() >= self.max_queued:
+            raise QueueFull(self.retry_after())
+        if self.queued_by_owner[owner_key] >= self.max_queued_per_user:
+            raise QueueFull(self.retry_after(), "Too many queued jobs")
+
+    async def submit(self, queued_job: QueuedJob):
+        async with self.changed:
+            self.check_capacity(queued_job.owner_key)
+            await self.store.create(queued_job.job)
+            self.lanes[queued_job.job.lane].append(queued_job)
+            self.queued_by_owner[queued_job.owner_key] += 1
+            self.changed.notify()
+
+    async def cancel(self, job_id: str) -> bool:
+        async with self.changed:
+            for lane in self.lanes.values():
+                for queued_job in lane:
+                    if queued_job.job.job_id == job_id:
+                        lane.remove(queued_job)
+                        self.queued_by_owner[queued_job.owner_key] -= 1
+                        await self._finish(job_id, JobStatus.cancelled)
+                        remove_job_files(job_id)
+                        return True
+        return False
+
+    def position(self, job_id: str) -> Optional[int]:
+        position = 0
+        for lane in LANES:
+            for queued_job in self.lanes[lane]:
+                if queued_job.job.job_id == job_id:
+                    return position
+                position += 1
+        return None
+
+    def _take(self) -> Optional[QueuedJob]:
+        for lane in LANES:
+            for queued_job in self.lanes[lane]:
+                if self.running_by_owner[queued_job.owner_key] < self.max_running_per_user:
+                    self.lanes[lane].remove(queued_job)
+                    self.queued_by_owner[queued_job.owner_key] -= 1
+                    self.running_by_owner[queued_job.owner_key] += 1
+                    return queued_job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self.changed:
+                while (queued_job := self._take()) is None:
+                    await self.changed.wait()
+            try:
+                await self._run(queued_job)
+            except Exception as e:
+                # A store that cannot be reached fails the job, not the worker
+                get_logger("jobs").exception(
+                    f"Job '{queued_job.job.job_id}' could not be run: {e}"
+                )
+            finally:
+                async with self.changed:
+                    self.running_by_owner[queued_job.owner_key] -= 1
+                    self.changed.notify_all()
+
+    async def _run(self, queued_job: QueuedJob):
+        job_id = queued_job.job.job_id
+        started = time.monotonic()
+        succeeded = False
+        try:
+            await self.store.update(
+                job_id, status=JobStatus.running, started_at=datetime.now(timezone.utc)
+            )
+            info = await self.executor.run(
+                None, queued_job.func, *queued_job.args, timeout=self.timeout
+            )
+        except HTTPException as e:
+            await self._finish(
+                job_id,
+                JobStatus.failed,
+                error={"status_code": e.status_code, "detail": e.detail},
+            )
+        except Exception as e:
+            get_logger("jobs").exception(f"Job '{job_id}' failed: {e}")
+            await self._finish(
+                job_id,
+                JobStatus.failed,
+                error={"status_code": 500, "detail": "Job failed"},
+            )
+        else:
+            succeeded = True
+            await self._finish(job_id, JobStatus.succeeded, progress=1.0, **info)
+            elapsed = time.monotonic() - started
+            if self.mean_seconds is None:
+                self.mean_seconds = elapsed
+            else:
+                self.mean_seconds = 0.8 * self.mean_seconds + 0.2 * elapsed
+        finally:
+            remove_job_files(job_id, ("input", "progress") if succeeded else JOB_FILES)
+
+    async def _finish(self, job_id: str, status: JobStatus, **fields):
+        now = datetime.now(timezone.utc)
+        await self.store.update(
+            job_id,
+            status=status,
+            finished_at=now,
+            expires_at=now + timedelta(seconds=self.result_ttl),
+            **fields,
+        )
@@ -0,0 +1,63 @@
+import importlib
+import os
+import sys
+from types import ModuleType
+from typing import Callable, Iterable, Optional
+
+from .config import COPY_ON_WRITE
+
+# Modules the pipeline code needs, but the app does not need to start serving
+HEAVY_MODULES = ("numpy", "pandas", "pyarrow")
+
+
+class LazyModule:
+    # Stands in for a module that is only imported when one of its attributes
+    # is first used. Imports hold a lock per module, so threads that get here
+    # at once import it only once. `on_load` sets the module up before it is
+    # first used through the proxy.
+    def __init__(
+        self, name: str, on_load: Optional[Callable[[ModuleType], None]] = None
+    ):
+        self._name = name
+        self._on_load = on_load
+        self._module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._on_load is not None:
+                self._on_load(module)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}'>"
+
+
+def configure_pandas(pandas: ModuleType):
+    # With copy-on-write, steps that return a new frame share the columns
+    # they do not change with their input instead of copying them
+    pandas.set_option("mode.copy_on_write", COPY_ON_WRITE)
+
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas", on_load=configure_pandas)
+
+
+def preload(names: Iterable[str] = HEAVY_MODULES):
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    for module in (np, pd):
+        if module._name in sys.modules:
+            module._load()
+
+
+# A process forked while another thread imports one of these modules inherits
+# the half done import and hangs on it, so they are imported before forking
+os.register_at_fork(before=preload)
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from .config import LOOKUP_DIR, LOOKUP_MAX_BYTES
+from .lazy import np, pd
+from .memory import frame_bytes
+from .models import Lookup
+from .planner import as_column_list
+from .transformer import Schema, Transformer, TransformerRegistry, is_string_dtype
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+LOOKUP_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Arrow schema metadata of stored tables
+KEY_METADATA = b"lookup_key"
+ROWS_METADATA = b"lookup_rows"
+BYTES_METADATA = b"lookup_bytes"
+
+
+class LookupTable:
+    # A reference table held in memory with a hash index on its key columns
+    def __init__(self, df: DataFrame, key: List[Any]):
+        if not df.columns.is_unique:
+            raise ValueError("Lookup table columns must be unique")
+        if not key:
+            raise ValueError("Lookup table key must name at least one column")
+        for col in key:
+            if col not in df.columns:
+                raise ValueError(f"Missing key column '{col}' in lookup table")
+        if df[key].isna().to_numpy().any():
+            raise ValueError(f"Lookup table key {key} has missing values")
+
+        self.frame = df
+        self.key = list(key)
+        if len(key) == 1:
+            self.index = pd.Index(df[key[0]])
+        else:
+            self.index = pd.MultiIndex.from_arrays([df[col] for col in key])
+        if not self.index.is_unique:
+            raise ValueError(f"Lookup table key {key} has duplicate values")
+        # The hash table is built now rather than by the first join
+        self.index.get_indexer(self.index[:1])
+        self.nbytes = frame_bytes(df) + self.index.memory_usage()
+
+    def metadata(self) -> Dict[bytes, bytes]:
+        return {
+            KEY_METADATA: json.dumps(self.key).encode(),
+            ROWS_METADATA: str(len(self.frame)).encode(),
+            BYTES_METADATA: str(self.nbytes).encode(),
+        }
+
+    def positions(self, df: DataFrame, on: List[Any]) -> np.ndarray:
+        # The table row of each row of df, -1 where there is none
+        if len(on) > 1:
+            return self.index.get_indexer(
+                pd.MultiIndex.from_arrays([df[col] for col in on])
+            )
+        values = df[on[0]]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Each category is looked up once
+            codes = values.cat.codes.to_numpy()
+            found = self.index.get_indexer(values.cat.categories)
+            return np.where(codes >= 0, found[codes], -1)
+        return self.index.get_indexer(values)
+
+
+def valid_lookup_name(name: Any) -> bool:
+    return isinstance(name, str) and LOOKUP_NAME.match(name) is not None
+
+
+def lookup_path(name: str) -> str:
+    return os.path.join(LOOKUP_DIR, f"{name}.arrow")
+
+
+def read_lookup(path: str) -> LookupTable:
+    import pyarrow as pa
+
+    # Numeric columns stay memory-mapped, so processes that load the same
+    # table share their pages
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    key = json.loads(table.schema.metadata[KEY_METADATA])
+    return LookupTable(table.to_pandas(split_blocks=True), key)
+
+
+def lookup_info(name: str) -> Optional[Lookup]:
+    import pyarrow as pa
+
+    path = lookup_path(name)
+    try:
+        schema = pa.ipc.open_file(pa.memory_map(path)).schema
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    metadata = schema.metadata
+    return Lookup(
+        name=name,
+        key=json.loads(metadata[KEY_METADATA]),
+        rows=int(metadata[ROWS_METADATA]),
+        columns=[str(col) for col in schema.names],
+        size_bytes=int(metadata[BYTES_METADATA]),
+        updated_at=datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+    )
+
+
+def list_lookups() -> List[Lookup]:
+    try:
+        names = sorted(os.listdir(LOOKUP_DIR))
+    except FileNotFoundError:
+        return []
+    lookups = []
+    for filename in names:
+        name, ext = os.path.splitext(filename)
+        if ext == ".arrow" and valid_lookup_name(name):
+            info = lookup_info(name)
+            if info is not None:
+                lookups.append(info)
+    return lookups
+
+
+def remove_lookup(name: str) -> bool:
+    try:
+        os.remove(lookup_path(name))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def lookups_version() -> str:
+    # Changes whenever a table is stored, replaced or removed, so cached
+    # results of pipelines that join them are not reused
+    try:
+        with os.scandir(LOOKUP_DIR) as entries:
+            versions = sorted(
+                (entry.name, entry.inode(), entry.stat().st_mtime_ns)
+                for entry in entries
+                if entry.name.endswith(".arrow")
+            )
+    except FileNotFoundError:
+        return ""
+    return json.dumps(versions)
+
+
+# Tables loaded by this process, least recently used first, with the file
+# version they were read from
+_tables: OrderedDict[str, Tuple[Tuple[int, int, int], LookupTable]] = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def get_lookup(name: Any) -> LookupTable:
+    # Tables are read once and read again when their file is replaced
+    if not valid_lookup_name(name):
+        raise ValueError(f"Lookup table '{name}' not found")
+    path = lookup_path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        with _tables_lock:
+            _tables.pop(name, None)
+        raise ValueError(f"Lookup table '{name}' not found")
+    version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _tables_lock:
+        cached = _tables.get(name)
+        if cached is not None and cached[0] == version:
+            _tables.move_to_end(name)
+            return cached[1]
+
+    # Read without the lock, so loading a large table does not hold up joins
+    # on the others. Two joins may both read a table that is not loaded yet;
+    # the last one read is kept.
+    try:
+        table = read_lookup(path)
+    except FileNotFoundError:
+        raise ValueError(f"Lookup table '{name}' not found")
+    with _tables_lock:
+        _tables[name] = (version, table)
+        _tables.move_to_end(name)
+        # Past the cap, the least recently used tables are dropped until they
+        # are joined again
+        total = sum(loaded.nbytes for _, loaded in _tables.values())
+        while 0 < LOOKUP_MAX_BYTES < total and len(_tables) > 1:
+            _, (_, evicted) = _tables.popitem(last=False)
+            total -= evicted.nbytes
+        return table
+
+
+def key_kind(dtype) -> Optional[str]:
+    # Keys of different kinds never compare equal
+    if pd.api.types.is_bool_dtype(dtype):
+        return "boolean"
+    if pd.api.types.is_numeric_dtype(dtype):
+        return "numeric"
+    if is_string_dtype(dtype):
+        return "string"
+    return None
+
+
+def join_args(kwargs: Dict[str, Any]) -> Tuple[LookupTable, List[Any], List[Any], str]:
+    name = kwargs["table"]
+    table = get_lookup(name)
+    on = as_column_list(kwargs["on"])
+    if len(on) != len(table.key):
+        raise ValueError(
+            f"'on' must name one column for each column of the key "
+            f"{table.key} of lookup table '{name}'"
+        )
+
+    columns = kwargs.get("columns")
+    if columns is None:
+        columns = [col for col in table.frame.columns if col not in table.key]
+    else:
+        columns = as_column_list(columns)
+        for col in columns:
+            if col not in table.frame.columns:
+                raise ValueError(f"Missing column '{col}' in lookup table '{name}'")
+
+    how = kwargs.get("how", "left")
+    if how not in ("left", "inner"):
+        raise ValueError("'how' must be 'left' or 'inner'")
+    return table, on, columns, how
+
+
+class JoinTransformer(Transformer):
+    # The key columns are checked against the key of the lookup table, so
+    # their expected types are only known once the table is loaded
+    def _validate(
+        self, columns, get_dtype: Callable[[Any], Any], kwargs: Dict[str, Any]
+    ):
+        super()._validate(columns, get_dtype, kwargs)
+        table, on, added, _ = join_args(kwargs)
+        for col, key in zip(on, table.key):
+            if col not in columns:
+                raise ValueError(
+                    f"Missing column '{col}' in DataFrame (from kwarg 'on')"
+                )
+            actual_dtype = get_dtype(col)
+            expected_type = key_kind(table.frame[key].dtype)
+            if (
+                actual_dtype is not None
+                and expected_type is not None
+                and key_kind(actual_dtype) != expected_type
+            ):
+                raise TypeError(
+                    f"Column '{col}' must be of type {expected_type} to match key "
+                    f"'{key}' of lookup table '{kwargs['table']}', got "
+                    f"'{actual_dtype}'"
+                )
+        for col in added:
+            if col in columns:
+                raise ValueError(f"Column '{col}' already exists in DataFrame")
+
+
+def join_rows(df: DataFrame, **kwargs) -> DataFrame:
+    # Each row's key is looked up in the table index at once, then the table
+    # columns are taken by position. Left joins leave missing values where no
+    # row matches; inner joins drop those rows.
+    table, on, columns, how = join_args(kwargs)
+    positions = table.positions(df, on)
+    if how == "inner":
+        matched = positions >= 0
+        if not matched.all():
+            df = df[matched]
+            positions = positions[matched]
+
+    out = df.copy(deep=False)
+    for col in columns:
+        values = table.frame[col]
+        values = (
+            values.to_numpy() if isinstance(values.dtype, np.dtype) else values.array
+        )
+        out[col] = pd.api.extensions.take(
+            values, positions, allow_fill=how == "left"
+        )
+    return out
+
+
+def join_schema(schema: Schema, **kwargs) -> Schema:
+    table, _, columns, how = join_args(kwargs)
+    schema = dict(schema)
+    for col in columns:
+        dtype = table.frame[col].dtype
+        # Integer and boolean columns of a left join become float or object
+        # only when a row has no match
+        if how == "left" and isinstance(dtype, np.dtype) and dtype.kind in "biu":
+            dtype = None
+        schema[col] = dtype
+    return schema
+
+
+def register_lookup_transformers(registry: TransformerRegistry):
+    for name in ("join", "lookup"):
+        registry.register(
+            name,
+            JoinTransformer(
+                func=join_rows,
+                required_args=["table", "on"],
+                row_local=True,
+                output_schema=join_schema,
+            ),
+        )
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import sys
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from .config import COMPACT_DTYPES, MEMORY_BUDGET_BYTES
+from .lazy import np, pd
+from .models import TransformStep
+from .planner import PlanNode, as_column_list, columns_read, is_noop
+from .status import MemoryBudgetExceeded
+from .transformer import Schema, frame_schema, is_string_dtype
+
+if TYPE_CHECKING:
+    from pandas import DataFrame, Series
+
+# Frames with fewer rows are not worth compacting
+COMPACT_MIN_ROWS = 1000
+# String columns become categorical when at most this share of values differ
+CATEGORY_MAX_UNIQUE = 0.5
+# Values sampled to estimate how repetitive a column is and how big its
+# strings are
+SAMPLE_SIZE = 1000
+
+
+def passthrough_columns(
+    pipeline: List[TransformStep], schema: Schema
+) -> Optional[Dict[Any, Any]]:
+    # The input columns whose values no step reads, by their name in the
+    # output, following renames. None when a step reads columns it does not
+    # name, or a rename lands on another column.
+    origin = {col: col for col in schema}
+    read: Set[Any] = set()
+    for step in pipeline:
+        node = PlanNode(step.name, step.args)
+        if step.name == "rename" and step.args.get("from") in origin:
+            # Renames check that the column holds strings and report its
+            # dtype otherwise
+            source = origin[step.args["from"]]
+            if not is_string_dtype(schema[source]):
+                read.add(source)
+        if is_noop(node):
+            continue
+        if step.name == "drop":
+            for col in as_column_list(step.args.get("columns")):
+                origin.pop(col, None)
+        elif step.name == "rename":
+            if step.args.get("from") in origin:
+                if step.args.get("to") in origin:
+                    return None
+                origin[step.args["to"]] = origin.pop(step.args["from"])
+        else:
+            cols = columns_read(node)
+            if cols is None:
+                return None
+            read.update(origin[col] for col in cols if col in origin)
+    return {name: col for name, col in origin.items() if col not in read}
+
+
+def _owner(array: np.ndarray) -> np.ndarray:
+    # The array that holds the memory a view looks into
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def _sample(values: np.ndarray) -> np.ndarray:
+    return values[:: max(1, len(values) // SAMPLE_SIZE)]
+
+
+def compact_column(series: Series) -> Optional[Series]:
+    if not isinstance(series.dtype, np.dtype):
+        return None
+    values = series.to_numpy()
+
+    if values.dtype == object:
+        # Sampling first skips the full pass over columns of unique strings
+        sample = _sample(values)
+        if (
+            pd.api.types.infer_dtype(sample, skipna=True) != "string"
+            or pd.unique(sample).size > CATEGORY_MAX_UNIQUE * len(sample)
+            or pd.api.types.infer_dtype(values, skipna=True) != "string"
+        ):
+            return None
+        compacted = series.astype("category")
+        if len(compacted.cat.categories) > CATEGORY_MAX_UNIQUE * len(series):
+            return None
+        return compacted
+
+    # Arrays read zero-copy from a file are left where they are
+    if values.dtype.kind in "iu" and _owner(values).base is None:
+        compacted = pd.to_numeric(
+            series, downcast="integer" if values.dtype.kind == "i" else "unsigned"
+        )
+        if compacted.dtype != series.dtype:
+            return compacted
+    return None
+
+
+def compact_frame(
+    df: DataFrame, pipeline: List[TransformStep]
+) -> Tuple[DataFrame, Dict[Any, Any]]:
+    # Stores the columns that the pipeline passes through untouched in less
+    # memory: repetitive strings as categoricals and integers in the
+    # narrowest dtype that holds them. Returns the frame and the dtypes to
+    # restore, by output column, so the result is the same as without it.
+    if not COMPACT_DTYPES or len(df) < COMPACT_MIN_ROWS:
+        return df, {}
+    schema = frame_schema(df)
+    if schema is None:
+        return df, {}
+    try:
+        passthrough = passthrough_columns(pipeline, schema)
+    except TypeError:
+        # Unhashable arguments, left for the pipeline checks to reject
+        return df, {}
+    if not passthrough:
+        return df, {}
+    inputs = {col: name for name, col in passthrough.items()}
+
+    columns = {}
+    dtypes = {}
+    for col in inputs:
+        compacted = compact_column(df[col])
+        if compacted is not None:
+            columns[col] = compacted
+            dtypes[inputs[col]] = df[col].dtype
+    if not columns:
+        return df, {}
+
+    # Columns of one dtype may share a single block, which stays alive as
+    # long as any of them does. The others of each block with a compacted
+    # column are copied out so that the whole block is freed with the input.
+    owners = {
+        id(_owner(df[col].to_numpy()))
+        for col in columns
+        if isinstance(df[col].dtype, np.dtype)
+    }
+    out = df.copy(deep=False)
+    for col in df.columns:
+        if col in columns:
+            out[col] = columns[col]
+        elif (
+            isinstance(df[col].dtype, np.dtype)
+            and id(_owner(df[col].to_numpy())) in owners
+        ):
+            out[col] = df[col].copy()
+    return out, dtypes
+
+
+def restore_dtypes(df: DataFrame, dtypes: Dict[Any, Any]) -> DataFrame:
+    changed = {
+        col: dtype
+        for col, dtype in dtypes.items()
+        if col in df.columns and df[col].dtype != dtype
+    }
+    return df.astype(changed) if changed else df
+
+
+def _array_bytes(values: np.ndarray, seen: Set[int]) -> int:
+    # Arrays shared between frames, as copy-on-write leaves them, count once.
+    # Strings are sized from a sample.
+    key = values.__array_interface__["data"][0]
+    if key in seen:
+        return 0
+    seen.add(key)
+    nbytes = values.nbytes
+    if values.dtype == object and len(values):
+        sample = _sample(values)
+        nbytes += sum(map(sys.getsizeof, sample)) * len(values) // len(sample)
+    return nbytes
+
+
+def frame_bytes(*frames: DataFrame) -> int:
+    # Estimated memory held by the frames together
+    seen: Set[int] = set()
+    total = 0
+    for df in frames:
+        if id(df.index) not in seen:
+            seen.add(id(df.index))
+            total += df.index.memory_usage()
+        for i in range(df.shape[1]):
+            values = df.iloc[:, i].array
+            if isinstance(values, pd.Categorical):
+                total += _array_bytes(values.codes, seen)
+                total += _array_bytes(values.categories.to_numpy(), seen)
+            elif isinstance(values, pd.arrays.NumpyExtensionArray):
+                total += _array_bytes(values.to_numpy(), seen)
+            else:
+                total += values.nbytes
+    return total
+
+
+def _mib(nbytes: int) -> str:
+    return f"{nbytes / (1024 * 1024):.1f} MiB"
+
+
+def check_size(what: str, nbytes: int):
+    # Fails a request whose input alone is over the budget before it is parsed
+    if 0 < MEMORY_BUDGET_BYTES < nbytes:
+        raise MemoryBudgetExceeded(
+            f"{what} is {_mib(nbytes)}, over the memory budget of "
+            f"{_mib(MEMORY_BUDGET_BYTES)}"
+        )
+
+
+def check_budget(what: str, *frames: DataFrame):
+    if MEMORY_BUDGET_BYTES <= 0:
+        return
+    nbytes = frame_bytes(*frames)
+    if nbytes > MEMORY_BUDGET_BYTES:
+        raise MemoryBudgetExceeded(
+            f"{what} needs about {_mib(nbytes)}, over the memory budget of "
+            f"{_mib(MEMORY_BUDGET_BYTES)}"
+        )
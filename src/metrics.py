@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+
+SECONDS_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+ROWS_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+
+
+@dataclass
+class Phase:
+    name: str
+    seconds: float
+    # Transformer name and step labels for pipeline steps
+    transformer: Optional[str] = None
+    label: Optional[str] = None
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    # Change in the size of the frame's arrays, not counting the objects that
+    # object columns point to
+    bytes_delta: Optional[int] = None
+
+
+@dataclass
+class Trace:
+    phases: List[Phase] = field(default_factory=list)
+    # The whole request up to the response, including the wait for a worker
+    total: float = 0.0
+    # Names of the steps the job was asked to run, for admission control
+    steps: List[str] = field(default_factory=list)
+    # Without timing only the steps are recorded
+    timing: bool = True
+
+    def server_timing(self) -> str:
+        entries = []
+        step = 0
+        for phase in self.phases:
+            if phase.transformer is None:
+                entries.append(f"{phase.name};dur={phase.seconds * 1000:.3f}")
+                continue
+            step += 1
+            desc = (
+                f"{phase.label}: {phase.rows_in} -> {phase.rows_out} rows, "
+                f"{phase.bytes_delta:+d} B"
+            )
+            entries.append(f'step-{step};desc="{desc}";dur={phase.seconds * 1000:.3f}')
+        entries.append(f"total;dur={self.total * 1000:.3f}")
+        return ", ".join(entries)
+
+    def describe(self) -> str:
+        parts = []
+        for phase in self.phases:
+            if phase.transformer is None:
+                parts.append(f"{phase.name} {phase.seconds:.3f}s")
+            else:
+                parts.append(
+                    f"{phase.label} {phase.seconds:.3f}s "
+                    f"({phase.rows_in} -> {phase.rows_out} rows)"
+                )
+        return ", ".join(parts)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def traced(timing: bool, func: Callable[..., Any], *args) -> Tuple[Any, Trace]:
+    # Runs an executor job with a trace that the pipeline code records its
+    # phases into. Module-level, so the process backend can pickle it.
+    trace = Trace(timing=timing)
+    token = _trace.set(trace)
+    try:
+        return func(*args), trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def phase(name: str):
+    trace = _trace.get()
+    if trace is None or not trace.timing:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.phases.append(Phase(name, time.perf_counter() - start))
+
+
+def record_steps(steps: Iterable[str]):
+    trace = _trace.get()
+    if trace is not None:
+        trace.steps.extend(steps)
+
+
+def frame_bytes(df: DataFrame) -> int:
+    # Worked out from the dtypes, as DataFrame.memory_usage takes longer than
+    # many steps on small frames. Extension dtypes count as 8 bytes a value.
+    itemsize = sum(getattr(dtype, "itemsize", 8) for dtype in df.dtypes)
+    return int(df.index.nbytes) + len(df) * itemsize
+
+
+def trace_step(
+    trace: Trace,
+    transformer: str,
+    label: str,
+    df: DataFrame,
+    run: Callable[[], DataFrame],
+) -> DataFrame:
+    # The input is measured first, as steps may write to the frame they get
+    rows_in, bytes_in = len(df), frame_bytes(df)
+    start = time.perf_counter()
+    out = run()
+    seconds = time.perf_counter() - start
+    trace.phases.append(
+        Phase(
+            "step",
+            seconds,
+            transformer,
+            label,
+            rows_in,
+            len(out),
+            frame_bytes(out) - bytes_in,
+        )
+    )
+    return out
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = SECONDS_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count per bucket, sum and count of observations
+        self.series: Dict[Tuple[str, ...], List[Any]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            series = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self.series.items()
+            )
+        for key, (counts, total, count) in series:
+            labels = [
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labelnames, key)
+            ]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = ",".join([*labels, f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            bucket_labels = ",".join([*labels, 'le="+Inf"'])
+            lines.append(f"{self.name}_bucket{{{bucket_labels}}} {count}")
+            lines.append(f"{self.name}_sum{{{','.join(labels)}}} {total}")
+            lines.append(f"{self.name}_count{{{','.join(labels)}}} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metrics of this process, in the Prometheus text format
+PIPELINE_SECONDS = Histogram(
+    "transform_request_seconds",
+    "Time to run a transform request, from the request to the response",
+    ["endpoint", "role"],
+)
+PHASE_SECONDS = Histogram(
+    "transform_phase_seconds",
+    "Time spent in the phases of a transform other than pipeline steps",
+    ["phase", "role"],
+)
+STEP_SECONDS = Histogram(
+    "transform_step_seconds",
+    "Time spent running a pipeline step",
+    ["transformer", "role"],
+)
+STEP_ROWS = Histogram(
+    "transform_step_input_rows",
+    "Rows a pipeline step was run on",
+    ["transformer", "role"],
+    ROWS_BUCKETS,
+)
+HISTOGRAMS = [PIPELINE_SECONDS, PHASE_SECONDS, STEP_SECONDS, STEP_ROWS]
+
+
+def record_trace(trace: Trace, endpoint: str, role: str):
+    PIPELINE_SECONDS.observe(trace.total, endpoint=endpoint, role=role)
+    for phase in trace.phases:
+        if phase.transformer is None:
+            PHASE_SECONDS.observe(phase.seconds, phase=phase.name, role=role)
+        else:
+            STEP_SECONDS.observe(
+                phase.seconds, transformer=phase.transformer, role=role
+            )
+            STEP_ROWS.observe(phase.rows_in, transformer=phase.transformer, role=role)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for h in HISTOGRAMS for line in h.render()) + "\n"
@@ -1,7 +1,8 @@
+from datetime import datetime
 from enum import Enum
 from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, SkipValidation, model_validator
 
 
 class TransformStep(BaseModel):
@@ -9,15 +10,59 @@ class TransformStep(BaseModel):
     args: Dict[str, Any] = {}
 
 
-class TransformRequest(BaseModel):
-    data: List[Dict[str, Any]]
+class TransformInput(BaseModel):
+    # Only the pipelines are validated by Pydantic. Row or column data is
+    # passed through as decoded and checked in bulk when the DataFrame is built.
+    data: SkipValidation[Optional[List[Dict[str, Any]]]] = None
+    columns: SkipValidation[Optional[Dict[str, List[Any]]]] = None
+
+
+class TransformRequest(TransformInput):
     pipeline: List[TransformStep]
 
 
+class BatchTransformRequest(TransformInput):
+    pipelines: List[List[TransformStep]] = Field(min_length=1)
+
+
 class TransformConfig(BaseModel):
     enabled_transforms: List[str]
 
 
+class UserTransformConfig(TransformConfig):
+    username: str
+
+
+class BulkTransformConfig(BaseModel):
+    users: List[UserTransformConfig] = Field(min_length=1)
+
+
+# bcrypt hashes, e.g. exported from another deployment
+BCRYPT_HASH_PATTERN = r"^\$2[aby]\$\d\d\$[./A-Za-z0-9]{53}$"
+
+
+class NewUser(BaseModel):
+    username: str = Field(min_length=1)
+    # Exactly one of the password or its bcrypt hash. Users given by hash are
+    # created without hashing anything.
+    password: Optional[str] = Field(None, min_length=1)
+    hashed_password: Optional[str] = Field(None, pattern=BCRYPT_HASH_PATTERN)
+    # None for the DEFAULT_TRANSFORMS
+    enabled_transforms: Optional[List[str]] = None
+
+    @model_validator(mode="after")
+    def check_password(self):
+        if (self.password is None) == (self.hashed_password is None):
+            raise ValueError(
+                "Exactly one of 'password' or 'hashed_password' is required"
+            )
+        return self
+
+
+class BulkRegisterRequest(BaseModel):
+    users: List[NewUser] = Field(min_length=1)
+
+
 class UserRole(str, Enum):
     user = "user"
     admin = "admin"
@@ -28,3 +73,54 @@ class User(BaseModel):
     hashed_password: str
     role: UserRole = UserRole.user
     allowed_transforms: Optional[List[str]] = Field(default_factory=list)
+    # Bytes of stored datasets, None meaning the DATASET_QUOTA_BYTES default
+    dataset_quota_bytes: Optional[int] = None
+
+
+class DatasetQuota(BaseModel):
+    quota_bytes: Optional[int] = Field(None, ge=0)
+
+
+class Dataset(BaseModel):
+    dataset_id: str
+    owner: str
+    name: str
+    format: str
+    rows: int
+    columns: List[str]
+    size_bytes: int
+    created_at: datetime
+    expires_at: datetime
+
+
+class Lookup(BaseModel):
+    name: str
+    key: List[str]
+    rows: int
+    columns: List[str]
+    # Estimated memory the table and its index take once loaded
+    size_bytes: int
+    updated_at: datetime
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class Job(BaseModel):
+    job_id: str
+    owner: Optional[str] = None
+    lane: str
+    status: JobStatus = JobStatus.queued
+    progress: float = 0.0
+    error: Optional[Dict[str, Any]] = None
+    rows: Optional[int] = None
+    columns: Optional[List[str]] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import pickle
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, util
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
+
+from fastapi import HTTPException
+
+from .config import (
+    EXECUTOR_BACKEND,
+    EXECUTOR_MAX_WORKERS,
+    PARTITION_MIN_ROWS,
+    PARTITION_WORKERS,
+)
+from .lazy import pd
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class PartitionError(Exception):
+    # The pool, shared memory or pickling failed, rather than a step
+    pass
+
+
+@dataclass
+class SharedFrame:
+    # A frame pickled into a shared memory block: the pickle stream followed
+    # by its out-of-band buffers, which hold the numeric columns as raw bytes
+    name: str
+    sizes: List[int]
+
+
+def share_frame(df: DataFrame) -> SharedFrame:
+    buffers = []
+    data = pickle.dumps(df, protocol=5, buffer_callback=buffers.append)
+    parts = [memoryview(data)] + [buffer.raw() for buffer in buffers]
+    sizes = [part.nbytes for part in parts]
+
+    shm = SharedMemory(create=True, size=max(sum(sizes), 1))
+    offset = 0
+    for part, size in zip(parts, sizes):
+        shm.buf[offset : offset + size] = part
+        offset += size
+    shm.close()
+    return SharedFrame(shm.name, sizes)
+
+
+def load_frame(shared: SharedFrame) -> DataFrame:
+    # The buffers are copied out so the block can be closed at once, whatever
+    # the frame built on them is kept alive by
+    shm = SharedMemory(name=shared.name)
+    try:
+        offset = shared.sizes[0]
+        buffers = []
+        for size in shared.sizes[1:]:
+            buffers.append(bytearray(shm.buf[offset : offset + size]))
+            offset += size
+        return pickle.loads(shm.buf[: shared.sizes[0]], buffers=buffers)
+    finally:
+        shm.close()
+
+
+def unlink_frame(shared: SharedFrame):
+    try:
+        shm = SharedMemory(name=shared.name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def pool_workers() -> int:
+    # Every process of the process executor backend starts its own pool, so
+    # PARTITION_WORKERS is split among them
+    if EXECUTOR_BACKEND == "process":
+        return max(PARTITION_WORKERS // max(EXECUTOR_MAX_WORKERS, 1), 1)
+    return PARTITION_WORKERS
+
+
+def partition_count(rows: int) -> int:
+    return min(pool_workers(), rows // max(PARTITION_MIN_ROWS, 1))
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers share the tracker of this process, so a block created
+            # on one side and unlinked on the other is not reported as leaked
+            resource_tracker.ensure_running()
+            _pool = ProcessPoolExecutor(max_workers=pool_workers())
+            # A pool worker process joins its children when it exits, so a pool
+            # created there is shut down first, ahead of the exit handlers of
+            # the queues that carry its shutdown
+            util.Finalize(None, shutdown_pool, kwargs={"wait": True}, exitpriority=20)
+        return _pool
+
+
+def shutdown_pool(wait: bool = False):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+            _pool = None
+
+
+def map_partitions(
+    func: Callable[..., DataFrame],
+    df: DataFrame,
+    parts: int,
+    *args,
+    progress: Optional[Callable[[float], None]] = None,
+) -> DataFrame:
+    # Splits the rows into `parts` contiguous partitions, runs `func` on each in
+    # the pool and concatenates the results in row order. Partitions and
+    # results go through shared memory rather than the pool's pipes. Steps
+    # fail with an HTTPException; any other failure is raised as a
+    # PartitionError.
+    try:
+        return _map_partitions(func, df, parts, *args, progress=progress)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise PartitionError(f"{type(e).__name__}: {e}") from e
+
+
+def _map_partitions(
+    func: Callable[..., DataFrame],
+    df: DataFrame,
+    parts: int,
+    *args,
+    progress: Optional[Callable[[float], None]] = None,
+) -> DataFrame:
+    pool = get_pool()
+    bounds = [len(df) * i // parts for i in range(parts + 1)]
+    inputs: List[SharedFrame] = []
+    futures: List[Future] = []
+    results: List[DataFrame] = []
+    try:
+        for start, stop in zip(bounds, bounds[1:]):
+            inputs.append(share_frame(df.iloc[start:stop]))
+            futures.append(pool.submit(_run_shared, func, inputs[-1], *args))
+        for i, future in enumerate(futures):
+            shared = future.result()
+            try:
+                results.append(load_frame(shared))
+            finally:
+                unlink_frame(shared)
+            if progress:
+                progress((i + 1) / parts)
+    finally:
+        # Results of partitions that were still running when another failed
+        # are collected only to be unlinked
+        for future in futures[len(results) :]:
+            if not future.cancel():
+                try:
+                    unlink_frame(future.result())
+                except Exception:
+                    pass
+        for shared in inputs:
+            unlink_frame(shared)
+    return pd.concat(results)
+
+
+def _run_shared(func: Callable[..., DataFrame], shared: SharedFrame, *args: Any):
+    try:
+        return share_frame(func(load_frame(shared), *args))
+    except HTTPException as e:
+        # An HTTPException built with keyword arguments cannot be unpickled,
+        # which would break the pool
+        raise HTTPException(e.status_code, e.detail, e.headers)
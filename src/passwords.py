@@ -0,0 +1,66 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+import bcrypt
+
+from .status import Overloaded
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode(), hashed_password.encode())
+
+
+class PasswordHasher:
+    # bcrypt takes a few hundred milliseconds of CPU per call and releases
+    # the GIL while it runs, so it runs on a small pool of its own instead of
+    # the event loop. Calls beyond `max_pending`, running or queued, are
+    # refused rather than left to pile up behind a burst of logins.
+    def __init__(self, max_workers: int, max_pending: int):
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="bcrypt"
+        )
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        # Only changed on the event loop
+        self.pending = 0
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        if 0 < self.max_pending <= self.pending:
+            raise Overloaded(detail="Too many password checks in progress")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.pool, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def hash_many(self, passwords: List[str]) -> List[str]:
+        # Keeps every worker busy, but queues one round of hashes at a time so
+        # that logins wait for a round at most, not for the whole batch
+        loop = asyncio.get_running_loop()
+        hashes: List[str] = []
+        for start in range(0, len(passwords), self.max_workers):
+            hashes.extend(
+                await asyncio.gather(
+                    *(
+                        loop.run_in_executor(self.pool, hash_password, password)
+                        for password in passwords[start : start + self.max_workers]
+                    )
+                )
+            )
+        return hashes
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, password, hashed_password)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
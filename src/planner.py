@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from .models import TransformStep
+from .transformer import TransformerRegistry, topk_rows
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+PROJECTION_STEPS = {"rename", "drop"}
+LIMIT_STEPS = {"limit", "head"}
+# Steps that only pick rows, whatever their columns hold
+ROW_STEPS = LIMIT_STEPS | {"sample"}
+
+_IDENTIFIER = re.compile(r"`([^`]*)`|([A-Za-z_][A-Za-z0-9_]*)")
+
+
+@dataclass
+class PlanNode:
+    name: str
+    args: Dict[str, Any]
+    steps: List[TransformStep] = field(default_factory=list)
+    # The fused operation ("project" or "topk") of nodes built from several
+    # steps, or from a run of no-op projections. Kept apart from the name, so
+    # a transformer registered under the same name is not taken for it.
+    fusion: Optional[str] = None
+
+    @property
+    def fused(self) -> bool:
+        return self.fusion is not None
+
+    @property
+    def label(self) -> str:
+        return "+".join(step.name for step in self.steps)
+
+
+@dataclass
+class PrefixNode:
+    node: Optional[PlanNode] = None
+    children: Dict[str, "PrefixNode"] = field(default_factory=dict)
+    # Indexes of the pipelines that end at this node
+    pipelines: List[int] = field(default_factory=list)
+
+    def subtree_pipelines(self) -> List[int]:
+        indexes = []
+        stack = [self]
+        while stack:
+            tree_node = stack.pop()
+            indexes.extend(tree_node.pipelines)
+            stack.extend(tree_node.children.values())
+        return indexes
+
+
+def as_column_list(value: Any) -> List[Any]:
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def condition_columns(condition: str) -> Set[str]:
+    # Every identifier in the expression is treated as a possible column
+    # reference, which errs on the side of not reordering.
+    return {quoted or bare for quoted, bare in _IDENTIFIER.findall(str(condition))}
+
+
+# Columns a node depends on, or None when unknown
+def columns_read(node: PlanNode) -> Optional[Set[Any]]:
+    args = node.args
+    if node.name == "filter":
+        return condition_columns(args.get("condition", ""))
+    if node.name in ("sort", "topk"):
+        return set(as_column_list(args.get("by")))
+    if node.name in ROW_STEPS:
+        return set()
+    if node.name in ("uppercase", "fillna"):
+        return {args.get("column")}
+    if node.name == "rename":
+        return {args.get("from"), args.get("to")}
+    if node.name in ("join", "lookup") and "columns" in args:
+        # The columns it adds are read too, since it fails when they exist
+        return set(as_column_list(args.get("on"))) | set(
+            as_column_list(args["columns"])
+        )
+    return None
+
+
+def is_noop(node: PlanNode) -> bool:
+    if node.name == "rename":
+        return node.args.get("from") == node.args.get("to")
+    if node.name == "drop":
+        return as_column_list(node.args.get("columns")) == []
+    return False
+
+
+# Whether a node can run before the node that precedes it. Only moves that are
+# exact are made: filters and string ops are not moved across each other
+# because pandas decides string-ness and fillna dtypes from the rows present.
+def _can_swap(prev: PlanNode, node: PlanNode) -> bool:
+    # Sorts run as late as possible, since they are stable and every step they
+    # cross only touches columns other than the sort keys.
+    if prev.name == "sort" and node.name in ("filter", "uppercase", "fillna"):
+        by = set(as_column_list(prev.args.get("by")))
+        return node.name == "filter" or node.args.get("column") not in by
+
+    # Drops run as early as possible
+    if node.name == "drop" and prev.name in (
+        "sort",
+        "uppercase",
+        "fillna",
+        "filter",
+        "rename",
+        "topk",
+        *ROW_STEPS,
+    ):
+        read = columns_read(prev)
+        dropped = set(as_column_list(node.args.get("columns")))
+        return read is not None and not (read & dropped)
+    return False
+
+
+def _reorder(nodes: List[PlanNode]) -> List[PlanNode]:
+    nodes = list(nodes)
+    moved = True
+    while moved:
+        moved = False
+        for i in range(1, len(nodes)):
+            if _can_swap(nodes[i - 1], nodes[i]):
+                nodes[i - 1], nodes[i] = nodes[i], nodes[i - 1]
+                moved = True
+    return nodes
+
+
+def _fuse_projections(nodes: List[PlanNode]) -> List[PlanNode]:
+    fused: List[PlanNode] = []
+    run: List[PlanNode] = []
+
+    def flush():
+        if len(run) == 1 and not is_noop(run[0]):
+            fused.extend(run)
+        elif run:
+            # No-op steps are kept in the node so they are still validated
+            steps = [step for node in run for step in node.steps]
+            ops = [(node.name, node.args) for node in run if not is_noop(node)]
+            fused.append(PlanNode("project", {"ops": ops}, steps, "project"))
+        run.clear()
+
+    for node in nodes:
+        if node.name in PROJECTION_STEPS:
+            run.append(node)
+        else:
+            flush()
+            fused.append(node)
+    flush()
+    return fused
+
+
+def _fuse_topk(nodes: List[PlanNode]) -> List[PlanNode]:
+    # A sort followed by a limit only needs the first rows, which a top-k
+    # selection finds without sorting the rest
+    fused: List[PlanNode] = []
+    for node in nodes:
+        prev = fused[-1] if fused else None
+        if (
+            prev is not None
+            and prev.name == "sort"
+            and not prev.fused
+            and node.name in LIMIT_STEPS
+        ):
+            args = {
+                "by": prev.args.get("by"),
+                "ascending": prev.args.get("ascending", True),
+                "n": node.args.get("n"),
+            }
+            fused[-1] = PlanNode("topk", args, prev.steps + node.steps, "topk")
+        else:
+            fused.append(node)
+    return fused
+
+
+def plan_pipeline(pipeline: List[TransformStep]) -> List[PlanNode]:
+    nodes = [PlanNode(step.name, step.args, [step]) for step in pipeline]
+    nodes = _reorder(nodes)
+    nodes = _fuse_topk(nodes)
+    return _fuse_projections(nodes)
+
+
+def project(df: DataFrame, ops: List[Any]) -> DataFrame:
+    # Applies a run of renames and drops label by label, then selects the
+    # surviving columns with a single copy.
+    positions = []
+    names = []
+    for pos, name in enumerate(df.columns):
+        dropped = False
+        for op, args in ops:
+            if op == "rename" and name == args["from"]:
+                name = args["to"]
+            elif op == "drop" and name in as_column_list(args["columns"]):
+                dropped = True
+                break
+        if not dropped:
+            positions.append(pos)
+            names.append(name)
+
+    out = df.iloc[:, positions]
+    out.columns = names
+    return out
+
+
+@dataclass
+class Scan:
+    # Input columns to read, or None for all of them
+    columns: Optional[List[Any]]
+    # The pipeline with drops of unread columns removed
+    pipeline: List[TransformStep]
+
+
+def scan_pipeline(
+    pipeline: List[TransformStep], columns: List[Any], registry: TransformerRegistry
+) -> Scan:
+    # Finds the input columns a pipeline needs, following them through
+    # renames, so a scan can skip the rest. Columns that are only ever dropped
+    # are not read. Dtypes are left to the reader, since the steps that check
+    # them accept or reject a column by the dtype it infers.
+    origin = {col: col for col in columns}
+    needed: Set[Any] = set()
+    drops: List[Tuple[TransformStep, Any, Any]] = []
+    for node in plan_pipeline(pipeline):
+        for step in node.steps:
+            step_node = PlanNode(step.name, step.args)
+            read = columns_read(step_node)
+            if read is None or registry.get(step.name) is None:
+                return Scan(None, pipeline)
+            needed.update(origin[col] for col in read if col in origin)
+
+            if is_noop(step_node):
+                continue
+            if step.name == "rename" and step.args.get("from") in origin:
+                if step.args.get("to") in origin:
+                    return Scan(None, pipeline)
+                origin[step.args["to"]] = origin.pop(step.args["from"])
+            elif step.name == "drop":
+                for col in as_column_list(step.args.get("columns")):
+                    if col in origin:
+                        drops.append((step, col, origin.pop(col)))
+
+    needed.update(origin.values())
+    # At least one column is read to keep the row count
+    if not needed and columns:
+        needed.add(columns[0])
+    if len(needed) == len(columns):
+        return Scan(None, pipeline)
+
+    unread: Dict[int, List[Any]] = {}
+    for step, col, source in drops:
+        if source not in needed:
+            unread.setdefault(id(step), []).append(col)
+    pruned = []
+    for step in pipeline:
+        if id(step) in unread:
+            kept = [
+                col
+                for col in as_column_list(step.args["columns"])
+                if col not in unread[id(step)]
+            ]
+            step = TransformStep(name=step.name, args={**step.args, "columns": kept})
+        pruned.append(step)
+    return Scan([col for col in columns if col in needed], pruned)
+
+
+def run_fused(node: PlanNode, df: DataFrame) -> DataFrame:
+    if node.fusion == "topk":
+        return topk_rows(df, **node.args)
+    if not node.args["ops"]:
+        return df
+    return project(df, **node.args)
+
+
+def node_key(node: PlanNode) -> str:
+    steps = [[step.name, step.args] for step in node.steps]
+    return json.dumps([node.name, node.fusion, steps], sort_keys=True, default=str)
+
+
+def prefix_tree(pipelines: Dict[int, List[TransformStep]]) -> PrefixNode:
+    # Every pipeline is planned on its own, then plans that start with the same
+    # nodes share a path from the root, so each pipeline runs exactly its plan.
+    root = PrefixNode()
+    for index, pipeline in pipelines.items():
+        tree_node = root
+        for node in plan_pipeline(pipeline):
+            key = node_key(node)
+            if key not in tree_node.children:
+                tree_node.children[key] = PrefixNode(node)
+            tree_node = tree_node.children[key]
+        tree_node.pipelines.append(index)
+    return root
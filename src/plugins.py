@@ -0,0 +1,148 @@
+import ast
+import functools
+import importlib
+import importlib.util
+import os
+import sys
+from importlib.metadata import entry_points
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from .logger import get_logger
+from .transformer import LazyTransformer, TransformerRegistry
+
+# Plugins are modules that declare their transformers in a module-level
+# TRANSFORMERS dict literal, which is read without running the module:
+#
+#     TRANSFORMERS = {
+#         "reverse": {"func": "reverse_rows", "output_schema": "same_schema"},
+#     }
+#
+# Besides the name of its function, an entry may give the transformer's
+# required_args, required_column_types and row_local, the name of its
+# output_schema function, and parallel as a bool or a function name. The
+# module is imported when one of its transformers first runs.
+ENTRY_POINT_GROUP = "data_transformer.plugins"
+MANIFEST = "TRANSFORMERS"
+COLUMN_TYPES = {"string", "numeric", "boolean"}
+
+
+def _is_str_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+SPEC_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "func": lambda value: isinstance(value, str),
+    "required_args": _is_str_list,
+    "required_column_types": lambda value: isinstance(value, dict)
+    and all(
+        isinstance(kwarg, str) and kwarg_type in COLUMN_TYPES
+        for kwarg, kwarg_type in value.items()
+    ),
+    "row_local": lambda value: isinstance(value, bool),
+    "output_schema": lambda value: value is None or isinstance(value, str),
+    "parallel": lambda value: isinstance(value, (bool, str)),
+}
+
+
+def read_manifest(path: str) -> Dict[str, Dict[str, Any]]:
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    manifest = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets, value = node.targets, node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            targets, value = [node.target], node.value
+        else:
+            continue
+        if any(isinstance(t, ast.Name) and t.id == MANIFEST for t in targets):
+            manifest = ast.literal_eval(value)
+    if not isinstance(manifest, dict):
+        raise ValueError(f"{MANIFEST} must be a dict literal")
+
+    for name, spec in manifest.items():
+        if not isinstance(name, str) or not isinstance(spec, dict):
+            raise ValueError(f"Invalid entry for transformer '{name}'")
+        if "func" not in spec:
+            raise ValueError(f"Missing 'func' for transformer '{name}'")
+        for key, value in spec.items():
+            if key not in SPEC_CHECKS or not SPEC_CHECKS[key](value):
+                raise ValueError(f"Invalid '{key}' for transformer '{name}'")
+    return manifest
+
+
+@functools.lru_cache(maxsize=None)
+def load_file(path: str) -> ModuleType:
+    # Registered under its own name so that it behaves as an imported module,
+    # e.g. for dataclasses
+    name = f"data_transformer_plugin_{os.path.splitext(os.path.basename(path))[0]}"
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+
+def discover_plugins(
+    plugin_dir: str,
+) -> Iterator[Tuple[str, str, Callable[[], ModuleType]]]:
+    # The source, file and loader of each plugin: modules named by entry
+    # points of installed packages, then the files in the plugin directory.
+    # Finding an entry point's file imports its parent packages only.
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        module = entry_point.module
+        try:
+            spec = importlib.util.find_spec(module)
+        except ImportError:
+            spec = None
+        if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+            get_logger().warning(f"Skipping plugin '{module}': module not found")
+            continue
+        yield module, spec.origin, functools.partial(importlib.import_module, module)
+
+    if plugin_dir and os.path.isdir(plugin_dir):
+        for entry in sorted(os.listdir(plugin_dir)):
+            if entry.endswith(".py") and not entry.startswith("_"):
+                path = os.path.abspath(os.path.join(plugin_dir, entry))
+                yield path, path, functools.partial(load_file, path)
+
+
+def register_plugin_transformers(
+    registry: TransformerRegistry, plugin_dir: str
+) -> int:
+    # Broken plugins and names that are already taken are skipped with a
+    # warning, so a plugin cannot replace a builtin transformer
+    count = 0
+    for source, path, load in discover_plugins(plugin_dir):
+        try:
+            manifest = read_manifest(path)
+        except (OSError, SyntaxError, ValueError) as e:
+            get_logger().warning(f"Skipping plugin '{source}': {e}")
+            continue
+        for name, spec in manifest.items():
+            if registry.get(name) is not None:
+                get_logger().warning(
+                    f"Skipping transformer '{name}' of plugin '{source}': "
+                    "name already registered"
+                )
+                continue
+            registry.register(
+                name,
+                LazyTransformer(
+                    load=load,
+                    func=spec["func"],
+                    required_args=spec.get("required_args"),
+                    required_column_types_by_kwarg=spec.get("required_column_types"),
+                    row_local=spec.get("row_local", False),
+                    output_schema=spec.get("output_schema"),
+                    parallel=spec.get("parallel", False),
+                ),
+            )
+            count += 1
+    return count
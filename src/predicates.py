@@ -0,0 +1,538 @@
+from __future__ import annotations
+
+import ast
+import functools
+import math
+import operator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .config import FILTER_CACHE_SIZE
+from .lazy import np, pd
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+# Below this many rows numexpr costs more than it saves
+NUMEXPR_MIN_ROWS = 10_000
+
+COMPARISONS: Dict[type, Tuple[Callable[[Any, Any], Any], str]] = {
+    ast.Eq: (operator.eq, "=="),
+    ast.NotEq: (operator.ne, "!="),
+    ast.Lt: (operator.lt, "<"),
+    ast.LtE: (operator.le, "<="),
+    ast.Gt: (operator.gt, ">"),
+    ast.GtE: (operator.ge, ">="),
+}
+# Only the operators numexpr computes exactly like numpy have a symbol
+ARITHMETIC: Dict[type, Tuple[Callable[[Any, Any], Any], Optional[str]]] = {
+    ast.Add: (operator.add, "+"),
+    ast.Sub: (operator.sub, "-"),
+    ast.Mult: (operator.mul, "*"),
+    ast.Div: (operator.truediv, None),
+    ast.FloorDiv: (operator.floordiv, None),
+    ast.Mod: (operator.mod, None),
+    ast.Pow: (operator.pow, None),
+}
+NULL_METHODS = {"isna", "isnull", "notna", "notnull"}
+STRING_METHODS = {"startswith", "endswith", "contains", "match", "fullmatch"}
+CLOSED = {"both", "neither", "left", "right"}
+
+
+class Unsupported(Exception):
+    pass
+
+
+@dataclass
+class Predicate:
+    expr: "Expr"
+    # Names resolved as columns, all of which must exist before evaluating
+    columns: Set[Any]
+    # Whether it calls string methods, which run value by value in Python
+    strings: bool = False
+
+
+@functools.lru_cache(maxsize=None)
+def _numexpr():
+    try:
+        import numexpr
+    except ImportError:
+        return None
+    return numexpr
+
+
+class Expr:
+    predicate = False
+
+    def evaluate(self, df: DataFrame) -> Any:
+        raise NotImplementedError
+
+    # numexpr source for the node, adding the columns it reads to `arrays`,
+    # or None when numexpr cannot compute it exactly
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]) -> Optional[str]:
+        return None
+
+    # Polars expression for the node on a frame with the given schema, giving
+    # the mask pandas gives once NaN has become null. Raises Unsupported when
+    # the results could differ.
+    def polars(self, pl, schema) -> Any:
+        raise Unsupported(type(self).__name__)
+
+
+class Column(Expr):
+    def __init__(self, name: Any):
+        self.name = name
+
+    def evaluate(self, df: DataFrame):
+        return df[self.name]
+
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]):
+        column = self.evaluate(df)
+        if not isinstance(column.dtype, np.dtype) or column.dtype.kind not in "if":
+            return None
+        var = f"_{len(arrays)}"
+        arrays[var] = column.to_numpy()
+        return var
+
+    def polars(self, pl, schema):
+        if self.name not in schema:
+            raise Unsupported(self.name)
+        return pl.col(self.name)
+
+
+class Literal(Expr):
+    def __init__(self, value: Any):
+        self.value = value
+
+    def evaluate(self, df: DataFrame):
+        return self.value
+
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]):
+        if type(self.value) is int and -(2**63) <= self.value < 2**63:
+            return repr(self.value)
+        if type(self.value) is float and math.isfinite(self.value):
+            return repr(self.value)
+        return None
+
+    def polars(self, pl, schema):
+        if type(self.value) not in (bool, int, float, str):
+            raise Unsupported(self.value)
+        return pl.lit(self.value)
+
+
+class Compare(Expr):
+    predicate = True
+
+    def __init__(self, ops: List[type], operands: List[Expr]):
+        self.ops = ops
+        self.operands = operands
+
+    def evaluate(self, df: DataFrame):
+        # Chained comparisons are joined with &, like DataFrame.query does
+        result = None
+        for i, op in enumerate(self.ops):
+            left = self.operands[i].evaluate(df)
+            right = self.operands[i + 1].evaluate(df)
+            # A list on the right is a membership test, also for == and !=
+            if op in (ast.In, ast.NotIn) or isinstance(right, list):
+                if (
+                    op not in (ast.In, ast.NotIn, ast.Eq, ast.NotEq)
+                    or not isinstance(right, list)
+                    or not isinstance(left, pd.Series)
+                ):
+                    raise Unsupported(op)
+                mask = left.isin(right)
+                if op in (ast.NotIn, ast.NotEq):
+                    mask = ~mask
+            else:
+                mask = COMPARISONS[op][0](left, right)
+            result = mask if result is None else result & mask
+        return result
+
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]):
+        parts = []
+        for i, op in enumerate(self.ops):
+            if op not in COMPARISONS:
+                return None
+            left = self.operands[i].numexpr(df, arrays)
+            right = self.operands[i + 1].numexpr(df, arrays)
+            if left is None or right is None:
+                return None
+            parts.append(f"({left} {COMPARISONS[op][1]} {right})")
+        return " & ".join(parts)
+
+    def polars(self, pl, schema):
+        result = None
+        for i, op in enumerate(self.ops):
+            left = self.operands[i]
+            right = self.operands[i + 1]
+            values = right.value if isinstance(right, Literal) else None
+            if op in (ast.In, ast.NotIn) or isinstance(values, list):
+                if op not in (ast.In, ast.NotIn, ast.Eq, ast.NotEq):
+                    raise Unsupported(op)
+                mask = _polars_isin(left, values, pl, schema)
+                if op in (ast.NotIn, ast.NotEq):
+                    mask = ~mask
+            else:
+                if isinstance(left, Literal) and isinstance(right, Literal):
+                    raise Unsupported(op)
+                # Comparisons with NaN are false in pandas, except !=
+                mask = COMPARISONS[op][0](
+                    left.polars(pl, schema), right.polars(pl, schema)
+                ).fill_null(op is ast.NotEq)
+            result = mask if result is None else result & mask
+        return result
+
+
+class BoolOp(Expr):
+    predicate = True
+
+    def __init__(self, op: type, items: List[Expr]):
+        self.op = op
+        self.items = items
+
+    def evaluate(self, df: DataFrame):
+        combine = operator.and_ if self.op is ast.And else operator.or_
+        return functools.reduce(combine, (item.evaluate(df) for item in self.items))
+
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]):
+        if not all(item.predicate for item in self.items):
+            return None
+        parts = [item.numexpr(df, arrays) for item in self.items]
+        if None in parts:
+            return None
+        symbol = " & " if self.op is ast.And else " | "
+        return symbol.join(f"({part})" for part in parts)
+
+    def polars(self, pl, schema):
+        if not all(item.predicate for item in self.items):
+            raise Unsupported(self.op)
+        combine = operator.and_ if self.op is ast.And else operator.or_
+        items = [item.polars(pl, schema) for item in self.items]
+        return functools.reduce(combine, items)
+
+
+class Not(Expr):
+    def __init__(self, item: Expr):
+        self.item = item
+        self.predicate = item.predicate
+
+    def evaluate(self, df: DataFrame):
+        return ~self.item.evaluate(df)
+
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]):
+        source = self.item.numexpr(df, arrays) if self.predicate else None
+        return None if source is None else f"~({source})"
+
+    def polars(self, pl, schema):
+        if not self.predicate:
+            raise Unsupported("~")
+        return ~self.item.polars(pl, schema)
+
+
+class Arithmetic(Expr):
+    def __init__(self, op: type, left: Expr, right: Expr):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def evaluate(self, df: DataFrame):
+        return ARITHMETIC[self.op][0](self.left.evaluate(df), self.right.evaluate(df))
+
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]):
+        symbol = ARITHMETIC[self.op][1]
+        left = self.left.numexpr(df, arrays)
+        right = self.right.numexpr(df, arrays)
+        if symbol is None or left is None or right is None:
+            return None
+        return f"({left} {symbol} {right})"
+
+    def polars(self, pl, schema):
+        if ARITHMETIC[self.op][1] is None or not _numeric(self, schema):
+            raise Unsupported(self.op)
+        return ARITHMETIC[self.op][0](
+            self.left.polars(pl, schema), self.right.polars(pl, schema)
+        )
+
+
+class Negative(Expr):
+    def __init__(self, item: Expr):
+        self.item = item
+
+    def evaluate(self, df: DataFrame):
+        return -self.item.evaluate(df)
+
+    def numexpr(self, df: DataFrame, arrays: Dict[str, Any]):
+        source = self.item.numexpr(df, arrays)
+        return None if source is None else f"(-{source})"
+
+    def polars(self, pl, schema):
+        if not _numeric(self, schema):
+            raise Unsupported("-")
+        return -self.item.polars(pl, schema)
+
+
+class Method(Expr):
+    # Series methods as DataFrame.query calls them, e.g. `name.str.startswith('a')`
+    predicate = True
+
+    def __init__(self, target: Expr, accessor: Optional[str], name: str, args, kwargs):
+        self.target = target
+        self.accessor = accessor
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+
+    def evaluate(self, df: DataFrame):
+        target = self.target.evaluate(df)
+        if not isinstance(target, pd.Series):
+            raise Unsupported(self.name)
+        if self.accessor is not None:
+            target = getattr(target, self.accessor)
+        return getattr(target, self.name)(*self.args, **self.kwargs)
+
+    def polars(self, pl, schema):
+        # String methods are left out: pandas fails on NaN where polars
+        # returns null
+        if self.accessor is not None or not isinstance(self.target, Column):
+            raise Unsupported(self.name)
+        if self.name in NULL_METHODS and not self.args and not self.kwargs:
+            column = self.target.polars(pl, schema)
+            if self.name in ("isna", "isnull"):
+                return column.is_null()
+            return column.is_not_null()
+        if self.name == "isin" and len(self.args) == 1 and not self.kwargs:
+            return _polars_isin(self.target, self.args[0], pl, schema)
+        if self.name == "between" and len(self.args) == 2:
+            closed = self.kwargs.get("inclusive", "both")
+            if set(self.kwargs) - {"inclusive"} or closed not in CLOSED:
+                raise Unsupported(self.name)
+            return _polars_between(self.target, *self.args, closed, pl, schema)
+        raise Unsupported(self.name)
+
+
+class Function(Expr):
+    # Predicates that DataFrame.query does not have. Missing values never match.
+    predicate = True
+
+    def __init__(self, name: str, target: Expr, args: List[Any]):
+        self.name = name
+        self.target = target
+        self.args = args
+
+    def evaluate(self, df: DataFrame):
+        column = self.target.evaluate(df)
+        if not isinstance(column, pd.Series):
+            raise Unsupported(self.name)
+        if self.name == "isnull":
+            return column.isna()
+        if self.name == "notnull":
+            return column.notna()
+        if self.name == "between":
+            return column.between(*self.args)
+        if self.name == "contains":
+            return column.str.contains(*self.args, regex=False, na=False)
+        return getattr(column.str, self.name)(*self.args, na=False)
+
+    def polars(self, pl, schema):
+        if not isinstance(self.target, Column):
+            raise Unsupported(self.name)
+        column = self.target.polars(pl, schema)
+        if self.name == "isnull":
+            return column.is_null()
+        if self.name == "notnull":
+            return column.is_not_null()
+        if self.name == "between":
+            return _polars_between(self.target, *self.args, "both", pl, schema)
+        if not all(isinstance(arg, str) for arg in self.args):
+            raise Unsupported(self.name)
+        if self.name == "contains":
+            return column.str.contains(*self.args, literal=True).fill_null(False)
+        method = "starts_with" if self.name == "startswith" else "ends_with"
+        return getattr(column.str, method)(*self.args).fill_null(False)
+
+
+FUNCTION_ARGS = {
+    "isnull": 0,
+    "notnull": 0,
+    "between": 2,
+    "startswith": 1,
+    "endswith": 1,
+    "contains": 1,
+}
+
+
+def _numeric(expr: Expr, schema) -> bool:
+    if isinstance(expr, Column):
+        dtype = schema.get(expr.name)
+        return dtype is not None and dtype.is_numeric()
+    if isinstance(expr, Literal):
+        return type(expr.value) in (int, float)
+    if isinstance(expr, Arithmetic):
+        return _numeric(expr.left, schema) and _numeric(expr.right, schema)
+    if isinstance(expr, Negative):
+        return _numeric(expr.item, schema)
+    return False
+
+
+def _polars_isin(target: Expr, values: Any, pl, schema):
+    if (
+        not isinstance(target, Column)
+        or not isinstance(values, list)
+        or not all(type(value) in (bool, int, float, str) for value in values)
+        or any(value != value for value in values)
+    ):
+        raise Unsupported("isin")
+    return target.polars(pl, schema).is_in(values).fill_null(False)
+
+
+def _polars_between(target: Expr, low: Any, high: Any, closed: str, pl, schema):
+    if not all(type(bound) in (int, float, str) for bound in (low, high)):
+        raise Unsupported("between")
+    column = target.polars(pl, schema)
+    return column.is_between(low, high, closed=closed).fill_null(False)
+
+
+def _preparse(condition: str) -> Tuple[str, Dict[str, Any]]:
+    # Rewrites `&` and `|` to `and` and `or` as DataFrame.query does, which
+    # gives them a lower precedence than comparisons, and backtick-quoted
+    # column names to placeholder identifiers
+    source: List[str] = []
+    quoted: Dict[str, Any] = {}
+    i = 0
+    while i < len(condition):
+        char = condition[i]
+        if char in "'\"":
+            if condition.startswith(char * 3, i):
+                raise Unsupported(condition)
+            end = i + 1
+            while end < len(condition) and condition[end] != char:
+                end += 2 if condition[end] == "\\" else 1
+            source.append(condition[i : end + 1])
+            i = end + 1
+        elif char == "`":
+            end = condition.find("`", i + 1)
+            if end < 0:
+                raise Unsupported(condition)
+            name = f"__column_{len(quoted)}"
+            quoted[name] = condition[i + 1 : end]
+            source.append(name)
+            i = end + 1
+        else:
+            source.append({"&": " and ", "|": " or "}.get(char, char))
+            i += 1
+    return "".join(source), quoted
+
+
+def _constant(node: ast.AST) -> Any:
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        value = _constant(node.operand)
+        if type(value) in (int, float):
+            return -value
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_constant(item) for item in node.elts]
+    raise Unsupported(ast.dump(node))
+
+
+def _compile(node: ast.AST, quoted: Dict[str, Any]) -> Expr:
+    if isinstance(node, ast.Name):
+        return Column(quoted.get(node.id, node.id))
+    if isinstance(node, (ast.Constant, ast.List, ast.Tuple)):
+        return Literal(_constant(node))
+    if isinstance(node, ast.Compare):
+        ops = [type(op) for op in node.ops]
+        if any(op not in COMPARISONS and op not in (ast.In, ast.NotIn) for op in ops):
+            raise Unsupported(ops)
+        operands = [_compile(item, quoted) for item in [node.left, *node.comparators]]
+        return Compare(ops, operands)
+    if isinstance(node, ast.BoolOp):
+        return BoolOp(type(node.op), [_compile(item, quoted) for item in node.values])
+    if isinstance(node, ast.UnaryOp):
+        item = _compile(node.operand, quoted)
+        if isinstance(node.op, (ast.Not, ast.Invert)):
+            return Not(item)
+        if isinstance(node.op, ast.USub):
+            return Negative(item)
+        raise Unsupported(node.op)
+    if isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC:
+        return Arithmetic(
+            type(node.op), _compile(node.left, quoted), _compile(node.right, quoted)
+        )
+    if isinstance(node, ast.Call):
+        return _compile_call(node, quoted)
+    raise Unsupported(ast.dump(node))
+
+
+def _compile_call(node: ast.Call, quoted: Dict[str, Any]) -> Expr:
+    func = node.func
+    kwargs = {keyword.arg: _constant(keyword.value) for keyword in node.keywords}
+    if None in kwargs:
+        raise Unsupported("**kwargs")
+
+    if isinstance(func, ast.Name) and func.id in FUNCTION_ARGS:
+        if kwargs or len(node.args) != FUNCTION_ARGS[func.id] + 1:
+            raise Unsupported(func.id)
+        target = _compile(node.args[0], quoted)
+        return Function(func.id, target, [_constant(arg) for arg in node.args[1:]])
+
+    if not isinstance(func, ast.Attribute):
+        raise Unsupported(ast.dump(func))
+    args = [_constant(arg) for arg in node.args]
+    target = func.value
+    if (
+        func.attr in STRING_METHODS
+        and isinstance(target, ast.Attribute)
+        and target.attr == "str"
+    ):
+        return Method(_compile(target.value, quoted), "str", func.attr, args, kwargs)
+    if func.attr in NULL_METHODS | {"between", "isin"}:
+        return Method(_compile(target, quoted), None, func.attr, args, kwargs)
+    raise Unsupported(func.attr)
+
+
+@functools.lru_cache(maxsize=FILTER_CACHE_SIZE)
+def compile_condition(condition: str) -> Optional[Predicate]:
+    # Conditions outside the supported subset compile to None and are left
+    # to DataFrame.query
+    try:
+        source, quoted = _preparse(condition)
+        tree = ast.parse(source.strip(), mode="eval").body
+        expr = _compile(tree, quoted)
+    except (SyntaxError, ValueError, RecursionError, Unsupported):
+        return None
+    if not expr.predicate:
+        return None
+    calls = [node.func for node in ast.walk(tree) if isinstance(node, ast.Call)]
+    functions = {id(func) for func in calls}
+    columns = {
+        quoted.get(node.id, node.id)
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and id(node) not in functions
+    }
+    strings = any(
+        getattr(func, "attr", getattr(func, "id", None)) in STRING_METHODS
+        for func in calls
+    )
+    return Predicate(expr, columns, strings)
+
+
+def evaluate_mask(predicate: Predicate, df: DataFrame) -> Optional[pd.Series]:
+    # Boolean mask of the rows matching a compiled condition, or None when it
+    # has to be evaluated by DataFrame.query
+    if not df.columns.is_unique or not predicate.columns.issubset(df.columns):
+        return None
+    try:
+        numexpr = _numexpr()
+        if numexpr is not None and len(df) >= NUMEXPR_MIN_ROWS:
+            arrays: Dict[str, Any] = {}
+            source = predicate.expr.numexpr(df, arrays)
+            if source is not None:
+                return pd.Series(
+                    numexpr.evaluate(source, local_dict=arrays), index=df.index
+                )
+        mask = predicate.expr.evaluate(df)
+    except Unsupported:
+        return None
+    return mask if isinstance(mask, pd.Series) else None
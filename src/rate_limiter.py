@@ -1,9 +1,29 @@
+from fastapi import Request
+from jose import JWTError
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
-from .config import RATE_LIMIT
+from .config import RATE_LIMIT, RATE_LIMIT_STORAGE_URI
+from .tokens import decode_token
 
+
+def rate_limit_key(request: Request) -> str:
+    # Requests with a valid token are limited per user, wherever they come
+    # from; the others per client address
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            username = decode_token(token).get("sub")
+        except JWTError:
+            username = None
+        if username:
+            return f"user:{username}"
+    return f"ip:{get_remote_address(request)}"
+
+
+# With a shared storage such as redis:// the limits hold across worker processes
 limiter = Limiter(
-    key_func=get_remote_address,
+    key_func=rate_limit_key,
     default_limits=[RATE_LIMIT],
+    storage_uri=RATE_LIMIT_STORAGE_URI,
 )
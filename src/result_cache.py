@@ -0,0 +1,227 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from .logger import get_logger
+
+DIGEST_BLOCK_SIZE = 1024 * 1024
+
+
+@dataclass
+class CachedResult:
+    fmt: str
+    size: int
+    body: Optional[bytes] = None
+    path: Optional[str] = None
+
+
+def make_key(*parts: Any) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def digest_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_file(file: BinaryIO) -> str:
+    digest = hashlib.sha256()
+    file.seek(0)
+    while block := file.read(DIGEST_BLOCK_SIZE):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    # Encoded results are kept in memory up to `max_bytes` in total, evicting
+    # the least recently used. With a disk directory, evicted entries and those
+    # larger than `max_entry_bytes` are spilled to files up to
+    # `disk_max_bytes`.
+    def __init__(
+        self,
+        max_bytes: int,
+        max_entry_bytes: int,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 0,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.disk_dir = disk_dir if disk_dir and disk_max_bytes > 0 else None
+        self.disk_max_bytes = disk_max_bytes if self.disk_dir else 0
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self.memory_bytes = 0
+        self.disk: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self.disk_bytes = 0
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        if self.disk_dir:
+            self._load_disk()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.disk_max_bytes > 0
+
+    def _load_disk(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            key, _, fmt = name.partition(".")
+            path = os.path.join(self.disk_dir, name)
+            if not fmt or fmt.endswith("tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, key, CachedResult(fmt, stat.st_size, path=path)))
+        for _, key, entry in sorted(entries, key=lambda item: item[0]):
+            self.disk[key] = entry
+            self.disk_bytes += entry.size
+        self._evict_disk()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats["hits"] += 1
+                return self.memory[key]
+            if key in self.disk:
+                self.disk.move_to_end(key)
+                self.stats["disk_hits"] += 1
+                return self.disk[key]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, fmt: str, body: bytes):
+        spills = []
+        with self.lock:
+            if len(body) <= self.max_entry_bytes:
+                self._discard(key)
+                self.memory[key] = CachedResult(fmt, len(body), body=body)
+                self.memory_bytes += len(body)
+                spills = self._evict_memory()
+            elif len(body) <= self.disk_max_bytes:
+                spills = [(key, CachedResult(fmt, len(body), body=body))]
+        for spilled_key, entry in spills:
+            self._spill(spilled_key, entry)
+
+    def put_file(self, key: str, fmt: str, tmp_path: str, size: int):
+        with self.lock:
+            self._discard(key)
+            path = os.path.join(self.disk_dir, f"{key}.{fmt}")
+            os.replace(tmp_path, path)
+            self.disk[key] = CachedResult(fmt, size, path=path)
+            self.disk_bytes += size
+            self._evict_disk()
+
+    def writer(self, key: str, fmt: str):
+        return lambda chunks: _tee(self, key, fmt, chunks)
+
+    def _discard(self, key: str):
+        if (entry := self.memory.pop(key, None)) is not None:
+            self.memory_bytes -= entry.size
+        if (entry := self.disk.pop(key, None)) is not None:
+            self.disk_bytes -= entry.size
+            _remove(entry.path)
+
+    def _evict_memory(self) -> List[Tuple[str, CachedResult]]:
+        # Returns the evicted entries to spill, which the caller writes once
+        # the lock is released
+        spills = []
+        while self.memory_bytes > self.max_bytes:
+            key, entry = self.memory.popitem(last=False)
+            self.memory_bytes -= entry.size
+            self.stats["evictions"] += 1
+            if self.disk_dir and entry.size <= self.disk_max_bytes:
+                spills.append((key, entry))
+        return spills
+
+    def _spill(self, key: str, entry: CachedResult):
+        tmp_path = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=self.disk_dir, suffix=".tmp", delete=False
+            ) as file:
+                tmp_path = file.name
+                file.write(entry.body)
+        except OSError as e:
+            get_logger("result_cache").warning(f"Could not spill cache entry: {e}")
+            _remove(tmp_path)
+            return
+        self.put_file(key, entry.fmt, tmp_path, entry.size)
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.disk_max_bytes:
+            _, entry = self.disk.popitem(last=False)
+            self.disk_bytes -= entry.size
+            self.stats["evictions"] += 1
+            _remove(entry.path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+            hits = self.stats["hits"] + self.stats["disk_hits"]
+            return {
+                **self.stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "entries": len(self.memory),
+                "bytes": self.memory_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+            }
+
+
+def _remove(path: Optional[str]):
+    try:
+        if path:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _tee(cache: ResultCache, key: str, fmt: str, chunks: Iterator[bytes]):
+    # Passes a response body through while keeping a copy of it. Small bodies
+    # are buffered in memory, larger ones are written to a temporary file in
+    # the disk tier. Bodies over every limit, or that are not sent to the end,
+    # are not cached.
+    parts: Optional[List[bytes]] = []
+    file = None
+    size = 0
+    try:
+        for chunk in chunks:
+            yield chunk
+            if parts is None:
+                continue
+            size += len(chunk)
+            if file is None and size > cache.max_entry_bytes and cache.disk_dir:
+                file = tempfile.NamedTemporaryFile(
+                    dir=cache.disk_dir, suffix=".tmp", delete=False
+                )
+                file.writelines(parts)
+                parts.clear()
+            if size > max(cache.max_entry_bytes, cache.disk_max_bytes):
+                parts = None
+            elif file is not None:
+                file.write(chunk)
+            else:
+                parts.append(chunk)
+    except BaseException:
+        parts = None
+        raise
+    finally:
+        if file is not None:
+            file.close()
+            if parts is None:
+                _remove(file.name)
+            else:
+                cache.put_file(key, fmt, file.name, size)
+        elif parts is not None:
+            cache.put(key, fmt, b"".join(parts))
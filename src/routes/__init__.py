@@ -1,5 +1,17 @@
 from .auth import router as auth_router
+from .datasets import router as datasets_router
+from .jobs import router as jobs_router
+from .lookups import router as lookups_router
+from .metrics import router as metrics_router
 from .root import router as root_router
 from .transform import router as transform_router
 
-__all__ = ["auth_router", "root_router", "transform_router"]
+__all__ = [
+    "auth_router",
+    "datasets_router",
+    "jobs_router",
+    "lookups_router",
+    "metrics_router",
+    "root_router",
+    "transform_router",
+]
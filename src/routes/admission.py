@@ -0,0 +1,77 @@
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable, List, Optional
+
+from fastapi import Request
+from slowapi.util import get_remote_address
+from starlette.concurrency import run_in_threadpool
+
+from ..admission import AdmissionController
+from ..models import User
+from ..utils import get_admission
+
+
+def client_key(request: Request, request_user: Optional[User]) -> str:
+    if request_user is not None:
+        return f"user:{request_user.username}"
+    return f"ip:{get_remote_address(request)}"
+
+
+class Admission:
+    def __init__(
+        self,
+        controller: AdmissionController,
+        key: str,
+        input_bytes: int,
+        cost: float,
+        slot: Optional[str],
+    ):
+        self.controller = controller
+        self.key = key
+        self.input_bytes = input_bytes
+        self.cost = cost
+        self.slot = slot
+        self.steps: Optional[List[str]] = None
+
+    def settle(self, steps: Iterable[str]):
+        # Requests whose pipeline is only known to the job are admitted on an
+        # estimate, and charged the difference once the job reports its steps
+        self.steps = list(steps)
+
+    def hold(self) -> Callable[[], None]:
+        # Hands the slot over to a streamed response, which releases it by
+        # calling the returned function once it is over, instead of when the
+        # request handler returns
+        slot, self.slot = self.slot, None
+        return partial(self.controller.release, slot)
+
+
+@asynccontextmanager
+async def admitted(
+    request: Request,
+    request_user: Optional[User],
+    input_bytes: int,
+    steps: Iterable[str] = (),
+) -> AsyncIterator[Admission]:
+    controller = get_admission(request)
+    key = client_key(request, request_user)
+    cost = controller.cost(input_bytes, steps)
+    if not controller.enabled:
+        yield Admission(controller, key, input_bytes, cost, None)
+        return
+
+    slot = await run_in_threadpool(controller.admit, key, cost)
+    admission = Admission(controller, key, input_bytes, cost, slot)
+    try:
+        yield admission
+    finally:
+        extra = 0.0
+        if admission.steps is not None:
+            extra = controller.cost(input_bytes, admission.steps) - cost
+        if extra or admission.slot is not None:
+            await run_in_threadpool(settle, controller, admission, extra)
+
+
+def settle(controller: AdmissionController, admission: Admission, extra: float):
+    controller.charge(admission.key, extra)
+    controller.release(admission.slot)
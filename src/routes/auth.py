@@ -1,13 +1,15 @@
-from datetime import datetime, timedelta, timezone
-import bcrypt
+from typing import Dict, List, Tuple
+
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from jose import jwt
 
-from ..config import ALGORITHM, SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES
-from ..db import create_user, get_user
+from ..auth import admin_required
+from ..config import BULK_MAX_PASSWORDS, BULK_MAX_USERS, DEFAULT_TRANSFORMS
+from ..db import create_user, create_users, get_user, get_user_roles
+from ..models import BulkRegisterRequest, User, UserRole
 from ..status import InvalidCredentials
-from ..utils import get_db
+from ..tokens import create_access_token
+from ..utils import get_db, get_password_hasher, get_registry
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
@@ -17,15 +19,12 @@ async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends
     db = get_db(request)
     user = await get_user(db, form_data.username)
 
-    if not user or not bcrypt.checkpw(
-        form_data.password.encode(), user.hashed_password.encode()
+    if not user or not await get_password_hasher(request).verify(
+        form_data.password, user.hashed_password
     ):
         raise InvalidCredentials("Wrong Login Credentials")
 
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    token = jwt.encode(
-        {"sub": user.username, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM
-    )
+    token = create_access_token(user.username)
     return {"access_token": token, "token_type": "bearer"}
 
 
@@ -38,9 +37,97 @@ async def register(request: Request, form_data: OAuth2PasswordRequestForm = Depe
     if user:
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    hashed_pw = bcrypt.hashpw(form_data.password.encode(), bcrypt.gensalt()).decode()
+    hashed_pw = await get_password_hasher(request).hash(form_data.password)
     did_create = await create_user(db, username, hashed_pw, role="user")
     if not did_create:
         raise HTTPException(status_code=400, detail="Error creating user")
 
     return {"status": "User created"}
+
+
+@router.post("/register/bulk")
+async def register_bulk(
+    request: Request, body: BulkRegisterRequest, admin=Depends(admin_required)
+):
+    # Users that cannot be created fail on their own, with the error
+    # /register would give them
+    if len(body.users) > BULK_MAX_USERS:
+        raise HTTPException(
+            422, detail=f"At most {BULK_MAX_USERS} users can be created at once"
+        )
+    # Each password takes bcrypt a few hundred milliseconds, all within this
+    # request, so larger batches are given by hash
+    passwords = sum(new_user.password is not None for new_user in body.users)
+    if 0 < BULK_MAX_PASSWORDS < passwords:
+        raise HTTPException(
+            422,
+            detail=f"At most {BULK_MAX_PASSWORDS} users can be created with a "
+            f"password at once, give the others a hashed_password",
+        )
+    db = get_db(request)
+    available = set(get_registry(request).list_available())
+
+    errors: Dict[int, Tuple[int, str]] = {}
+    seen = set()
+    for index, new_user in enumerate(body.users):
+        enabled = new_user.enabled_transforms or []
+        if invalid := [t for t in enabled if t not in available]:
+            errors[index] = (400, f"Invalid transforms: {invalid}")
+        elif new_user.enabled_transforms == []:
+            # Stored users with no transforms get the defaults, so an empty
+            # list would not withhold them
+            errors[index] = (
+                400,
+                "enabled_transforms must name a transformer, leave it out for "
+                "the defaults",
+            )
+        elif new_user.username in seen:
+            errors[index] = (400, "Duplicate username in request")
+        seen.add(new_user.username)
+
+    existing = await get_user_roles(db, seen)
+    for index, new_user in enumerate(body.users):
+        if index not in errors and new_user.username in existing:
+            errors[index] = (400, "Username already exists")
+
+    pending = [index for index in range(len(body.users)) if index not in errors]
+    to_hash = [index for index in pending if body.users[index].password is not None]
+    hashes = dict(
+        zip(
+            to_hash,
+            await get_password_hasher(request).hash_many(
+                [body.users[index].password for index in to_hash]
+            ),
+        )
+    )
+    users: List[User] = [
+        User(
+            username=body.users[index].username,
+            hashed_password=hashes.get(index) or body.users[index].hashed_password,
+            role=UserRole.user,
+            allowed_transforms=(
+                DEFAULT_TRANSFORMS
+                if body.users[index].enabled_transforms is None
+                else body.users[index].enabled_transforms
+            ),
+        )
+        for index in pending
+    ]
+    failed = await create_users(db, users) if users else {}
+    for index in pending:
+        if detail := failed.get(body.users[index].username):
+            errors[index] = (400, detail)
+
+    results = []
+    for index, new_user in enumerate(body.users):
+        if index in errors:
+            status_code, detail = errors[index]
+            results.append(
+                {
+                    "username": new_user.username,
+                    "error": {"status_code": status_code, "detail": detail},
+                }
+            )
+        else:
+            results.append({"username": new_user.username, "status": "User created"})
+    return {"results": results}
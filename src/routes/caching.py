@@ -0,0 +1,42 @@
+import json
+from typing import List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from ..models import TransformStep
+from ..result_cache import ResultCache
+from ..utils import get_result_cache
+from .streaming import STREAM_FORMATS, read_blocks
+
+
+def cache_requested(request: Request, cache: bool) -> bool:
+    if not cache or not get_result_cache(request).enabled:
+        return False
+    directives = request.headers.get("cache-control", "").lower()
+    return "no-cache" not in directives and "no-store" not in directives
+
+
+def pipeline_key(pipeline: List[TransformStep]) -> str:
+    steps = [{"name": step.name, "args": step.args} for step in pipeline]
+    return json.dumps(steps, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def permission_key(allowed: Optional[List[str]]) -> Optional[tuple]:
+    return None if allowed is None else tuple(sorted(set(allowed)))
+
+
+def cached_response(cache: ResultCache, key: str) -> Optional[Response]:
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    headers = {"X-Cache": "HIT"}
+    media_type = STREAM_FORMATS[entry.fmt]
+    if entry.body is not None:
+        return Response(entry.body, media_type=media_type, headers=headers)
+    # The open file stays readable even if the entry is evicted meanwhile
+    try:
+        file = open(entry.path, "rb")
+    except OSError:
+        return None
+    return StreamingResponse(read_blocks(file), media_type=media_type, headers=headers)
@@ -0,0 +1,152 @@
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Path, Request, UploadFile
+
+from ..auth import admin_required, get_current_user
+from ..config import DATASET_DIR, DATASET_MAX_TTL_SECONDS, DATASET_TTL_SECONDS
+from ..datasets import (
+    dataset_path,
+    dataset_quota,
+    purge_expired_datasets,
+    remove_dataset_file,
+)
+from ..db import (
+    create_dataset,
+    delete_dataset,
+    get_dataset,
+    get_dataset_usage,
+    get_user,
+    list_datasets,
+    set_user_dataset_quota,
+)
+from ..models import Dataset, DatasetQuota, User, UserRole
+from ..status import DatasetNotFound, QuotaExceeded
+from ..utils import get_db, get_executor
+from .formats import get_upload_encoding, get_upload_format
+from .utils import spool_upload, store_upload
+
+router = APIRouter(prefix="/datasets", tags=["Datasets"])
+
+
+async def get_user_dataset(db, dataset_id: str, user: Optional[User]) -> Dataset:
+    # Other users' datasets are reported as missing
+    dataset = await get_dataset(db, dataset_id)
+    if (
+        dataset is None
+        or user is None
+        or (user.role != UserRole.admin and dataset.owner != user.username)
+    ):
+        raise DatasetNotFound()
+    return dataset
+
+
+@router.post("/")
+async def upload_dataset(
+    request: Request,
+    file: UploadFile = File(...),
+    name: Optional[str] = Form(None),
+    ttl_seconds: int = Form(DATASET_TTL_SECONDS, gt=0, le=DATASET_MAX_TTL_SECONDS),
+    user=Depends(get_current_user),
+):
+    db = get_db(request)
+    executor = get_executor(request)
+    input_format = get_upload_format(file)
+    input_encoding = get_upload_encoding(file)
+
+    await purge_expired_datasets(db)
+    quota = dataset_quota(user)
+    usage = await get_dataset_usage(db, user.username)
+    if quota is not None and usage >= quota:
+        raise QuotaExceeded()
+
+    # The upload is parsed once and stored as an Arrow IPC file
+    dataset_id = uuid.uuid4().hex
+    path = dataset_path(dataset_id)
+    os.makedirs(DATASET_DIR, exist_ok=True)
+
+    spooled = executor.backend == "process"
+    source = await spool_upload(file) if spooled else file.file
+    try:
+        info = await executor.run(
+            request, store_upload, source, input_format, path, input_encoding
+        )
+    except BaseException:
+        remove_dataset_file(dataset_id)
+        raise
+    finally:
+        if spooled:
+            os.remove(source)
+
+    size = os.path.getsize(path)
+    if quota is not None and usage + size > quota:
+        remove_dataset_file(dataset_id)
+        raise QuotaExceeded(
+            f"Dataset quota exceeded: {usage + size} of {quota} bytes"
+        )
+
+    now = datetime.now(timezone.utc)
+    dataset = Dataset(
+        dataset_id=dataset_id,
+        owner=user.username,
+        name=name or file.filename or dataset_id,
+        format=input_format,
+        size_bytes=size,
+        created_at=now,
+        expires_at=now + timedelta(seconds=ttl_seconds),
+        **info,
+    )
+    await create_dataset(db, dataset)
+    # Usage is checked again once the dataset is recorded, so concurrent
+    # uploads that each fit but not together cannot all be kept
+    if quota is not None:
+        usage = await get_dataset_usage(db, user.username)
+        if usage > quota:
+            await delete_dataset(db, dataset_id)
+            remove_dataset_file(dataset_id)
+            raise QuotaExceeded(f"Dataset quota exceeded: {usage} of {quota} bytes")
+    return dataset
+
+
+@router.get("/")
+async def get_datasets(request: Request, user=Depends(get_current_user)):
+    return await list_datasets(get_db(request), user.username)
+
+
+@router.get("/{dataset_id}")
+async def get_dataset_info(
+    request: Request,
+    dataset_id: str = Path(..., description="Dataset id"),
+    user=Depends(get_current_user),
+):
+    return await get_user_dataset(get_db(request), dataset_id, user)
+
+
+@router.delete("/{dataset_id}")
+async def remove_dataset(
+    request: Request,
+    dataset_id: str = Path(..., description="Dataset id"),
+    user=Depends(get_current_user),
+):
+    db = get_db(request)
+    await get_user_dataset(db, dataset_id, user)
+    if await delete_dataset(db, dataset_id):
+        remove_dataset_file(dataset_id)
+    return {"status": "Deleted"}
+
+
+@router.put("/quota/{username}")
+async def set_dataset_quota(
+    request: Request,
+    quota: DatasetQuota,
+    username: str = Path(..., description="Username"),
+    admin=Depends(admin_required),
+):
+    db = get_db(request)
+    if await get_user(db, username) is None:
+        raise HTTPException(status_code=400, detail=f"User '{username}' not found")
+
+    await set_user_dataset_quota(db, username, quota.quota_bytes)
+    return {"status": "Updated"}
@@ -0,0 +1,469 @@
+from __future__ import annotations
+
+import io
+import os
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from fastapi import HTTPException, UploadFile
+
+from ..compression import (
+    GZIP,
+    ZSTD,
+    check_expanded,
+    content_encoding,
+    open_decoded,
+)
+from ..config import DECOMPRESS_MAX_BYTES
+from ..lazy import np, pd
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/x-parquet"
+CSV_MEDIA_TYPE = "text/csv"
+
+UPLOAD_MEDIA_TYPES = {
+    ARROW_MEDIA_TYPE: "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+    PARQUET_MEDIA_TYPE: "parquet",
+    "application/vnd.apache.parquet": "parquet",
+}
+UPLOAD_EXTENSIONS = {
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+    ".ipc": "arrow",
+    ".feather": "arrow",
+    ".parquet": "parquet",
+}
+# A compressed upload is named by the Content-Encoding header of its part, its
+# media type or its extension
+ENCODING_MEDIA_TYPES = {
+    "application/gzip": GZIP,
+    "application/x-gzip": GZIP,
+    "application/zstd": ZSTD,
+}
+ENCODING_EXTENSIONS = {".gz": GZIP, ".gzip": GZIP, ".zst": ZSTD, ".zstd": ZSTD}
+UPLOAD_ERRORS = {
+    "csv": "Invalid CSV file.",
+    "arrow": "Invalid Arrow file.",
+    "parquet": "Invalid Parquet file.",
+}
+# Rows of output held back at most while a column has no type, see _to_tables
+NULL_HOLD_ROWS = 1_000_000
+
+Source = Union[str, bytes, BinaryIO]
+DECODE_BLOCK_SIZE = 1024 * 1024
+
+
+def _split_encoding(filename: str) -> Tuple[str, Optional[str]]:
+    for extension, encoding in ENCODING_EXTENSIONS.items():
+        if filename.endswith(extension):
+            return filename[: -len(extension)], encoding
+    return filename, None
+
+
+def get_upload_format(file: UploadFile) -> str:
+    if file.content_type in UPLOAD_MEDIA_TYPES:
+        return UPLOAD_MEDIA_TYPES[file.content_type]
+    filename, _ = _split_encoding((file.filename or "").lower())
+    for extension, fmt in UPLOAD_EXTENSIONS.items():
+        if filename.endswith(extension):
+            return fmt
+    return "csv"
+
+
+def get_upload_encoding(file: UploadFile) -> Optional[str]:
+    if "content-encoding" in file.headers:
+        return content_encoding(file.headers["content-encoding"])
+    _, encoding = _split_encoding((file.filename or "").lower())
+    encoding = ENCODING_MEDIA_TYPES.get(file.content_type or "", encoding)
+    return content_encoding(encoding) if encoding else None
+
+
+def _open(source: Source):
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+@contextmanager
+def _decoded(source: Source, encoding: Optional[str]):
+    # A compressed source is decompressed while it is parsed, rather than
+    # being expanded in memory first
+    if encoding is None:
+        yield _open(source)
+    elif isinstance(source, str):
+        with open(source, "rb") as raw, open_decoded(raw, encoding) as stream:
+            yield stream
+    else:
+        with open_decoded(_open(source), encoding) as stream:
+            yield stream
+
+
+def _expand(source: Source, encoding: Optional[str]) -> Source:
+    # Arrow and Parquet readers seek, so compressed uploads in these formats
+    # are expanded in memory
+    if encoding is None:
+        return source
+    with _decoded(source, encoding) as stream:
+        if DECOMPRESS_MAX_BYTES <= 0:
+            return stream.read()
+        data = stream.read(DECOMPRESS_MAX_BYTES + 1)
+    check_expanded("The upload", len(data))
+    return data
+
+
+def upload_size(source: Source, fmt: str, encoding: Optional[str] = None) -> int:
+    # The size an upload is parsed from. A compressed upload is expanded to
+    # find it, and fails once it expands past DECOMPRESS_MAX_BYTES.
+    if encoding is None:
+        if isinstance(source, str):
+            return os.path.getsize(source)
+        if isinstance(source, bytes):
+            return len(source)
+        size = source.seek(0, os.SEEK_END)
+        source.seek(0)
+        return size
+    size = 0
+    try:
+        with _decoded(source, encoding) as stream:
+            while block := stream.read(DECODE_BLOCK_SIZE):
+                size += len(block)
+                check_expanded("The upload", size)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail=UPLOAD_ERRORS[fmt])
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+    return size
+
+
+def _open_arrow(source: Source):
+    import pyarrow as pa
+
+    if isinstance(source, str):
+        return pa.memory_map(source)
+    return pa.BufferReader(source) if isinstance(source, bytes) else source
+
+
+def _arrow_reader(source: Source):
+    import pyarrow as pa
+
+    # Accepts both the IPC stream and the IPC file (Feather v2) layouts
+    try:
+        return pa.ipc.open_stream(_open_arrow(source))
+    except pa.ArrowInvalid:
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return pa.ipc.open_file(_open_arrow(source))
+
+
+def _arrow_batches(reader):
+    if hasattr(reader, "num_record_batches"):
+        return (reader.get_batch(i) for i in range(reader.num_record_batches))
+    return reader
+
+
+def read_csv_header(source: Source, encoding: Optional[str] = None) -> List[Any]:
+    try:
+        with _decoded(source, encoding) as stream:
+            columns = list(pd.read_csv(stream, nrows=0).columns)
+    except Exception:
+        raise HTTPException(status_code=400, detail=UPLOAD_ERRORS["csv"])
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return columns
+
+
+# `usecols` selects the CSV columns to parse and is ignored for other formats
+def read_upload(
+    source: Source, fmt: str, usecols=None, encoding: Optional[str] = None
+) -> DataFrame:
+    try:
+        if fmt == "arrow":
+            return _arrow_reader(_expand(source, encoding)).read_all().to_pandas()
+        if fmt == "parquet":
+            return pd.read_parquet(_open(_expand(source, encoding)))
+        with _decoded(source, encoding) as stream:
+            return pd.read_csv(stream, usecols=usecols)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail=UPLOAD_ERRORS[fmt])
+
+
+def iter_upload(
+    source: Source, fmt: str, rows: int, usecols=None, encoding: Optional[str] = None
+) -> Iterator[DataFrame]:
+    try:
+        if fmt == "arrow":
+            batches = _arrow_batches(_arrow_reader(_expand(source, encoding)))
+        elif fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            batches = pq.ParquetFile(_open(_expand(source, encoding))).iter_batches(
+                batch_size=rows
+            )
+        else:
+            yield from _iter_csv(source, rows, usecols, encoding)
+            return
+        for batch in batches:
+            yield batch.to_pandas()
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail=UPLOAD_ERRORS[fmt])
+
+
+def _read_csv_chunks(
+    source: Source, rows: int, usecols, encoding: Optional[str], dtype=None
+) -> Iterator[DataFrame]:
+    with _decoded(source, encoding) as stream, pd.read_csv(
+        stream, chunksize=rows, usecols=usecols, dtype=dtype
+    ) as reader:
+        yield from reader
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def _common_dtype(dtypes: Iterable[Any]):
+    # The dtype concatenating parts inferred as `dtypes` gives
+    dtypes = set(dtypes)
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    if all(isinstance(d, np.dtype) and d.kind in "iuf" for d in dtypes):
+        return np.result_type(*dtypes)
+    return np.dtype(object)
+
+
+def _iter_csv(
+    source: Source, rows: int, usecols, encoding: Optional[str]
+) -> Iterator[DataFrame]:
+    # read_csv infers dtypes chunk by chunk, so a column that is empty or
+    # numeric in the first chunk may hold strings later. A first pass works
+    # out the dtypes reading the whole file gives, and the chunks of a second
+    # pass are read or cast to them. Files that fit in one chunk are read once.
+    dtypes: Dict[Any, List[Any]] = {}
+    strings = set()
+    first = None
+    count = 0
+    for chunk in _read_csv_chunks(source, rows, usecols, encoding):
+        count += 1
+        first = chunk if count == 1 else None
+        for col, dtype in chunk.dtypes.items():
+            dtypes.setdefault(col, []).append(dtype)
+            if (
+                dtype == object
+                and col not in strings
+                and pd.api.types.infer_dtype(chunk[col], skipna=True)
+                not in ("boolean", "empty")
+            ):
+                strings.add(col)
+    if count <= 1:
+        if first is not None:
+            yield first
+        return
+
+    common = {col: _common_dtype(seen) for col, seen in dtypes.items()}
+    # Numbers in a column that also holds strings are read as strings, as in
+    # a whole read. Missing values and booleans are kept as they are.
+    mixed = {
+        col: object
+        for col, dtype in common.items()
+        if col in strings and len(set(dtypes[col])) > 1
+    }
+    for chunk in _read_csv_chunks(source, rows, usecols, encoding, mixed):
+        for col, dtype in common.items():
+            if chunk[col].dtype != dtype:
+                chunk[col] = chunk[col].astype(dtype)
+        yield chunk
+
+
+def write_arrow_file(
+    df: DataFrame, path: str, metadata: Optional[Dict[bytes, bytes]] = None
+):
+    schema = arrow_schema(df)
+    if metadata:
+        schema = schema.with_metadata({**(schema.metadata or {}), **metadata})
+    write_arrow_batches([df], path, schema)
+
+
+def write_arrow_batches(
+    batches: Iterable[DataFrame], path: str, schema=None
+) -> Tuple[int, List[str]]:
+    import pyarrow as pa
+
+    # Batches are cast to one schema, see _to_tables
+    rows = 0
+    with pa.OSFile(path, "wb") as sink:
+        writer = None
+        for table in _to_tables(batches, schema):
+            if writer is None:
+                schema = table.schema
+                writer = pa.ipc.new_file(sink, schema)
+            writer.write_table(table)
+            rows += table.num_rows
+        if writer is None:
+            schema = schema or pa.schema([])
+            writer = pa.ipc.new_file(sink, schema)
+        writer.close()
+    return rows, list(schema.names)
+
+
+def read_arrow_file(path: str) -> DataFrame:
+    import pyarrow as pa
+
+    # The file is memory-mapped rather than read, and the columns are not
+    # consolidated into blocks, so numeric columns are not copied
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def encode_csv(batches: Iterable[DataFrame]) -> Iterator[bytes]:
+    header = True
+    for batch in batches:
+        yield batch.to_csv(index=False, header=header).encode()
+        header = False
+
+
+@contextmanager
+def _encoding_errors():
+    import pyarrow as pa
+
+    try:
+        yield
+    except (pa.ArrowException, ValueError) as e:
+        raise HTTPException(
+            status_code=422, detail=f"Result cannot be encoded as Arrow: {e}"
+        )
+
+
+def _to_table(batch: DataFrame, schema=None):
+    import pyarrow as pa
+
+    with _encoding_errors():
+        return pa.Table.from_pandas(batch, schema=schema, preserve_index=False)
+
+
+def _to_tables(batches: Iterable[DataFrame], schema=None):
+    import pyarrow as pa
+
+    # Without a schema it is taken from the first batches. A column with no
+    # values yet has no type, so batches are held back until every column
+    # has one, or NULL_HOLD_ROWS rows are held, and then cast to the types of
+    # all of them. Columns still without a type are written as strings. Later
+    # batches are cast to that schema, as the output has already started.
+    held: List[Any] = []
+    rows = 0
+    for batch in batches:
+        if schema is not None:
+            yield _to_table(batch, schema)
+            continue
+        held.append(_to_table(batch))
+        rows += held[-1].num_rows
+        unified = _unify([table.schema for table in held])
+        if _null_fields(unified) and rows < NULL_HOLD_ROWS:
+            continue
+        schema = _fill_null_fields(unified)
+        yield from _cast_tables(held, schema)
+        held = []
+    if held:
+        yield from _cast_tables(held, _unify([table.schema for table in held]))
+
+
+def _unify(schemas: List[Any]):
+    import pyarrow as pa
+
+    with _encoding_errors():
+        return pa.unify_schemas(schemas, promote_options="permissive")
+
+
+def _null_fields(schema) -> List[str]:
+    import pyarrow as pa
+
+    return [field.name for field in schema if pa.types.is_null(field.type)]
+
+
+def _fill_null_fields(schema):
+    import pyarrow as pa
+
+    for name in _null_fields(schema):
+        index = schema.get_field_index(name)
+        schema = schema.set(index, schema.field(index).with_type(pa.string()))
+    return schema
+
+
+def _cast_tables(tables: List[Any], schema) -> Iterator[Any]:
+    for table in tables:
+        with _encoding_errors():
+            table = table.cast(schema)
+        yield table
+
+
+def arrow_schema(df: DataFrame):
+    import pyarrow as pa
+
+    try:
+        return pa.Schema.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, ValueError) as e:
+        raise HTTPException(
+            status_code=422, detail=f"Result cannot be encoded as Arrow: {e}"
+        )
+
+
+def encode_arrow(batches: Iterable[DataFrame], schema=None) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    sink = io.BytesIO()
+    writer = None
+    for table in _to_tables(batches, schema):
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, table.schema)
+        writer.write_table(table)
+        yield _drain(sink)
+    if writer is None:
+        if schema is None:
+            return
+        writer = pa.ipc.new_stream(sink, schema)
+    writer.close()
+    yield _drain(sink)
+
+
+def encode_parquet(batches: Iterable[DataFrame], schema=None) -> Iterator[bytes]:
+    import pyarrow.parquet as pq
+
+    # Each batch becomes a row group that is sent as soon as it is written;
+    # the footer follows the last one
+    sink = io.BytesIO()
+    writer: Optional[pq.ParquetWriter] = None
+    for table in _to_tables(batches, schema):
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield _drain(sink)
+    if writer is None:
+        if schema is None:
+            return
+        writer = pq.ParquetWriter(sink, schema)
+    writer.close()
+    yield _drain(sink)
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate(0)
+    return data
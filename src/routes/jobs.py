@@ -0,0 +1,237 @@
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    UploadFile,
+)
+from starlette.concurrency import run_in_threadpool
+
+from ..auth import get_optional_user
+from ..config import CHUNKED_UPLOAD_THRESHOLD_BYTES
+from ..datasets import dataset_path
+from ..db import get_user_allowed_transforms
+from ..jobs import QueuedJob, job_lane, job_path, read_progress, remove_job_files
+from ..models import Job, JobStatus, TransformRequest, TransformStep, UserRole
+from ..status import JobNotFound
+from ..utils import get_db, get_job_queue, get_registry
+from .datasets import get_user_dataset
+from .formats import (
+    get_upload_encoding,
+    get_upload_format,
+    read_arrow_file,
+    upload_size,
+)
+from .streaming import get_stream_format, stream_frame
+from .utils import (
+    inline_schema,
+    spool_upload,
+    transform_json_job,
+    transform_upload_job,
+)
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+def new_job(request: Request, request_user, allowed):
+    # Anonymous jobs are capped per client address and can be read by anyone
+    # holding their id
+    username = request_user.username if request_user else None
+    owner_key = username or f"ip:{request.client.host if request.client else ''}"
+    job = Job(
+        job_id=uuid.uuid4().hex,
+        owner=username,
+        lane=job_lane(username, allowed),
+        created_at=datetime.now(timezone.utc),
+    )
+    get_job_queue(request).check_capacity(owner_key)
+    return job, owner_key
+
+
+async def get_user_job(request: Request, job_id: str, request_user) -> Job:
+    job = await get_job_queue(request).store.get(job_id)
+    if job is None or (
+        job.owner is not None
+        and (
+            request_user is None
+            or (
+                request_user.role != UserRole.admin
+                and request_user.username != job.owner
+            )
+        )
+    ):
+        raise JobNotFound()
+    return job
+
+
+def write_file(path: str, contents: bytes):
+    with open(path, "wb") as file:
+        file.write(contents)
+
+
+@router.post(
+    "/",
+    status_code=202,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": inline_schema(TransformRequest)}},
+        }
+    },
+)
+async def submit_json_job(
+    request: Request,
+    dataset_id: Optional[str] = Query(
+        None, description="Run on a stored dataset instead of inline data"
+    ),
+    request_user=Depends(get_optional_user),
+):
+    db = get_db(request)
+    queue = get_job_queue(request)
+
+    username = request_user.username if request_user else None
+    allowed = await get_user_allowed_transforms(db, username)
+
+    path = None
+    if dataset_id is not None:
+        await get_user_dataset(db, dataset_id, request_user)
+        path = dataset_path(dataset_id)
+
+    await queue.purge_expired()
+    job, owner_key = new_job(request, request_user, allowed)
+    input_path = job_path(job.job_id, "input")
+    await run_in_threadpool(write_file, input_path, await request.body())
+
+    args = (
+        input_path,
+        get_registry(request),
+        allowed,
+        path,
+        job_path(job.job_id, "arrow"),
+        job_path(job.job_id, "progress"),
+    )
+    try:
+        await queue.submit(QueuedJob(job, owner_key, transform_json_job, args))
+    except BaseException:
+        remove_job_files(job.job_id)
+        raise
+    return job
+
+
+@router.post("/file", status_code=202)
+async def submit_file_job(
+    request: Request,
+    file: UploadFile = File(...),
+    pipeline: str = Form(...),
+    chunked: bool = Form(False),
+    request_user=Depends(get_optional_user),
+):
+    db = get_db(request)
+    queue = get_job_queue(request)
+    input_format = get_upload_format(file)
+    input_encoding = get_upload_encoding(file)
+
+    username = request_user.username if request_user else None
+    allowed = await get_user_allowed_transforms(db, username)
+
+    try:
+        pipeline_data = json.loads(pipeline)
+        if not isinstance(pipeline_data, list):
+            raise ValueError("Pipeline must be a list of transformation steps")
+        pipeline_steps = [TransformStep(**step) for step in pipeline_data]
+    except Exception as e:
+        raise HTTPException(
+            status_code=400, detail=f"Invalid pipeline format. {str(e)}"
+        )
+
+    # Compressed uploads count by the size they expand to
+    size = await run_in_threadpool(
+        upload_size, file.file, input_format, input_encoding
+    )
+    chunked = chunked or bool(
+        CHUNKED_UPLOAD_THRESHOLD_BYTES and size > CHUNKED_UPLOAD_THRESHOLD_BYTES
+    )
+
+    await queue.purge_expired()
+    job, owner_key = new_job(request, request_user, allowed)
+    input_path = await spool_upload(file, job_path(job.job_id, "input"))
+
+    args = (
+        pipeline_steps,
+        input_path,
+        input_format,
+        chunked,
+        get_registry(request),
+        allowed,
+        job_path(job.job_id, "arrow"),
+        job_path(job.job_id, "progress"),
+        input_encoding,
+    )
+    try:
+        await queue.submit(QueuedJob(job, owner_key, transform_upload_job, args))
+    except BaseException:
+        remove_job_files(job.job_id)
+        raise
+    return job
+
+
+@router.get("/{job_id}")
+async def get_job_status(
+    request: Request,
+    job_id: str = Path(..., description="Job id"),
+    request_user=Depends(get_optional_user),
+):
+    job = await get_user_job(request, job_id, request_user)
+    status = job.model_dump()
+    if job.status == JobStatus.queued:
+        status["position"] = get_job_queue(request).position(job_id)
+    elif job.status == JobStatus.running:
+        progress = read_progress(job_path(job_id, "progress"))
+        status["progress"] = progress if progress is not None else job.progress
+    return status
+
+
+@router.get("/{job_id}/result")
+async def get_job_result(
+    request: Request,
+    job_id: str = Path(..., description="Job id"),
+    stream: Optional[str] = Query(
+        None,
+        description="Result format: 'ndjson', 'json', 'csv', 'arrow' or 'parquet'. "
+        "Also negotiated through the Accept header.",
+    ),
+    request_user=Depends(get_optional_user),
+):
+    job = await get_user_job(request, job_id, request_user)
+    if job.status == JobStatus.failed:
+        raise HTTPException(job.error["status_code"], detail=job.error["detail"])
+    if job.status != JobStatus.succeeded:
+        raise HTTPException(409, detail=f"Job is {job.status.value}")
+
+    stream_format = get_stream_format(request, stream) or "json"
+    try:
+        df = await run_in_threadpool(read_arrow_file, job_path(job_id, "arrow"))
+    except FileNotFoundError:
+        raise JobNotFound("Job result has expired")
+    return await stream_frame(df, stream_format)
+
+
+@router.delete("/{job_id}")
+async def cancel_job(
+    request: Request,
+    job_id: str = Path(..., description="Job id"),
+    request_user=Depends(get_optional_user),
+):
+    await get_user_job(request, job_id, request_user)
+    if not await get_job_queue(request).cancel(job_id):
+        raise HTTPException(409, detail="Only queued jobs can be cancelled")
+    return {"status": "Cancelled"}
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import uuid
+from typing import List
+
+from fastapi import APIRouter, Depends, File, Form, Path, Request, UploadFile
+
+from ..auth import admin_required, get_current_user
+from ..config import LOOKUP_DIR, LOOKUP_MAX_BYTES
+from ..lookups import (
+    LOOKUP_NAME,
+    list_lookups,
+    lookup_info,
+    lookup_path,
+    remove_lookup,
+)
+from ..status import LookupNotFound, QuotaExceeded
+from ..utils import get_executor
+from .formats import get_upload_encoding, get_upload_format
+from .utils import spool_upload, store_lookup
+
+router = APIRouter(prefix="/lookups", tags=["Lookups"])
+
+# Uploads are parsed side by side, but checked against LOOKUP_MAX_BYTES and
+# swapped in one at a time, so together they cannot exceed it
+_swap_lock = asyncio.Lock()
+
+
+@router.put("/{name}")
+async def upload_lookup(
+    request: Request,
+    name: str = Path(
+        ..., description="Lookup table name", pattern=LOOKUP_NAME.pattern
+    ),
+    file: UploadFile = File(...),
+    key: List[str] = Form(..., description="Key column, repeated for a compound key"),
+    admin=Depends(admin_required),
+):
+    executor = get_executor(request)
+    input_format = get_upload_format(file)
+    input_encoding = get_upload_encoding(file)
+
+    # The table is written next to the one it replaces, then swapped in, so
+    # pipelines read either the old table or the new one
+    path = lookup_path(name)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(LOOKUP_DIR, exist_ok=True)
+
+    spooled = executor.backend == "process"
+    source = await spool_upload(file) if spooled else file.file
+    try:
+        info = await executor.run(
+            request, store_lookup, source, input_format, tmp_path, key, input_encoding
+        )
+        async with _swap_lock:
+            others = sum(
+                lookup.size_bytes for lookup in list_lookups() if lookup.name != name
+            )
+            total = others + info["size_bytes"]
+            if 0 < LOOKUP_MAX_BYTES < total:
+                raise QuotaExceeded(
+                    f"Lookup tables would take {total} bytes in memory, over the "
+                    f"limit of {LOOKUP_MAX_BYTES} bytes"
+                )
+            os.replace(tmp_path, path)
+    finally:
+        if spooled:
+            os.remove(source)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return lookup_info(name)
+
+
+@router.get("/")
+async def get_lookups(user=Depends(get_current_user)):
+    return list_lookups()
+
+
+@router.get("/{name}")
+async def get_lookup_info(
+    name: str = Path(
+        ..., description="Lookup table name", pattern=LOOKUP_NAME.pattern
+    ),
+    user=Depends(get_current_user),
+):
+    lookup = lookup_info(name)
+    if lookup is None:
+        raise LookupNotFound()
+    return lookup
+
+
+@router.delete("/{name}")
+async def delete_lookup(
+    name: str = Path(
+        ..., description="Lookup table name", pattern=LOOKUP_NAME.pattern
+    ),
+    admin=Depends(admin_required),
+):
+    if not remove_lookup(name):
+        raise LookupNotFound()
+    return {"status": "Deleted"}
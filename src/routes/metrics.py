@@ -0,0 +1,81 @@
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+
+from ..config import METRICS_ENABLED, SLOW_PIPELINE_SECONDS
+from ..logger import get_logger
+from ..metrics import Phase, Trace, record_trace, render_metrics, traced
+from ..models import User
+from ..rate_limiter import limiter
+from ..utils import get_executor
+
+router = APIRouter(tags=["Metrics"])
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+@limiter.exempt
+async def get_metrics(request: Request):
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+
+async def run_instrumented(
+    request: Request,
+    endpoint: str,
+    request_user: Optional[User],
+    func: Callable[..., Any],
+    *args,
+    record: bool = True,
+) -> Tuple[Any, Trace]:
+    # Runs a transform job on the pipeline executor and records how long its
+    # phases and steps took, unless `record` is off because the result is
+    # still to be streamed. With metrics disabled the trace only holds the
+    # steps the job ran.
+    start = time.perf_counter()
+    result, trace = await get_executor(request).run(
+        request, traced, METRICS_ENABLED, func, *args
+    )
+    if not METRICS_ENABLED:
+        return result, trace
+    trace.total = time.perf_counter() - start
+    if record:
+        finish_trace(trace, endpoint, request_user)
+    return result, trace
+
+
+def finish_trace(trace: Trace, endpoint: str, request_user: Optional[User]):
+    role = request_user.role.value if request_user else "anonymous"
+    record_trace(trace, endpoint, role)
+    if SLOW_PIPELINE_SECONDS and trace.total >= SLOW_PIPELINE_SECONDS:
+        username = request_user.username if request_user else None
+        get_logger("metrics").warning(
+            f"Slow pipeline on {endpoint} ({trace.total:.3f}s, user {username}): "
+            f"{trace.describe()}"
+        )
+
+
+def serialize_timer(
+    trace: Trace, endpoint: str, request_user: Optional[User]
+) -> Optional[Callable[[float], None]]:
+    # Streamed results are encoded after the header is sent, so their
+    # encoding time is added to the trace and recorded once the stream ends
+    if not trace.timing:
+        return None
+
+    def done(seconds: float):
+        trace.phases.append(Phase("serialize", seconds))
+        trace.total += seconds
+        finish_trace(trace, endpoint, request_user)
+
+    return done
+
+
+def add_server_timing(response: Response, trace: Optional[Trace]) -> Response:
+    if trace is not None and trace.timing:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import time
+from contextlib import ExitStack
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+)
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from ..compression import quality_values
+from ..config import STREAM_BATCH_ROWS
+from ..result_cache import DIGEST_BLOCK_SIZE
+from .formats import (
+    ARROW_MEDIA_TYPE,
+    CSV_MEDIA_TYPE,
+    PARQUET_MEDIA_TYPE,
+    arrow_schema,
+    encode_arrow,
+    encode_csv,
+    encode_parquet,
+)
+from .utils import safe_dict
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_FORMATS = {
+    "ndjson": NDJSON_MEDIA_TYPE,
+    "json": "application/json",
+    "csv": CSV_MEDIA_TYPE,
+    "arrow": ARROW_MEDIA_TYPE,
+    "parquet": PARQUET_MEDIA_TYPE,
+}
+COLUMNAR_FORMATS = ("arrow", "parquet")
+
+# Accept header media types, None meaning the regular JSON response
+ACCEPT_FORMATS = {
+    "*/*": None,
+    "application/*": None,
+    "application/json": None,
+    NDJSON_MEDIA_TYPE: "ndjson",
+    CSV_MEDIA_TYPE: "csv",
+    ARROW_MEDIA_TYPE: "arrow",
+    PARQUET_MEDIA_TYPE: "parquet",
+    "application/vnd.apache.parquet": "parquet",
+}
+
+
+def get_stream_format(request: Request, stream: Optional[str]) -> Optional[str]:
+    if stream:
+        if stream not in STREAM_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid stream format '{stream}', expected one of "
+                f"{sorted(STREAM_FORMATS)}",
+            )
+        return stream
+    return negotiate_format(request.headers.get("accept", ""))
+
+
+def negotiate_format(accept: str) -> Optional[str]:
+    best, best_quality = None, 0.0
+    for media_type, quality in quality_values(accept):
+        if media_type in ACCEPT_FORMATS and quality > best_quality:
+            best, best_quality = ACCEPT_FORMATS[media_type], quality
+    return best
+
+
+def frame_batches(df: DataFrame, rows: int) -> Iterator[DataFrame]:
+    # An empty frame still gives one batch, so headers and schemas get written
+    for start in range(0, max(len(df), 1), rows):
+        yield df.iloc[start : start + rows]
+
+
+def prime(chunks: Iterator) -> Iterator:
+    # Runs the producer up to its first chunk, so errors raised before any
+    # output still reach the client as a proper error response
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], chunks)
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _encode_rows(batch: DataFrame) -> Iterator[str]:
+    for row in safe_dict(batch.to_dict(orient="records")):
+        yield json.dumps(row, default=_default)
+
+
+def encode_ndjson(batches: Iterable[DataFrame]) -> Iterator[bytes]:
+    for batch in batches:
+        lines = "".join(row + "\n" for row in _encode_rows(batch))
+        if lines:
+            yield lines.encode()
+
+
+def encode_json(batches: Iterable[DataFrame]) -> Iterator[bytes]:
+    # Same document as the non-streaming response, written batch by batch
+    prefix = '{"result":['
+    for batch in batches:
+        rows = ",".join(_encode_rows(batch))
+        if rows:
+            yield (prefix + rows).encode()
+            prefix = ","
+    yield (prefix.rstrip(",") + "]}").encode()
+
+
+ENCODERS = {
+    "ndjson": encode_ndjson,
+    "json": encode_json,
+    "csv": encode_csv,
+    "arrow": encode_arrow,
+    "parquet": encode_parquet,
+}
+
+
+Tee = Callable[[Iterator[bytes]], Iterator[bytes]]
+Timer = Callable[[float], None]
+
+
+def timed(chunks: Iterator[bytes], timer: Timer) -> Iterator[bytes]:
+    # Passes the time spent producing the chunks to `timer` once the stream
+    # ends or is closed, leaving out the time spent sending them
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield chunk
+    finally:
+        timer(seconds)
+
+
+def read_blocks(file) -> Iterator[bytes]:
+    with file:
+        while block := file.read(DIGEST_BLOCK_SIZE):
+            yield block
+
+
+def stream_file(path: str, fmt: str, tee: Optional[Tee] = None) -> StreamingResponse:
+    # The file is removed once open, so it goes away with the response even
+    # if the body is never read
+    file = open(path, "rb")
+    os.remove(path)
+    body = read_blocks(file)
+    return StreamingResponse(tee(body) if tee else body, media_type=STREAM_FORMATS[fmt])
+
+
+def json_response(content: Any) -> JSONResponse:
+    # The response FastAPI builds for a returned dict, built by the endpoint
+    # so its body can be cached
+    return JSONResponse(jsonable_encoder(content))
+
+
+def close_all(callbacks: Sequence[Callable[[], None]]):
+    # Every callback runs even if an earlier one fails
+    with ExitStack() as stack:
+        for callback in reversed(callbacks):
+            stack.callback(callback)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    # Runs `on_close` once the response is over, whether it was sent in full,
+    # failed or was dropped by the client, even before its body was started
+    def __init__(self, content, on_close: Sequence[Callable[[], None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await run_in_threadpool(close_all, self.on_close)
+
+
+async def stream_batches(
+    batches: Iterator[DataFrame],
+    fmt: str,
+    frame: Optional[DataFrame] = None,
+    tee: Optional[Tee] = None,
+    timer: Optional[Timer] = None,
+    on_close: Sequence[Callable[[], None]] = (),
+) -> StreamingResponse:
+    def start():
+        encode = ENCODERS[fmt]
+        if fmt in COLUMNAR_FORMATS and frame is not None:
+            # The schema of a complete frame is inferred from all its rows
+            body = encode(batches, arrow_schema(frame))
+        else:
+            body = encode(batches)
+        if timer:
+            body = timed(body, timer)
+        return prime(tee(body) if tee else body)
+
+    try:
+        body = await run_in_threadpool(start)
+    except BaseException:
+        await run_in_threadpool(close_all, on_close)
+        raise
+    if on_close:
+        return ClosingStreamingResponse(
+            body, on_close, media_type=STREAM_FORMATS[fmt]
+        )
+    return StreamingResponse(body, media_type=STREAM_FORMATS[fmt])
+
+
+async def stream_frame(
+    df: DataFrame, fmt: str, tee: Optional[Tee] = None, timer: Optional[Timer] = None
+) -> StreamingResponse:
+    return await stream_batches(
+        frame_batches(df, STREAM_BATCH_ROWS), fmt, df, tee, timer
+    )
@@ -1,7 +1,9 @@
-import io
 import json
+import os
+import tempfile
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
 
-import pandas as pd
 from fastapi import (
     APIRouter,
     Depends,
@@ -9,36 +11,220 @@ from fastapi import (
     Form,
     HTTPException,
     Path,
+    Query,
     Request,
+    Response,
     UploadFile,
 )
+from starlette.concurrency import run_in_threadpool
 
 from ..auth import admin_required, get_optional_user
-from ..db import get_user, get_user_allowed_transforms, set_user_transforms
-from ..models import TransformConfig, TransformRequest, TransformStep, UserRole
-from ..utils import get_db, get_registry
-from .utils import execute_pipeline, safe_dict
+from ..config import BULK_MAX_USERS, CHUNKED_UPLOAD_THRESHOLD_BYTES
+from ..datasets import dataset_path
+from ..db import (
+    get_user,
+    get_user_allowed_transforms,
+    get_user_roles,
+    set_user_transforms,
+    set_users_transforms,
+)
+from ..lookups import lookups_version
+from ..memory import check_size
+from ..metrics import Trace
+from ..models import (
+    BatchTransformRequest,
+    BulkTransformConfig,
+    TransformConfig,
+    TransformRequest,
+    TransformStep,
+    User,
+    UserRole,
+)
+from ..result_cache import ResultCache, digest_bytes, digest_file, make_key
+from ..utils import get_db, get_executor, get_registry, get_result_cache
+from .admission import admitted
+from .caching import cache_requested, cached_response, permission_key, pipeline_key
+from .datasets import get_user_dataset
+from .formats import get_upload_encoding, get_upload_format, upload_size
+from .metrics import add_server_timing, run_instrumented, serialize_timer
+from .streaming import (
+    get_stream_format,
+    json_response,
+    stream_batches,
+    stream_file,
+    stream_frame,
+)
+from .utils import (
+    check_engine,
+    inline_schema,
+    iter_upload_chunked,
+    spool_upload,
+    transform_batch,
+    transform_json,
+    transform_upload,
+    transform_upload_chunked,
+)
 
 router = APIRouter(prefix="/transform", tags=["Transform"])
 
+CACHE_QUERY = Query(
+    True,
+    description="Serve and store the result through the result cache. Also "
+    "disabled by a 'Cache-Control: no-cache' or 'no-store' request header.",
+)
+DATASET_QUERY = Query(
+    None, description="Run on a stored dataset instead of inline data"
+)
+ENGINE_QUERY = Query(
+    None,
+    description="Engine that runs the pipeline, e.g. 'polars'. Pipelines it "
+    "cannot run exactly fall back to pandas. Defaults to the ENGINE setting.",
+)
+STREAM_QUERY = Query(
+    None,
+    description="Stream the result as 'ndjson', a chunked 'json' array, 'csv', "
+    "'arrow' (IPC stream) or 'parquet'. Also negotiated through the Accept header.",
+)
+
+
+async def send_result(
+    result: Any,
+    trace: Trace,
+    stream_format: Optional[str],
+    endpoint: str,
+    request_user: Optional[User],
+    result_cache: Optional[ResultCache] = None,
+    key: Optional[str] = None,
+) -> Response:
+    # A cache miss sends the response the uncached request gets and stores
+    # its body. Streamed results were run with the trace left unrecorded.
+    if stream_format:
+        tee = result_cache.writer(key, stream_format) if key else None
+        timer = serialize_timer(trace, endpoint, request_user)
+        return add_server_timing(
+            await stream_frame(result, stream_format, tee, timer), trace
+        )
+    response = await run_in_threadpool(json_response, {"result": result})
+    if key:
+        await run_in_threadpool(result_cache.put, key, "json", response.body)
+    return add_server_timing(response, trace)
 
-@router.post("/")
+
+@router.post(
+    "/",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": inline_schema(TransformRequest)}},
+        }
+    },
+)
 async def transform_json_data(
-    request_data: TransformRequest,
     request: Request,
+    stream: Optional[str] = STREAM_QUERY,
+    cache: bool = CACHE_QUERY,
+    dataset_id: Optional[str] = DATASET_QUERY,
+    engine: Optional[str] = ENGINE_QUERY,
     request_user=Depends(get_optional_user),
 ):
     db = get_db(request)
     registry = get_registry(request)
+    stream_format = get_stream_format(request, stream)
+    engine = check_engine(engine, registry)
 
     username = request_user.username if request_user else None
     allowed = await get_user_allowed_transforms(db, username)
 
-    df = pd.DataFrame(request_data.data)
+    path = None
+    if dataset_id is not None:
+        await get_user_dataset(db, dataset_id, request_user)
+        path = dataset_path(dataset_id)
 
-    df = execute_pipeline(request_data.pipeline, df, registry, allowed)
+    body = await request.body()
 
-    return {"result": safe_dict(df.to_dict(orient="records"))}
+    # The raw body holds both the data and the pipeline, so it is hashed as is
+    result_cache = key = None
+    if cache_requested(request, cache):
+        result_cache = get_result_cache(request)
+        key = make_key(
+            "json",
+            dataset_id,
+            await run_in_threadpool(digest_bytes, body),
+            permission_key(allowed),
+            stream_format,
+            engine,
+            lookups_version(),
+        )
+        if hit := cached_response(result_cache, key):
+            return hit
+
+    # The body is decoded and validated in the executor, see transform_json
+    input_bytes = len(body) + (os.path.getsize(path) if path else 0)
+    async with admitted(request, request_user, input_bytes) as admission:
+        result, trace = await run_instrumented(
+            request,
+            "transform",
+            request_user,
+            transform_json,
+            body,
+            registry,
+            allowed,
+            stream_format is None,
+            path,
+            engine,
+            record=stream_format is None,
+        )
+        admission.settle(trace.steps)
+
+    return await send_result(
+        result, trace, stream_format, "transform", request_user, result_cache, key
+    )
+
+
+@router.post(
+    "/batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": inline_schema(BatchTransformRequest)}
+            },
+        }
+    },
+)
+async def transform_batch_data(
+    request: Request,
+    response: Response,
+    dataset_id: Optional[str] = DATASET_QUERY,
+    request_user=Depends(get_optional_user),
+):
+    db = get_db(request)
+    registry = get_registry(request)
+
+    username = request_user.username if request_user else None
+    allowed = await get_user_allowed_transforms(db, username)
+
+    path = None
+    if dataset_id is not None:
+        await get_user_dataset(db, dataset_id, request_user)
+        path = dataset_path(dataset_id)
+
+    body = await request.body()
+    input_bytes = len(body) + (os.path.getsize(path) if path else 0)
+    async with admitted(request, request_user, input_bytes) as admission:
+        results, trace = await run_instrumented(
+            request,
+            "batch",
+            request_user,
+            transform_batch,
+            body,
+            registry,
+            allowed,
+            path,
+        )
+        admission.settle(trace.steps)
+    add_server_timing(response, trace)
+    return {"results": results}
 
 
 @router.post("/file")
@@ -46,20 +232,23 @@ async def transform_file_data(
     request: Request,
     file: UploadFile = File(...),
     pipeline: str = Form(...),
+    chunked: bool = Form(False),
+    stream: Optional[str] = STREAM_QUERY,
+    cache: bool = CACHE_QUERY,
+    engine: Optional[str] = ENGINE_QUERY,
     request_user=Depends(get_optional_user),
 ):
     db = get_db(request)
     registry = get_registry(request)
+    executor = get_executor(request)
+    stream_format = get_stream_format(request, stream)
+    input_format = get_upload_format(file)
+    input_encoding = get_upload_encoding(file)
+    engine = check_engine(engine, registry)
 
     username = request_user.username if request_user else None
     allowed = await get_user_allowed_transforms(db, username)
 
-    try:
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents))
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid CSV file.")
-
     try:
         pipeline_data = json.loads(pipeline)
         if not isinstance(pipeline_data, list):
@@ -70,9 +259,100 @@ async def transform_file_data(
             status_code=400, detail=f"Invalid pipeline format. {str(e)}"
         )
 
-    df = execute_pipeline(pipeline_steps, df, registry, allowed)
+    # Large uploads are parsed and transformed in chunks straight from the
+    # spooled upload instead of being read into memory. Compressed uploads
+    # count by the size they expand to.
+    size = await run_in_threadpool(
+        upload_size, file.file, input_format, input_encoding
+    )
+    chunked = chunked or (
+        CHUNKED_UPLOAD_THRESHOLD_BYTES and size > CHUNKED_UPLOAD_THRESHOLD_BYTES
+    )
+
+    result_cache = key = None
+    if cache_requested(request, cache):
+        result_cache = get_result_cache(request)
+        key = make_key(
+            "file",
+            await run_in_threadpool(digest_file, file.file),
+            input_format,
+            input_encoding,
+            bool(chunked),
+            pipeline_key(pipeline_steps),
+            permission_key(allowed),
+            stream_format,
+            engine,
+            lookups_version(),
+        )
+        if hit := cached_response(result_cache, key):
+            return hit
+
+    steps = [step.name for step in pipeline_steps]
+    async with admitted(request, request_user, size, steps) as admission:
+        # Chunks are produced while the response is sent, after the upload
+        # itself has been closed, so they are read from a spooled copy
+        if chunked and stream_format:
+            path = await spool_upload(file)
+            batches = iter_upload_chunked(
+                pipeline_steps, path, input_format, registry, allowed, input_encoding
+            )
+            return await stream_batches(
+                batches,
+                stream_format,
+                tee=result_cache.writer(key, stream_format) if key else None,
+                on_close=(admission.hold(), partial(os.remove, path)),
+            )
 
-    return {"result": safe_dict(df.to_dict(orient="records"))}
+        if chunked:
+            # The process backend cannot share the upload's file object
+            spooled = executor.backend == "process"
+            source = await spool_upload(file) if spooled else file.file
+            fd, result_path = tempfile.mkstemp(suffix=".json")
+            os.close(fd)
+            try:
+                _, trace = await run_instrumented(
+                    request,
+                    "file",
+                    request_user,
+                    transform_upload_chunked,
+                    pipeline_steps,
+                    source,
+                    input_format,
+                    registry,
+                    allowed,
+                    input_encoding,
+                    result_path,
+                )
+            except BaseException:
+                os.remove(result_path)
+                raise
+            finally:
+                if spooled:
+                    os.remove(source)
+            tee = result_cache.writer(key, "json") if key else None
+            return add_server_timing(stream_file(result_path, "json", tee), trace)
+
+        check_size("The upload", size)
+        contents = await file.read()
+        result, trace = await run_instrumented(
+            request,
+            "file",
+            request_user,
+            transform_upload,
+            pipeline_steps,
+            contents,
+            input_format,
+            registry,
+            allowed,
+            stream_format is None,
+            engine,
+            input_encoding,
+            record=stream_format is None,
+        )
+
+    return await send_result(
+        result, trace, stream_format, "file", request_user, result_cache, key
+    )
 
 
 @router.get("/")
@@ -90,12 +370,18 @@ async def get_available_transforms(
     return {
         t: {
             "enabled": allowed is None or t in allowed,
+            "engines": registry.list_engines(t),
             **registry.get(t).get_metadata(),
         }
         for t in all_transforms
     }
 
 
+@router.get("/cache")
+async def get_result_cache_stats(request: Request, admin=Depends(admin_required)):
+    return get_result_cache(request).get_stats()
+
+
 @router.put("/user/{username}")
 async def set_user_transform_config(
     request: Request,
@@ -121,3 +407,52 @@ async def set_user_transform_config(
 
     await set_user_transforms(db, username, config.enabled_transforms)
     return {"status": "Updated"}
+
+
+@router.put("/users")
+async def set_users_transform_config(
+    request: Request,
+    body: BulkTransformConfig,
+    admin=Depends(admin_required),
+):
+    # Users that cannot be updated fail on their own, with the error
+    # /user/{username} would give them. The others are updated together.
+    if len(body.users) > BULK_MAX_USERS:
+        raise HTTPException(
+            422, detail=f"At most {BULK_MAX_USERS} users can be updated at once"
+        )
+    db = get_db(request)
+    available = set(get_registry(request).list_available())
+    roles = await get_user_roles(db, {config.username for config in body.users})
+
+    errors: Dict[int, Tuple[int, str]] = {}
+    updates: Dict[str, List[str]] = {}
+    for index, config in enumerate(body.users):
+        username = config.username
+        if invalid := [t for t in config.enabled_transforms if t not in available]:
+            errors[index] = (400, f"Invalid transforms: {invalid}")
+        elif username not in roles:
+            errors[index] = (400, f"User '{username}' not found")
+        elif roles[username] == UserRole.admin:
+            errors[index] = (400, "User is an admin, cannot modify transforms")
+        elif username in updates:
+            errors[index] = (400, "Duplicate username in request")
+        else:
+            updates[username] = config.enabled_transforms
+
+    failed = await set_users_transforms(db, updates) if updates else {}
+    results = []
+    for index, config in enumerate(body.users):
+        if index not in errors and config.username in failed:
+            errors[index] = (500, failed[config.username])
+        if index in errors:
+            status_code, detail = errors[index]
+            results.append(
+                {
+                    "username": config.username,
+                    "error": {"status_code": status_code, "detail": detail},
+                }
+            )
+        else:
+            results.append({"username": config.username, "status": "Updated"})
+    return {"results": results}
@@ -1,46 +1,396 @@
+from __future__ import annotations
+
+import json
 import math
-from typing import List
+import os
+import tempfile
+from contextlib import closing
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
-import pandas as pd
-from fastapi import HTTPException
+import orjson
+from fastapi import HTTPException, UploadFile
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError
 
-from ..models import TransformStep
-from ..transformer import TransformerRegistry
+from ..chunked import external_sort
+from ..config import BATCH_MAX_PIPELINES, CHUNK_ROWS, ENGINE, SORT_RUN_ROWS
+from ..engines import run_engine
+from ..jobs import ProgressReporter, job_result
+from ..lazy import pd
+from ..logger import get_logger
+from ..lookups import LookupTable
+from ..memory import check_budget, check_size, compact_frame, restore_dtypes
+from ..metrics import current_trace, phase, record_steps, trace_step
+from ..models import (
+    BatchTransformRequest,
+    TransformInput,
+    TransformRequest,
+    TransformStep,
+)
+from ..partition import PartitionError, map_partitions, partition_count
+from ..planner import (
+    LIMIT_STEPS,
+    PlanNode,
+    PrefixNode,
+    plan_pipeline,
+    prefix_tree,
+    run_fused,
+    scan_pipeline,
+)
+from ..transformer import (
+    DEFAULT_ENGINE,
+    Schema,
+    Transformer,
+    TransformerRegistry,
+    frame_schema,
+)
+from .formats import (
+    iter_upload,
+    read_arrow_file,
+    read_csv_header,
+    read_upload,
+    upload_size,
+    write_arrow_batches,
+    write_arrow_file,
+)
 
+SPOOL_BLOCK_SIZE = 1024 * 1024
 
-def execute_pipeline(
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def inline_schema(model: type) -> Dict[str, Any]:
+    # JSON schema of a model with its definitions inlined, for documenting
+    # request bodies that are read raw
+    schema = model.model_json_schema(ref_template="{model}")
+    definitions = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return resolve(definitions[node["$ref"]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+
+    return resolve(schema)
+
+
+def check_pipeline(
     pipeline: List[TransformStep],
-    df: pd.DataFrame,
     registry: TransformerRegistry,
     allowed=None,
-) -> pd.DataFrame:
+):
     for step in pipeline:
         name = step.name
-        kwargs = step.args
 
         # Transformer lookup
-        transformer = registry.get(name)
-        if not transformer:
+        if not registry.get(name):
             raise HTTPException(400, detail=f"Unknown transformer: {name}")
 
         # Permission check
         if allowed is not None and name not in allowed:
             raise HTTPException(400, detail=f"Transformer not allowed: {name}")
 
-        # Run transformer.validate()
-        try:
-            transformer.validate(df, kwargs)
-        except Exception as e:
-            raise HTTPException(422, detail=f"Validation failed for '{name}': {str(e)}")
 
-        # Run Pipeline
+def check_engine(engine: Optional[str], registry: TransformerRegistry) -> str:
+    # The ENGINE setting falls back to pandas when its library is missing
+    if engine is None:
+        return ENGINE if ENGINE in registry.list_engines() else DEFAULT_ENGINE
+    if engine not in registry.list_engines():
+        raise HTTPException(400, detail=f"Unknown engine: {engine}")
+    return engine
+
+
+def check_schema(
+    nodes: List[PlanNode], schema: Optional[Schema], registry: TransformerRegistry
+) -> Optional[Schema]:
+    # Every step is validated against the columns and dtypes it will see
+    # before any of them runs, with the errors the run would give. Checking
+    # stops at the first step whose output schema is unknown.
+    for node in nodes:
+        for step in node.steps:
+            if schema is None:
+                return None
+            transformer = registry.get(step.name)
+            try:
+                transformer.validate_schema(schema, step.args)
+            except Exception as e:
+                raise HTTPException(
+                    422, detail=f"Validation failed for '{step.name}': {str(e)}"
+                )
+            try:
+                schema = transformer.output_schema(schema, step.args)
+            except Exception as e:
+                raise HTTPException(
+                    422, detail=f"Simulation failed for '{step.name}': {str(e)}"
+                )
+    return schema
+
+
+def run_step(
+    name: str, transformer: Transformer, df: pd.DataFrame, kwargs: Dict[str, Any]
+) -> pd.DataFrame:
+    # Run transformer.validate()
+    try:
+        transformer.validate(df, kwargs)
+    except Exception as e:
+        raise HTTPException(422, detail=f"Validation failed for '{name}': {str(e)}")
+
+    # Run Pipeline
+    try:
+        return transformer.run(df, **kwargs)
+    except Exception as e:
+        raise HTTPException(422, detail=f"Simulation failed for '{name}': {str(e)}")
+
+
+def run_node(node: PlanNode, df: pd.DataFrame, registry: TransformerRegistry):
+    if not node.fused:
+        return run_step(node.name, registry.get(node.name), df, node.args)
+
+    # Fused steps keep dtypes, so they can be validated one by one against an
+    # empty frame before the single fused operation runs.
+    schema = df.iloc[:0]
+    for step in node.steps:
+        schema = run_step(step.name, registry.get(step.name), schema, step.args)
+
+    try:
+        return run_fused(node, df)
+    except Exception as e:
+        raise HTTPException(
+            422, detail=f"Simulation failed for '{node.label}': {str(e)}"
+        )
+
+
+def is_row_local(node: PlanNode, registry: TransformerRegistry) -> bool:
+    if node.fused:
+        return node.fusion == "project"
+    return registry.get(node.name).row_local
+
+
+def runs_parallel(nodes: List[PlanNode], registry: TransformerRegistry) -> bool:
+    if not all(is_row_local(node, registry) for node in nodes):
+        return False
+    return any(
+        registry.get(step.name).runs_parallel(step.args)
+        for node in nodes
+        for step in node.steps
+    )
+
+
+def run_nodes(
+    df: pd.DataFrame, nodes: List[PlanNode], registry: TransformerRegistry
+) -> pd.DataFrame:
+    for node in nodes:
+        df = run_node(node, df, registry)
+    return df
+
+
+def execute_pipeline(
+    pipeline: List[TransformStep],
+    df: pd.DataFrame,
+    registry: TransformerRegistry,
+    allowed=None,
+    progress: Optional[Callable[[float], None]] = None,
+    engine: str = DEFAULT_ENGINE,
+) -> pd.DataFrame:
+    check_pipeline(pipeline, registry, allowed)
+
+    nodes = plan_pipeline(pipeline)
+    schema = check_schema(nodes, frame_schema(df), registry)
+    # The input stays alive with the caller, so every step counts against the
+    # memory budget along with it
+    source = df
+
+    # Other engines only run pipelines the static check covered in full, so
+    # the validation errors are the pandas ones. Pipelines they cannot run
+    # exactly, or fail on, run on pandas.
+    if engine != DEFAULT_ENGINE and schema is not None:
+        with phase("engine"):
+            result = run_engine(engine, pipeline, df, registry)
+        if result is not None:
+            check_budget("The pipeline", source, result)
+            return result
+
+    # Row-local pipelines with a costly step run on row partitions in
+    # parallel. Step errors are raised as they are; if the partitions cannot
+    # be run, the pipeline runs on the whole frame instead.
+    parts = partition_count(len(df))
+    if parts > 1 and runs_parallel(nodes, registry):
         try:
-            df = transformer.run(df, **kwargs)
-        except Exception as e:
-            raise HTTPException(422, detail=f"Simulation failed for '{name}': {str(e)}")
+            with phase("partitions"):
+                result = map_partitions(
+                    run_nodes, df, parts, nodes, registry, progress=progress
+                )
+        except PartitionError as e:
+            get_logger("partition").warning(f"Running without partitions: {e}")
+        else:
+            check_budget("The pipeline", source, result)
+            return result
+
+    trace = current_trace()
+    for i, node in enumerate(nodes):
+        if trace is None or not trace.timing:
+            df = run_node(node, df, registry)
+        else:
+            df = trace_step(
+                trace,
+                node.name,
+                node.label,
+                df,
+                lambda node=node, df=df: run_node(node, df, registry),
+            )
+        check_budget(f"Step '{node.label}'", source, df)
+        if progress:
+            progress((i + 1) / len(nodes))
     return df
 
 
+def execute_prefix_tree(
+    root: PrefixNode, df: pd.DataFrame, registry: TransformerRegistry
+) -> Dict[int, Dict[str, Any]]:
+    # Each node of the tree runs once on the output of its parent. A failing
+    # node fails every pipeline below it and leaves its siblings running.
+    results: Dict[int, Dict[str, Any]] = {}
+    source = df
+    stack = [(root, df)]
+    while stack:
+        tree_node, df = stack.pop()
+        try:
+            if tree_node.node is not None:
+                df = run_node(tree_node.node, df, registry)
+                check_budget(f"Step '{tree_node.node.label}'", source, df)
+        except HTTPException as e:
+            error = {"error": {"status_code": e.status_code, "detail": e.detail}}
+            for index in tree_node.subtree_pipelines():
+                results[index] = error
+            continue
+
+        if tree_node.pipelines:
+            result = {"result": to_records(df)}
+            for index in tree_node.pipelines:
+                results[index] = result
+
+        # Steps may assign columns of their input, so every branch but one
+        # gets its own shallow copy, taken before any of them runs
+        for i, child in enumerate(tree_node.children.values()):
+            stack.append((child, df if i == 0 else df.copy(deep=False)))
+    return results
+
+
+def execute_pipeline_chunks(
+    pipeline: List[TransformStep],
+    chunks: Iterable[pd.DataFrame],
+    registry: TransformerRegistry,
+    allowed=None,
+) -> Iterator[pd.DataFrame]:
+    check_pipeline(pipeline, registry, allowed)
+
+    nodes = plan_pipeline(pipeline)
+    chunks = _check_chunks(nodes, chunks, registry)
+    for node in nodes:
+        if node.name == "topk":
+            chunks = _topk_chunks(node, chunks, registry)
+        elif node.name in LIMIT_STEPS:
+            chunks = _limit_chunks(node, chunks, registry)
+        elif is_row_local(node, registry):
+            chunks = _map_chunks(node, chunks, registry)
+        elif node.name == "sort":
+            chunks = _sort_chunks(node, chunks, registry)
+        else:
+            chunks = _collect_chunks(node, chunks, registry)
+    return chunks
+
+
+def _check_chunks(nodes: List[PlanNode], chunks, registry: TransformerRegistry):
+    checked = False
+    for chunk in chunks:
+        if not checked:
+            check_schema(nodes, frame_schema(chunk), registry)
+            checked = True
+        yield chunk
+
+
+def _map_chunks(node: PlanNode, chunks, registry: TransformerRegistry):
+    for chunk in chunks:
+        yield run_node(node, chunk, registry)
+
+
+def _limit_chunks(node: PlanNode, chunks, registry: TransformerRegistry):
+    # Stops reading once enough rows have been taken
+    taken = 0
+    for chunk in chunks:
+        chunk = run_node(node, chunk, registry)
+        chunk = chunk.iloc[: node.args["n"] - taken]
+        taken += len(chunk)
+        yield chunk
+        if taken >= node.args["n"]:
+            return
+
+
+def _topk_chunks(node: PlanNode, chunks, registry: TransformerRegistry):
+    # The best rows so far are kept ahead of each new chunk, so ties keep
+    # their input order
+    best = None
+    for chunk in chunks:
+        best = run_node(
+            node, chunk if best is None else pd.concat([best, chunk]), registry
+        )
+    if best is not None:
+        yield best
+
+
+def _sort_chunks(node: PlanNode, chunks, registry: TransformerRegistry):
+    transformer = registry.get(node.name)
+    by = node.args.get("by")
+
+    def validated():
+        for chunk in chunks:
+            try:
+                transformer.validate(chunk, node.args)
+            except Exception as e:
+                raise HTTPException(
+                    422, detail=f"Validation failed for '{node.name}': {str(e)}"
+                )
+            yield chunk
+
+    try:
+        yield from external_sort(
+            validated(),
+            by=[by] if isinstance(by, str) else by,
+            ascending=node.args.get("ascending", True),
+            run_rows=SORT_RUN_ROWS,
+            batch_rows=CHUNK_ROWS,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            422, detail=f"Simulation failed for '{node.name}': {str(e)}"
+        )
+
+
+def _collect_chunks(node: PlanNode, chunks, registry: TransformerRegistry):
+    # Steps that need every row at once see the whole frame
+    frames = list(chunks)
+    if frames:
+        yield run_node(node, pd.concat(frames), registry)
+
+
 def safe_dict(records):
     def fix_nan(value):
         if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
@@ -48,3 +398,339 @@ def safe_dict(records):
         return value
 
     return [{k: fix_nan(v) for k, v in row.items()} for row in records]
+
+
+def parse_body(body: bytes, model: Type[ModelT]) -> ModelT:
+    # Errors follow the format FastAPI uses for request validation
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(
+            422,
+            detail=[
+                {"type": "json_invalid", "loc": ["body", e.pos], "msg": e.msg}
+            ],
+        )
+
+    try:
+        return model.model_validate(payload)
+    except ValidationError as e:
+        errors = e.errors(include_url=False, include_context=False)
+        raise HTTPException(
+            422, detail=[{**error, "loc": ["body", *error["loc"]]} for error in errors]
+        )
+
+
+def parse_transform_body(
+    body: bytes, dataset_path: Optional[str] = None
+) -> Tuple[List[TransformStep], pd.DataFrame]:
+    request_data = parse_body(body, TransformRequest)
+    return request_data.pipeline, request_frame(request_data, dataset_path)
+
+
+def request_frame(
+    request_data: TransformInput, dataset_path: Optional[str] = None
+) -> pd.DataFrame:
+    data, columns = request_data.data, request_data.columns
+    if dataset_path is not None:
+        if data is not None or columns is not None:
+            raise HTTPException(
+                422, detail="'data' and 'columns' cannot be sent with a dataset"
+            )
+        return read_arrow_file(dataset_path)
+
+    if (data is None) == (columns is None):
+        raise HTTPException(
+            422, detail="Exactly one of 'data' or 'columns' must be provided"
+        )
+
+    try:
+        if columns is not None:
+            if not isinstance(columns, dict) or not all(
+                isinstance(values, list) for values in columns.values()
+            ):
+                raise ValueError("'columns' must map column names to lists of values")
+            return pd.DataFrame(columns)
+
+        if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+            raise ValueError("'data' must be a list of objects")
+        return pd.DataFrame(data)
+    except ValueError as e:
+        raise HTTPException(422, detail=str(e))
+
+
+def ingest_frame(
+    pipeline: List[TransformStep], df: pd.DataFrame, engine: str = DEFAULT_ENGINE
+) -> Tuple[pd.DataFrame, Dict[Any, Any]]:
+    # Other engines convert the frame on their own, so it is compacted for
+    # pandas only. Returns the frame and the dtypes to restore on the result.
+    if engine == DEFAULT_ENGINE:
+        df, dtypes = compact_frame(df, pipeline)
+    else:
+        dtypes = {}
+    check_budget("The input", df)
+    return df, dtypes
+
+
+def to_records(df: pd.DataFrame):
+    return safe_dict(df.to_dict(orient="records"))
+
+
+def json_records(df: pd.DataFrame) -> bytes:
+    # The rows as JSONResponse renders them, without the enclosing brackets
+    records = jsonable_encoder(to_records(df))
+    text = json.dumps(
+        records, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    )
+    return text[1:-1].encode()
+
+
+# Jobs submitted to the pipeline executor. They must stay module-level so the
+# process backend can pickle them. With `records=False` the final DataFrame is
+# returned for the caller to serialize.
+def transform_json(
+    body: bytes,
+    registry: TransformerRegistry,
+    allowed=None,
+    records: bool = True,
+    dataset_path: Optional[str] = None,
+    engine: str = DEFAULT_ENGINE,
+):
+    check_size("The request body", len(body))
+    with phase("ingest"):
+        pipeline, df = parse_transform_body(body, dataset_path)
+        df, dtypes = ingest_frame(pipeline, df, engine)
+    record_steps(step.name for step in pipeline)
+    df = execute_pipeline(pipeline, df, registry, allowed, engine=engine)
+    df = restore_dtypes(df, dtypes)
+    if not records:
+        return df
+    with phase("serialize"):
+        return to_records(df)
+
+
+def transform_batch(
+    body: bytes,
+    registry: TransformerRegistry,
+    allowed=None,
+    dataset_path: Optional[str] = None,
+):
+    request_data = parse_body(body, BatchTransformRequest)
+    if len(request_data.pipelines) > BATCH_MAX_PIPELINES:
+        raise HTTPException(
+            422, detail=f"At most {BATCH_MAX_PIPELINES} pipelines can be batched"
+        )
+    check_size("The request body", len(body))
+    with phase("ingest"):
+        df = request_frame(request_data, dataset_path)
+        check_budget("The input", df)
+    record_steps(step.name for steps in request_data.pipelines for step in steps)
+    schema = frame_schema(df)
+
+    # Pipelines with unknown, forbidden or mistyped steps fail on their own
+    results: Dict[int, Dict[str, Any]] = {}
+    pipelines = {}
+    for index, pipeline in enumerate(request_data.pipelines):
+        try:
+            check_pipeline(pipeline, registry, allowed)
+            check_schema(plan_pipeline(pipeline), schema, registry)
+            pipelines[index] = pipeline
+        except HTTPException as e:
+            results[index] = {
+                "error": {"status_code": e.status_code, "detail": e.detail}
+            }
+
+    results.update(execute_prefix_tree(prefix_tree(pipelines), df, registry))
+    return [results[index] for index in range(len(request_data.pipelines))]
+
+
+def transform_upload(
+    pipeline: List[TransformStep],
+    contents: bytes,
+    input_format: str,
+    registry: TransformerRegistry,
+    allowed=None,
+    records: bool = True,
+    engine: str = DEFAULT_ENGINE,
+    encoding: Optional[str] = None,
+):
+    with phase("ingest"):
+        pipeline, usecols = scan_upload(
+            pipeline, contents, input_format, registry, allowed, encoding
+        )
+        df = read_upload(contents, input_format, usecols, encoding)
+        df, dtypes = ingest_frame(pipeline, df, engine)
+    df = execute_pipeline(pipeline, df, registry, allowed, engine=engine)
+    df = restore_dtypes(df, dtypes)
+    if not records:
+        return df
+    with phase("serialize"):
+        return to_records(df)
+
+
+def scan_upload(
+    pipeline: List[TransformStep],
+    source: Union[str, bytes, BinaryIO],
+    input_format: str,
+    registry: TransformerRegistry,
+    allowed=None,
+    encoding: Optional[str] = None,
+) -> Tuple[List[TransformStep], Optional[List[Any]]]:
+    # The pipeline is checked against the CSV header before the file is
+    # parsed, and only the columns it needs are parsed. Returns the pipeline
+    # to run on them and the read_csv `usecols`.
+    if input_format != "csv":
+        return pipeline, None
+    columns = read_csv_header(source, encoding)
+    check_pipeline(pipeline, registry, allowed)
+    check_schema(plan_pipeline(pipeline), {col: None for col in columns}, registry)
+    scan = scan_pipeline(pipeline, columns, registry)
+    return scan.pipeline, scan.columns
+
+
+def store_upload(
+    source: Union[str, BinaryIO],
+    input_format: str,
+    path: str,
+    encoding: Optional[str] = None,
+):
+    # Written a chunk at a time, so the upload is never held in memory whole
+    chunks = iter_upload(source, input_format, CHUNK_ROWS, encoding=encoding)
+    with closing(chunks):
+        rows, columns = write_arrow_batches(chunks, path)
+    return {"rows": rows, "columns": columns}
+
+
+def store_lookup(
+    source: Union[str, BinaryIO],
+    input_format: str,
+    path: str,
+    key: List[str],
+    encoding: Optional[str] = None,
+):
+    df = read_upload(source, input_format, encoding=encoding)
+    # The index is built once here to reject keys that do not identify rows
+    try:
+        table = LookupTable(df, key)
+    except ValueError as e:
+        raise HTTPException(422, detail=str(e))
+    write_arrow_file(df, path, metadata=table.metadata())
+    return {"rows": len(df), "size_bytes": table.nbytes}
+
+
+def transform_upload_chunked(
+    pipeline: List[TransformStep],
+    source: Union[str, BinaryIO],
+    input_format: str,
+    registry: TransformerRegistry,
+    allowed,
+    encoding: Optional[str],
+    result_path: str,
+):
+    # Reading, transforming and serializing are interleaved chunk by chunk,
+    # so they are timed as one phase. The response body is written to
+    # `result_path` as it is produced instead of being held in memory. The
+    # caller creates the file, so a job still running after the caller gave
+    # up and removed it does not leave a new one behind.
+    with phase("chunked"), open(result_path, "r+b") as out:
+        out.write(b'{"result":[')
+        separator = b""
+        for chunk in iter_upload_chunked(
+            pipeline, source, input_format, registry, allowed, encoding
+        ):
+            if len(chunk):
+                out.write(separator + json_records(chunk))
+                separator = b","
+        out.write(b"]}")
+
+
+def iter_upload_chunked(
+    pipeline: List[TransformStep],
+    source: Union[str, BinaryIO],
+    input_format: str,
+    registry: TransformerRegistry,
+    allowed=None,
+    encoding: Optional[str] = None,
+) -> Iterator[pd.DataFrame]:
+    pipeline, usecols = scan_upload(
+        pipeline, source, input_format, registry, allowed, encoding
+    )
+    # The reader is closed as soon as the pipeline stops, not when a failed
+    # chunk's traceback is collected, by which time the upload may be closed
+    chunks = iter_upload(source, input_format, CHUNK_ROWS, usecols, encoding)
+    with closing(chunks):
+        yield from execute_pipeline_chunks(pipeline, chunks, registry, allowed)
+
+
+# Background jobs store their result as an Arrow file next to the job and
+# report progress through `progress_path`
+def transform_json_job(
+    body_path: str,
+    registry: TransformerRegistry,
+    allowed,
+    dataset_path: Optional[str],
+    result_path: str,
+    progress_path: str,
+):
+    check_size("The request body", os.path.getsize(body_path))
+    with open(body_path, "rb") as body:
+        pipeline, df = parse_transform_body(body.read(), dataset_path)
+    df, dtypes = ingest_frame(pipeline, df)
+    df = execute_pipeline(
+        pipeline, df, registry, allowed, ProgressReporter(progress_path)
+    )
+    df = restore_dtypes(df, dtypes)
+    with job_result(result_path, body_path) as path:
+        write_arrow_file(df, path)
+    return {"rows": len(df), "columns": [str(col) for col in df.columns]}
+
+
+def transform_upload_job(
+    pipeline: List[TransformStep],
+    input_path: str,
+    input_format: str,
+    chunked: bool,
+    registry: TransformerRegistry,
+    allowed,
+    result_path: str,
+    progress_path: str,
+    encoding: Optional[str] = None,
+):
+    progress = ProgressReporter(progress_path)
+    pipeline, usecols = scan_upload(
+        pipeline, input_path, input_format, registry, allowed, encoding
+    )
+    if not chunked:
+        check_size("The upload", upload_size(input_path, input_format, encoding))
+        df = read_upload(input_path, input_format, usecols, encoding)
+        df, dtypes = ingest_frame(pipeline, df)
+        df = execute_pipeline(pipeline, df, registry, allowed, progress)
+        df = restore_dtypes(df, dtypes)
+        with job_result(result_path, input_path) as path:
+            write_arrow_file(df, path)
+        return {"rows": len(df), "columns": [str(col) for col in df.columns]}
+
+    # Progress is the share of the upload read so far, compressed if it is
+    with open(input_path, "rb") as source:
+        size = os.fstat(source.fileno()).st_size or 1
+
+        def tracked(chunks):
+            for chunk in chunks:
+                yield chunk
+                progress(source.tell() / size)
+
+        chunks = iter_upload(source, input_format, CHUNK_ROWS, usecols, encoding)
+        chunks = execute_pipeline_chunks(pipeline, tracked(chunks), registry, allowed)
+        with job_result(result_path, input_path) as path:
+            rows, columns = write_arrow_batches(chunks, path)
+    return {"rows": rows, "columns": columns}
+
+
+async def spool_upload(file: UploadFile, path: Optional[str] = None) -> str:
+    # Copies an upload to a named file so another process can read it
+    with (
+        open(path, "wb") if path else tempfile.NamedTemporaryFile(delete=False)
+    ) as spooled:
+        while block := await file.read(SPOOL_BLOCK_SIZE):
+            spooled.write(block)
+    return spooled.name
@@ -9,3 +9,83 @@ class InvalidCredentials(HTTPException):
 class InsufficientPermission(HTTPException):
     def __init__(self, detail: str = "Insufficient permission"):
         super().__init__(status_code=status.HTTP_403_FORBIDDEN, detail=detail)
+
+
+class ClientDisconnected(HTTPException):
+    def __init__(self, detail: str = "Client disconnected"):
+        super().__init__(status_code=499, detail=detail)
+
+
+class PipelineTimeout(HTTPException):
+    def __init__(self, detail: str = "Pipeline timed out"):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=detail)
+
+
+class DatasetNotFound(HTTPException):
+    def __init__(self, detail: str = "Dataset not found"):
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+
+
+class LookupNotFound(HTTPException):
+    def __init__(self, detail: str = "Lookup table not found"):
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+
+
+class QuotaExceeded(HTTPException):
+    def __init__(self, detail: str = "Dataset quota exceeded"):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail
+        )
+
+
+class PayloadTooLarge(HTTPException):
+    def __init__(self, detail: str = "Request body too large"):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail
+        )
+
+
+class MemoryBudgetExceeded(HTTPException):
+    def __init__(self, detail: str = "Memory budget exceeded"):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=detail
+        )
+
+
+class QueueFull(HTTPException):
+    def __init__(self, retry_after: int, detail: str = "Job queue is full"):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class RateLimited(HTTPException):
+    def __init__(self, retry_after: int, detail: str = "Rate limit exceeded"):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class Overloaded(HTTPException):
+    def __init__(self, retry_after: int = 1, detail: str = "Server is busy"):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=detail,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class JobNotFound(HTTPException):
+    def __init__(self, detail: str = "Job not found"):
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+
+
+class UnsupportedEncoding(HTTPException):
+    def __init__(self, detail: str = "Unsupported Content-Encoding"):
+        super().__init__(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=detail
+        )
@@ -0,0 +1,38 @@
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from jose import jwt
+
+from .cache import MISSING, TTLCache
+from .config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    SECRET_KEY,
+    TOKEN_CACHE_SIZE,
+)
+
+# Claims of tokens that were verified, by token, until the token expires.
+# Tokens that fail verification are not cached, so made-up tokens cannot push
+# out valid ones.
+token_cache = TTLCache(TOKEN_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def create_access_token(username: str) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode({"sub": username, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_token(token: str) -> Dict[str, Any]:
+    # Raises JWTError for invalid and expired tokens
+    if (cached := token_cache.get(token)) is not MISSING:
+        return cached
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    expires = claims.get("exp")
+    if isinstance(expires, (int, float)):
+        ttl = min(expires - time.time(), token_cache.ttl)
+        if ttl > 0:
+            token_cache.set(token, claims, ttl)
+    else:
+        token_cache.set(token, claims)
+    return claims
@@ -1,6 +1,18 @@
-from typing import Callable, Dict, List, Any, Optional
-import pandas as pd
-from pandas import DataFrame
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
+
+from .lazy import np, pd
+from .predicates import compile_condition, evaluate_mask
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+DEFAULT_ENGINE = "pandas"
+
+# Column names mapped to their dtypes, in column order. A dtype of None means
+# the column exists but its dtype is only known once the data is read.
+Schema = Dict[Any, Any]
 
 
 class Transformer:
@@ -9,12 +21,46 @@ class Transformer:
         func: Callable[..., DataFrame],
         required_args: Optional[List[str]] = None,
         required_column_types_by_kwarg: Optional[Dict[str, str]] = None,
+        row_local: bool = False,
+        output_schema: Optional[Callable[..., Optional[Schema]]] = None,
+        parallel: Union[bool, Callable[..., bool]] = False,
     ):
         self.func = func
         self.required_args = required_args or []
         self.required_column_types_by_kwarg = required_column_types_by_kwarg or {}
+        # Row-local transformers give the same result when run on any split of
+        # the rows, so they can be applied chunk by chunk.
+        self.row_local = row_local
+        # Maps the input schema and kwargs to the output schema without
+        # touching data. Transformers without one end static checking.
+        self.schema_func = output_schema
+        # Whether the work per row outweighs handing the rows to another
+        # process, either always or depending on the kwargs. Pipelines of
+        # row-local steps with such a step can run on row partitions in
+        # parallel.
+        self.parallel = parallel
 
     def validate(self, df: DataFrame, kwargs: Dict[str, Any]):
+        self._validate(df.columns, lambda col: df[col].dtype, kwargs)
+
+    def validate_schema(self, schema: Schema, kwargs: Dict[str, Any]):
+        self._validate(schema, schema.get, kwargs)
+
+    def output_schema(
+        self, schema: Schema, kwargs: Dict[str, Any]
+    ) -> Optional[Schema]:
+        if self.schema_func is None:
+            return None
+        return self.schema_func(schema, **kwargs)
+
+    def runs_parallel(self, kwargs: Dict[str, Any]) -> bool:
+        if callable(self.parallel):
+            return self.parallel(**kwargs)
+        return self.parallel
+
+    def _validate(
+        self, columns, get_dtype: Callable[[Any], Any], kwargs: Dict[str, Any]
+    ):
         # Validate required keyword arguments
         for arg in self.required_args:
             if arg not in kwargs:
@@ -23,14 +69,16 @@ class Transformer:
         # Validate columns referenced by keyword arguments
         for kwarg_name, expected_type in self.required_column_types_by_kwarg.items():
             col_name = kwargs.get(kwarg_name)
-            if col_name not in df.columns:
+            if col_name not in columns:
                 raise ValueError(
                     f"Missing column '{col_name}' in DataFrame (from kwarg '{kwarg_name}')"
                 )
 
-            actual_dtype = df[col_name].dtype
+            actual_dtype = get_dtype(col_name)
+            if actual_dtype is None:
+                continue
             if expected_type == "string":
-                if not pd.api.types.is_string_dtype(actual_dtype):
+                if not is_string_dtype(actual_dtype):
                     raise TypeError(
                         f"Column '{col_name}' must be of type string, got '{actual_dtype}'"
                     )
@@ -61,23 +109,127 @@ class Transformer:
         return ret
 
 
+def is_string_dtype(dtype) -> bool:
+    # Categoricals of strings hold the same values as a string column
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    return pd.api.types.is_string_dtype(dtype)
+
+
+class LazyTransformer(Transformer):
+    # A transformer whose functions are imported on first use. `load` returns
+    # the module that defines them and the functions are given by name. Its
+    # metadata is known up front, so listing and validating it imports
+    # nothing.
+    def __init__(
+        self,
+        load: Callable[[], Any],
+        func: str,
+        required_args: Optional[List[str]] = None,
+        required_column_types_by_kwarg: Optional[Dict[str, str]] = None,
+        row_local: bool = False,
+        output_schema: Optional[str] = None,
+        parallel: Union[bool, str] = False,
+    ):
+        super().__init__(
+            func=None,
+            required_args=required_args,
+            required_column_types_by_kwarg=required_column_types_by_kwarg,
+            row_local=row_local,
+            parallel=parallel if isinstance(parallel, bool) else False,
+        )
+        self.load = load
+        self.names = (func, output_schema, parallel)
+        self.loaded = False
+
+    def _load(self):
+        if self.loaded:
+            return
+        module = self.load()
+        func, output_schema, parallel = self.names
+        self.func = getattr(module, func)
+        self.schema_func = getattr(module, output_schema) if output_schema else None
+        if isinstance(parallel, str):
+            self.parallel = getattr(module, parallel)
+        self.loaded = True
+
+    def output_schema(
+        self, schema: Schema, kwargs: Dict[str, Any]
+    ) -> Optional[Schema]:
+        if self.names[1] is None:
+            return None
+        self._load()
+        return super().output_schema(schema, kwargs)
+
+    def runs_parallel(self, kwargs: Dict[str, Any]) -> bool:
+        if isinstance(self.names[2], str):
+            self._load()
+        return super().runs_parallel(kwargs)
+
+    def run(self, df: DataFrame, **kwargs) -> DataFrame:
+        self._load()
+        return super().run(df, **kwargs)
+
+    def __getstate__(self):
+        # Sent to worker processes unloaded, as they import the module on
+        # their own, which may not be importable by name
+        state = dict(self.__dict__, func=None, schema_func=None, loaded=False)
+        if isinstance(self.names[2], str):
+            state["parallel"] = False
+        return state
+
+
 class TransformerRegistry:
     def __init__(self):
         self.registry: Dict[str, Transformer] = {}
+        # Implementations of registered transformers for other engines, by
+        # engine name. They work on the engine's frames and are not validated
+        # on their own: pipelines are checked against the pandas transformers.
+        self.engines: Dict[str, Dict[str, Transformer]] = {}
 
-    def register(self, name: str, transformer: Transformer):
-        self.registry[name] = transformer
+    def register(
+        self, name: str, transformer: Transformer, engine: str = DEFAULT_ENGINE
+    ):
+        if engine == DEFAULT_ENGINE:
+            self.registry[name] = transformer
+        else:
+            self.engines.setdefault(engine, {})[name] = transformer
 
-    def get(self, name: str) -> Optional[Transformer]:
-        return self.registry.get(name)
+    def get(self, name: str, engine: str = DEFAULT_ENGINE) -> Optional[Transformer]:
+        if engine == DEFAULT_ENGINE:
+            return self.registry.get(name)
+        return self.engines.get(engine, {}).get(name)
 
     def list_available(self) -> List[str]:
         return list(self.registry.keys())
 
+    def list_engines(self, name: Optional[str] = None) -> List[str]:
+        engines = [DEFAULT_ENGINE, *self.engines]
+        if name is None:
+            return engines
+        return [engine for engine in engines if self.get(name, engine) is not None]
+
 
 # Transformers functions
 def filter_rows(df: DataFrame, **kwargs) -> DataFrame:
-    return df.query(kwargs["condition"])
+    condition = kwargs["condition"]
+    expr = compile_condition(condition) if isinstance(condition, str) else None
+    mask = evaluate_mask(expr, df) if expr is not None else None
+    if mask is None:
+        return df.query(condition)
+    # Same selection as DataFrame.query makes with the mask
+    try:
+        return df.loc[mask]
+    except ValueError:
+        return df[mask]
+
+
+def filter_is_slow(**kwargs) -> bool:
+    # Conditions left to DataFrame.query and string predicates are evaluated
+    # row by row rather than vectorized
+    condition = kwargs.get("condition")
+    expr = compile_condition(condition) if isinstance(condition, str) else None
+    return expr is None or expr.strings
 
 
 def rename_column(df: DataFrame, **kwargs) -> DataFrame:
@@ -85,7 +237,9 @@ def rename_column(df: DataFrame, **kwargs) -> DataFrame:
 
 
 def uppercase_column(df: DataFrame, **kwargs) -> DataFrame:
+    # The column is set on a shallow copy so the input frame is left as it was
     col = kwargs["column"]
+    df = df.copy(deep=False)
     df[col] = df[col].str.upper()
     return df
 
@@ -105,13 +259,146 @@ def sort_dataframe(df: pd.DataFrame, **kwargs) -> pd.DataFrame:
     if isinstance(by, str):
         by = [by]
 
-    return df.sort_values(by=by, ascending=ascending)
+    return df.sort_values(by=by, ascending=ascending, kind="stable")
+
+
+def row_count(value: Any, name: str) -> int:
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError(f"'{name}' must be a non-negative integer")
+    return value
+
+
+def limit_rows(df: DataFrame, **kwargs) -> DataFrame:
+    return df.head(row_count(kwargs["n"], "n"))
+
+
+def topk_rows(df: DataFrame, **kwargs) -> DataFrame:
+    # Same rows as a stable sort followed by a limit. When the first key is
+    # numeric, the rows that can be among the first n are selected in linear
+    # time: those on the right side of the n-th value, ties included. Only
+    # they are sorted on all keys.
+    by = kwargs["by"]
+    n = row_count(kwargs["n"], "n")
+    ascending = kwargs.get("ascending", True)
+
+    keys = by if isinstance(by, list) else [by]
+    if keys and n < len(df):
+        first = df[keys[0]]
+        if (
+            isinstance(first, pd.Series)
+            and isinstance(first.dtype, np.dtype)
+            and first.dtype.kind in "iuf"
+        ):
+            values = first.to_numpy()
+            valid = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+            first_ascending = (
+                ascending[0] if isinstance(ascending, list) and ascending else ascending
+            )
+            if n == 0:
+                df = df.iloc[:0]
+            elif n < len(valid):
+                k = n - 1 if first_ascending else len(valid) - n
+                threshold = np.partition(valid, k)[k]
+                df = df[values <= threshold if first_ascending else values >= threshold]
+
+    return sort_dataframe(df, by=by, ascending=ascending).head(n)
+
+
+def sample_rows(df: DataFrame, **kwargs) -> DataFrame:
+    # Seeded, so the same pipeline always returns the same rows
+    n = kwargs.get("n")
+    frac = kwargs.get("frac")
+    seed = row_count(kwargs.get("seed", 0), "seed")
+    if (n is None) == (frac is None):
+        raise ValueError("Exactly one of 'n' or 'frac' must be given")
+    if n is not None:
+        return df.sample(n=min(row_count(n, "n"), len(df)), random_state=seed)
+    if (
+        not isinstance(frac, (int, float))
+        or isinstance(frac, bool)
+        or not 0 <= frac <= 1
+    ):
+        raise ValueError("'frac' must be a number between 0 and 1")
+    return df.sample(frac=frac, random_state=seed)
+
+
+# Output schemas
+def frame_schema(df: DataFrame) -> Optional[Schema]:
+    if not df.columns.is_unique:
+        return None
+    return dict(zip(df.columns, df.dtypes))
+
+
+def empty_frame(schema: Schema) -> DataFrame:
+    return pd.DataFrame(
+        {
+            col: pd.Series(dtype=object if dtype is None else dtype)
+            for col, dtype in schema.items()
+        }
+    )
+
+
+def same_schema(schema: Schema, **kwargs) -> Schema:
+    return dict(schema)
+
+
+# Steps that only move labels are run on an empty frame, which raises the
+# same errors as a run on the data would
+def rename_schema(schema: Schema, **kwargs) -> Optional[Schema]:
+    out = frame_schema(rename_column(empty_frame(schema), **kwargs))
+    if out is None:
+        return None
+    return {
+        col: schema[kwargs["from"] if col == kwargs["to"] else col] for col in out
+    }
+
+
+def drop_schema(schema: Schema, **kwargs) -> Schema:
+    out = drop_columns(empty_frame(schema), **kwargs)
+    return {col: schema[col] for col in out.columns}
+
+
+def sort_schema(schema: Schema, **kwargs) -> Schema:
+    sort_dataframe(empty_frame(schema), **kwargs)
+    return dict(schema)
+
+
+# Steps that only select rows are run on an empty frame to check their args
+def limit_schema(schema: Schema, **kwargs) -> Schema:
+    limit_rows(empty_frame(schema), **kwargs)
+    return dict(schema)
+
+
+def topk_schema(schema: Schema, **kwargs) -> Schema:
+    topk_rows(empty_frame(schema), **kwargs)
+    return dict(schema)
+
+
+def sample_schema(schema: Schema, **kwargs) -> Schema:
+    sample_rows(empty_frame(schema), **kwargs)
+    return dict(schema)
+
+
+def fillna_schema(schema: Schema, **kwargs) -> Schema:
+    # The filled dtype depends on whether the column holds missing values
+    schema = dict(schema)
+    col = kwargs["column"]
+    if col in schema and schema[col] != object:
+        schema[col] = None
+    return schema
 
 
 # Register built-in transformers
 def register_builtin_transformers(registry: TransformerRegistry):
     registry.register(
-        "filter", Transformer(func=filter_rows, required_args=["condition"])
+        "filter",
+        Transformer(
+            func=filter_rows,
+            required_args=["condition"],
+            row_local=True,
+            output_schema=same_schema,
+            parallel=filter_is_slow,
+        ),
     )
 
     registry.register(
@@ -120,6 +407,8 @@ def register_builtin_transformers(registry: TransformerRegistry):
             func=rename_column,
             required_args=["from", "to"],
             required_column_types_by_kwarg={"from": "string"},
+            row_local=True,
+            output_schema=rename_schema,
         ),
     )
 
@@ -129,16 +418,29 @@ def register_builtin_transformers(registry: TransformerRegistry):
             func=uppercase_column,
             required_args=["column"],
             required_column_types_by_kwarg={"column": "string"},
+            row_local=True,
+            output_schema=same_schema,
+            parallel=True,
         ),
     )
 
-    registry.register("drop", Transformer(func=drop_columns, required_args=["columns"]))
+    registry.register(
+        "drop",
+        Transformer(
+            func=drop_columns,
+            required_args=["columns"],
+            row_local=True,
+            output_schema=drop_schema,
+        ),
+    )
 
     registry.register(
         "fillna",
         Transformer(
             func=fillna_column,
             required_args=["column", "value"],
+            row_local=True,
+            output_schema=fillna_schema,
         ),
     )
 
@@ -147,5 +449,30 @@ def register_builtin_transformers(registry: TransformerRegistry):
         Transformer(
             func=sort_dataframe,
             required_args=["by", "ascending"],
+            output_schema=sort_schema,
         ),
     )
+
+    for name in ("limit", "head"):
+        registry.register(
+            name,
+            Transformer(
+                func=limit_rows,
+                required_args=["n"],
+                output_schema=limit_schema,
+            ),
+        )
+
+    registry.register(
+        "topk",
+        Transformer(
+            func=topk_rows,
+            required_args=["by", "n"],
+            output_schema=topk_schema,
+        ),
+    )
+
+    registry.register(
+        "sample",
+        Transformer(func=sample_rows, output_schema=sample_schema),
+    )
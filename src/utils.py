@@ -7,3 +7,23 @@ def get_db(request: Request):
 
 def get_registry(request: Request):
     return request.app.state.registry
+
+
+def get_executor(request: Request):
+    return request.app.state.executor
+
+
+def get_result_cache(request: Request):
+    return request.app.state.result_cache
+
+
+def get_job_queue(request: Request):
+    return request.app.state.job_queue
+
+
+def get_admission(request: Request):
+    return request.app.state.admission
+
+
+def get_password_hasher(request: Request):
+    return request.app.state.password_hasher
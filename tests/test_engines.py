@@ -0,0 +1,86 @@
+import pytest
+
+pytest.importorskip("polars")
+
+import numpy as np
+import pandas as pd
+
+from src.engines import POLARS, register_engine_transformers, run_engine
+from src.models import TransformStep
+from src.routes.utils import execute_pipeline
+from src.transformer import (
+    DEFAULT_ENGINE,
+    TransformerRegistry,
+    register_builtin_transformers,
+)
+
+# Builtin pipelines the polars engine runs in full, so each result really
+# comes from polars rather than from the fallback to pandas
+PIPELINES = {
+    "filter": [{"name": "filter", "args": {"condition": "a > 1 and b < 3"}}],
+    "filter_in": [{"name": "filter", "args": {"condition": "t in ['p']"}}],
+    "filter_null": [{"name": "filter", "args": {"condition": "s.notnull()"}}],
+    "rename": [{"name": "rename", "args": {"from": "s", "to": "z"}}],
+    "uppercase": [{"name": "uppercase", "args": {"column": "s"}}],
+    "drop": [{"name": "drop", "args": {"columns": ["b", "t"]}}],
+    "fillna_float": [{"name": "fillna", "args": {"column": "b", "value": 0.5}}],
+    "fillna_string": [{"name": "fillna", "args": {"column": "s", "value": "n"}}],
+    "sort": [{"name": "sort", "args": {"by": ["t", "b"], "ascending": [True, False]}}],
+    "limit": [{"name": "limit", "args": {"n": 7}}],
+    "head": [{"name": "head", "args": {"n": 0}}],
+    "topk": [{"name": "topk", "args": {"by": "b", "n": 5, "ascending": False}}],
+    "combined": [
+        {"name": "filter", "args": {"condition": "a >= 0"}},
+        {"name": "fillna", "args": {"column": "s", "value": "none"}},
+        {"name": "uppercase", "args": {"column": "s"}},
+        {"name": "rename", "args": {"from": "s", "to": "label"}},
+        {"name": "sort", "args": {"by": "a", "ascending": False}},
+        {"name": "drop", "args": {"columns": ["t"]}},
+        {"name": "limit", "args": {"n": 20}},
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def registry():
+    registry = TransformerRegistry()
+    register_builtin_transformers(registry)
+    register_engine_transformers(registry)
+    return registry
+
+
+def make_frame(rows=200):
+    rng = np.random.default_rng(0)
+    b = rng.choice([1.5, -2.0, 0.0, 3.0, 4.25], rows)
+    b[rng.random(rows) < 0.1] = np.nan
+    return pd.DataFrame(
+        {
+            "a": rng.integers(-1, 4, rows),
+            "b": b,
+            "s": rng.choice(["x", "Ab", "bb", None, "cx"], rows),
+            "t": rng.choice(["p", "q"], rows),
+        }
+    )
+
+
+@pytest.mark.parametrize("name", PIPELINES)
+def test_polars_matches_pandas(registry, name):
+    pipeline = [TransformStep(**step) for step in PIPELINES[name]]
+
+    result = run_engine(POLARS, pipeline, make_frame(), registry)
+    assert result is not None, "the pipeline fell back to pandas"
+    expected = execute_pipeline(pipeline, make_frame(), registry, engine=DEFAULT_ENGINE)
+
+    # Results are returned as records, so the index does not matter
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True), expected.reset_index(drop=True)
+    )
+
+
+def test_execute_pipeline_uses_polars(registry):
+    pipeline = [TransformStep(**step) for step in PIPELINES["combined"]]
+    result = execute_pipeline(pipeline, make_frame(), registry, engine=POLARS)
+    expected = execute_pipeline(pipeline, make_frame(), registry, engine=DEFAULT_ENGINE)
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True), expected.reset_index(drop=True)
+    )
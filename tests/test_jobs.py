@@ -0,0 +1,324 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from src import jobs
+from src.executor import PipelineExecutor
+from src.jobs import JobQueue, MemoryJobStore, QueuedJob, job_path, job_result
+from src.models import Job, JobStatus
+from src.status import QueueFull
+
+
+@pytest.fixture(autouse=True)
+def job_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_queue(store=None, **kwargs):
+    settings = dict(
+        workers=1,
+        max_queued=10,
+        max_queued_per_user=10,
+        max_running_per_user=2,
+        timeout=None,
+        result_ttl=60,
+    )
+    settings.update(kwargs)
+    return JobQueue(
+        store=store or MemoryJobStore(),
+        executor=PipelineExecutor("thread", max_workers=4),
+        **settings,
+    )
+
+
+def make_job(func, *args, lane="user", owner="u1"):
+    job = Job(
+        job_id=uuid.uuid4().hex,
+        owner=owner,
+        lane=lane,
+        created_at=datetime.now(timezone.utc),
+    )
+    return QueuedJob(job, owner, func, args)
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not await condition():
+        assert time.monotonic() < deadline, "timed out waiting for the queue"
+        await asyncio.sleep(0.01)
+
+
+async def wait_for_status(queue, job_id, *statuses):
+    async def reached():
+        job = await queue.store.get(job_id)
+        return job is not None and job.status in statuses
+
+    await wait_for(reached)
+    return await queue.store.get(job_id)
+
+
+def write_file(path, data=b"data"):
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def gate():
+    # A job that runs until the returned event is set
+    event = threading.Event()
+
+    def blocked():
+        event.wait(5)
+        return {}
+
+    return event, blocked
+
+
+def test_job_result_is_kept_and_input_removed():
+    async def run():
+        queue = make_queue()
+        await queue.start()
+        queued_job = make_job(lambda: {"rows": 3, "columns": ["a"]})
+        write_file(job_path(queued_job.job.job_id, "input"))
+        await queue.submit(queued_job)
+
+        job = await wait_for_status(queue, queued_job.job.job_id, JobStatus.succeeded)
+        await queue.stop()
+        assert (job.rows, job.columns, job.progress) == (3, ["a"], 1.0)
+        assert job.expires_at is not None
+        assert not os.path.exists(job_path(job.job_id, "input"))
+
+    asyncio.run(run())
+
+
+def test_lanes_run_in_priority_order():
+    async def run():
+        queue = make_queue()
+        await queue.start()
+        event, blocked = gate()
+        blocker = make_job(blocked, owner="blocker")
+        await queue.submit(blocker)
+        await wait_for_status(queue, blocker.job.job_id, JobStatus.running)
+
+        order = []
+        submitted = []
+        for lane in ("anonymous", "user", "admin", "user"):
+            queued_job = make_job(
+                lambda lane=lane: order.append(lane) or {}, lane=lane, owner=lane
+            )
+            submitted.append(queued_job.job.job_id)
+            await queue.submit(queued_job)
+        assert queue.position(submitted[2]) == 0
+        assert queue.position(submitted[0]) == 3
+
+        event.set()
+        for job_id in submitted:
+            await wait_for_status(queue, job_id, JobStatus.succeeded)
+        await queue.stop()
+        assert order == ["admin", "user", "user", "anonymous"]
+
+    asyncio.run(run())
+
+
+def test_running_jobs_are_capped_per_owner():
+    async def run():
+        queue = make_queue(workers=3, max_running_per_user=1)
+        await queue.start()
+        event, blocked = gate()
+        first, second = make_job(blocked), make_job(blocked)
+        other = make_job(blocked, owner="u2")
+        for queued_job in (first, second, other):
+            await queue.submit(queued_job)
+
+        await wait_for_status(queue, first.job.job_id, JobStatus.running)
+        await wait_for_status(queue, other.job.job_id, JobStatus.running)
+        await asyncio.sleep(0.05)
+        assert (await queue.store.get(second.job.job_id)).status == JobStatus.queued
+
+        event.set()
+        await wait_for_status(queue, second.job.job_id, JobStatus.succeeded)
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_queue_caps_reject_jobs():
+    async def run():
+        queue = make_queue(max_queued=3, max_queued_per_user=2)
+        for owner in ("u1", "u1", "u2"):
+            await queue.submit(make_job(lambda: {}, owner=owner))
+
+        with pytest.raises(QueueFull) as error:
+            queue.check_capacity("u3")
+        assert error.value.detail == "Job queue is full"
+        assert int(error.value.headers["Retry-After"]) >= 1
+
+        queue.max_queued = 10
+        with pytest.raises(QueueFull) as error:
+            await queue.submit(make_job(lambda: {}, owner="u1"))
+        assert error.value.detail == "Too many queued jobs"
+        assert queue.queued() == 3
+
+    asyncio.run(run())
+
+
+def test_cancel_removes_a_queued_job():
+    async def run():
+        queue = make_queue()
+        queued_job = make_job(lambda: {})
+        write_file(job_path(queued_job.job.job_id, "input"))
+        await queue.submit(queued_job)
+
+        assert await queue.cancel(queued_job.job.job_id)
+        assert not await queue.cancel(queued_job.job.job_id)
+        job = await queue.store.get(queued_job.job.job_id)
+        assert job.status == JobStatus.cancelled
+        assert queue.queued() == 0 and queue.queued_by_owner["u1"] == 0
+        assert not os.path.exists(job_path(job.job_id, "input"))
+
+    asyncio.run(run())
+
+
+def test_start_fails_jobs_interrupted_by_a_restart():
+    async def run():
+        store = MemoryJobStore()
+        now = datetime.now(timezone.utc)
+        for job_id, status in (
+            ("queued", JobStatus.queued),
+            ("done", JobStatus.succeeded),
+        ):
+            await store.create(
+                Job(job_id=job_id, lane="user", status=status, created_at=now)
+            )
+            write_file(job_path(job_id, "input"))
+
+        queue = make_queue(store)
+        await queue.start()
+        await queue.stop()
+        job = await store.get("queued")
+        assert job.status == JobStatus.failed
+        assert job.error["status_code"] == 503
+        assert not os.path.exists(job_path("queued", "input"))
+        assert (await store.get("done")).status == JobStatus.succeeded
+        assert os.path.exists(job_path("done", "input"))
+
+    asyncio.run(run())
+
+
+def test_purge_expired_deletes_jobs_and_files():
+    async def run():
+        store = MemoryJobStore()
+        now = datetime.now(timezone.utc)
+        for job_id, expires_at in (
+            ("old", now - timedelta(seconds=1)),
+            ("new", now + timedelta(hours=1)),
+        ):
+            await store.create(
+                Job(
+                    job_id=job_id,
+                    lane="user",
+                    status=JobStatus.succeeded,
+                    created_at=now,
+                    expires_at=expires_at,
+                )
+            )
+            write_file(job_path(job_id, "arrow"))
+
+        await make_queue(store).purge_expired()
+        assert await store.get("old") is None
+        assert not os.path.exists(job_path("old", "arrow"))
+        assert await store.get("new") is not None
+        assert os.path.exists(job_path("new", "arrow"))
+
+    asyncio.run(run())
+
+
+def test_failed_jobs_report_their_error():
+    def invalid():
+        raise HTTPException(422, detail="Invalid pipeline")
+
+    def broken():
+        raise RuntimeError("boom")
+
+    async def run():
+        queue = make_queue()
+        await queue.start()
+        first, second = make_job(invalid), make_job(broken)
+        write_file(job_path(second.job.job_id, "arrow"))
+        await queue.submit(first)
+        await queue.submit(second)
+
+        job = await wait_for_status(queue, first.job.job_id, JobStatus.failed)
+        assert job.error == {"status_code": 422, "detail": "Invalid pipeline"}
+        job = await wait_for_status(queue, second.job.job_id, JobStatus.failed)
+        assert job.error == {"status_code": 500, "detail": "Job failed"}
+        assert not os.path.exists(job_path(second.job.job_id, "arrow"))
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_timed_out_job_leaves_no_result():
+    finished = threading.Event()
+
+    def slow(result_path, input_path):
+        time.sleep(0.3)
+        with job_result(result_path, input_path) as path:
+            write_file(path)
+        finished.set()
+        return {}
+
+    async def run():
+        queue = make_queue(timeout=0.05)
+        await queue.start()
+        job_id = uuid.uuid4().hex
+        input_path = job_path(job_id, "input")
+        result_path = job_path(job_id, "arrow")
+        write_file(input_path)
+        queued_job = make_job(slow, result_path, input_path)
+        queued_job.job.job_id = job_id
+        await queue.submit(queued_job)
+
+        job = await wait_for_status(queue, job_id, JobStatus.failed)
+        assert job.error["status_code"] == 504
+        await asyncio.get_running_loop().run_in_executor(None, finished.wait, 5)
+        await queue.stop()
+        assert not os.path.exists(result_path)
+        assert not os.path.exists(f"{result_path}.tmp")
+
+    asyncio.run(run())
+
+
+class FlakyStore(MemoryJobStore):
+    # Fails the first update, as a store that is briefly unreachable would
+    def __init__(self):
+        super().__init__()
+        self.failures = 1
+
+    async def update(self, job_id, **fields):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("store unreachable")
+        await super().update(job_id, **fields)
+
+
+def test_worker_survives_store_errors():
+    async def run():
+        queue = make_queue(FlakyStore())
+        await queue.start()
+        first, second = make_job(lambda: {}), make_job(lambda: {})
+        await queue.submit(first)
+        await queue.submit(second)
+
+        await wait_for_status(queue, second.job.job_id, JobStatus.succeeded)
+        assert queue.running_by_owner["u1"] == 0
+        assert not any(task.done() for task in queue.tasks)
+        await queue.stop()
+
+    asyncio.run(run())